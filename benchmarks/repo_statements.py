@@ -0,0 +1,66 @@
+"""
+Микробенчмарк подготовки запросов filter() в репозиториях.
+
+Сравнивает построение SELECT на каждый вызов (как было раньше) с готовым выражением из реестра
+BaseAsyncDBRepo._filter_statement. Запросы выполняются на SQLite в памяти, чтобы в замер попадала работа
+SQLAlchemy на стороне Python, а не сеть.
+
+    python -m benchmarks.repo_statements
+"""
+import timeit
+
+from sqlalchemy import create_engine, select
+
+from feedbackbot.core.db import Base, FilterShape
+from feedbackbot.topics.models import Message
+from feedbackbot.topics.repos import MessageRepo
+from feedbackbot.users.models import UserLog
+from feedbackbot.users.repos import UserLogRepo
+
+NUMBER = 20000
+
+
+def rebuilt(model_class, ordering=None, **kwargs):
+    criteria = [getattr(model_class, name) == value for name, value in kwargs.items() if value is not None]
+    q = select(model_class).where(*criteria)
+    if ordering:
+        q = q.order_by(getattr(getattr(model_class, ordering[0]), ordering[1])())
+    return q, {}
+
+
+def registry(repo_class, ordering=None, **kwargs):
+    params = {name: value for name, value in kwargs.items() if value is not None}
+    return repo_class._filter_statement(FilterShape(tuple(params), ordering)), params
+
+
+def main():
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+
+    cases = {
+        'message by bot_message_id': (Message, MessageRepo, {'bot_message_id': 1}),
+        'user logs by user+field': (UserLog, UserLogRepo, {'user_id': 1, 'field': 'full_name'}),
+    }
+
+    with engine.connect() as con:
+        for name, (model_class, repo_class, kwargs) in cases.items():
+            def run_rebuilt():
+                con.execute(*rebuilt(model_class, **kwargs)).all()
+
+            def run_registry():
+                con.execute(*registry(repo_class, **kwargs)).all()
+
+            # прогрев кэша компиляции
+            run_rebuilt()
+            run_registry()
+
+            t_rebuilt = min(timeit.repeat(run_rebuilt, number=NUMBER, repeat=3)) / NUMBER * 1e6
+            t_registry = min(timeit.repeat(run_registry, number=NUMBER, repeat=3)) / NUMBER * 1e6
+            print(
+                f'{name:30} rebuilt: {t_rebuilt:7.1f} us/query   registry: {t_registry:7.1f} us/query   '
+                f'speedup: {t_rebuilt / t_registry:.2f}x'
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,14 @@
 #!/bin/sh
 
-echo "Waiting for postgres..."
+# встроенной SQLite не нужен отдельный сервер БД
+if [ "$DB_BACKEND" != "sqlite" ]; then
+  echo "Waiting for postgres..."
 
-while ! nc -z $DB_HOST $DB_PORT; do
-  sleep 0.1
-done
+  while ! nc -z $DB_HOST $DB_PORT; do
+    sleep 0.1
+  done
 
-echo "PostgreSQL started"
+  echo "PostgreSQL started"
+fi
 
 exec "$@"
\ No newline at end of file
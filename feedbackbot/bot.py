@@ -1,3 +1,4 @@
+import asyncio
 import logging.config
 import warnings
 
@@ -5,12 +6,17 @@ import sentry_sdk
 from ptbcontrib.roles import setup_roles
 from sentry_sdk.integrations.asyncio import AsyncioIntegration
 from telegram import BotCommandScopeChat, BotCommandScopeChatAdministrators
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, AIORateLimiter
+from telegram.ext import Application, CommandHandler, MessageHandler, filters
 
 from feedbackbot import settings
+from feedbackbot.broadcasts.handlers import BroadcastCommandHandler
 from feedbackbot.core.di import DIAsync
-from feedbackbot.core.db import Base
+from feedbackbot.core import migrations
 from feedbackbot.core.enums import Role
+from feedbackbot.core.media_groups import get_media_group_collector
+from feedbackbot.core.metrics import metrics
+from feedbackbot.core.ratelimit import PriorityRateLimiter
+from feedbackbot.core.updates import KeyedUpdateProcessor
 from feedbackbot.common.handlers import StartCommandHandler, HelpCommandHandler
 from feedbackbot.users.handlers import BanCommandHandler, UnbanCommandHandler, UserLogCommandHandler
 from feedbackbot.topics.handlers import DeleteCommandHandler, DeleteHistoryCommandHandler
@@ -37,8 +43,18 @@ async def post_init(app: Application) -> None:
 
     # DB
     logger.debug('POST-INIT: Setting up DB')
-    async with di.db.engine.begin() as con:
-        await con.run_sync(Base.metadata.create_all)
+    if settings.DB_MIGRATE_ON_STARTUP:
+        # Alembic запускает свой цикл событий, поэтому миграции выполняются в отдельном потоке
+        await asyncio.to_thread(migrations.upgrade)
+
+    if settings.DB_WARMUP:
+        # post_init выполняется до начала опроса: обновления начнут обрабатываться только после прогрева
+        logger.debug('POST-INIT: Warming up DB')
+        await di.warmup_service.warm_up()
+
+    # Users
+    logger.debug('POST-INIT: Loading banned users')
+    await di.user_service.load_banned_users()
 
     # Sentry
     logger.debug('POST-INIT: Setting up Sentry monitoring')
@@ -54,6 +70,27 @@ async def post_init(app: Application) -> None:
             environment=settings.ENVIRONMENT,
         )
 
+    # Metrics
+    if settings.METRICS_LOG_INTERVAL:
+        logger.debug('POST-INIT: Setting up metrics logging')
+        app.create_task(metrics.log_periodically(settings.METRICS_LOG_INTERVAL))
+
+    # Retention
+    retention_service = di.retention_service
+    if retention_service.enabled:
+        logger.debug('POST-INIT: Setting up retention')
+        app.create_task(retention_service.purge_periodically(settings.RETENTION_INTERVAL))
+
+    # Outbox
+    # запросы, оставшиеся в очереди с прошлого запуска, выполняются сразу
+    logger.debug('POST-INIT: Setting up outbox dispatcher')
+    app.create_task(di.outbox_dispatcher.run())
+
+    # Broadcasts
+    # рассылка, прерванная остановкой бота, продолжается с сохраненной позиции
+    logger.debug('POST-INIT: Resuming broadcasts')
+    app.create_task(di.broadcast_service.resume_broadcasts())
+
     # # Roles
     logger.debug('POST-INIT: Setting up roles')
     roles = setup_roles(app)
@@ -63,18 +100,25 @@ async def post_init(app: Application) -> None:
     app.add_handler(CommandHandler(StartCommandHandler.name, di.start_command_handler))
     app.add_handler(CommandHandler(HelpCommandHandler.name, di.help_command_handler))
 
+    # обработчики, работающие с БД, выполняются в единице работы: одна транзакция на обновление
+    uow = di.unit_of_work
+
     # users
-    app.add_handler(CommandHandler(BanCommandHandler.name, di.ban_command_handler))
-    app.add_handler(CommandHandler(UnbanCommandHandler.name, di.unban_command_handler))
-    app.add_handler(CommandHandler(UserLogCommandHandler.name, di.userlog_command_handler))
+    app.add_handler(CommandHandler(BanCommandHandler.name, uow.wrap(di.ban_command_handler)))
+    app.add_handler(CommandHandler(UnbanCommandHandler.name, uow.wrap(di.unban_command_handler)))
+    app.add_handler(CommandHandler(UserLogCommandHandler.name, uow.wrap(di.userlog_command_handler)))
 
     # topics
-    app.add_handler(CommandHandler(DeleteCommandHandler.name, di.delete_command_handler))
+    app.add_handler(CommandHandler(DeleteCommandHandler.name, uow.wrap(di.delete_command_handler)))
+    # удаление истории длится минуты: без общей транзакции, каждая порция коммитится отдельно (см. delete_history)
     app.add_handler(CommandHandler(DeleteHistoryCommandHandler.name, di.delete_history_command_handler))
 
+    # broadcasts
+    app.add_handler(CommandHandler(BroadcastCommandHandler.name, uow.wrap(di.broadcast_command_handler)))
+
     # messages (должны идти после команд, чтобы не перекрывать их)
-    app.add_handler(MessageHandler(filters.REPLY, di.reply_message_handler))
-    app.add_handler(MessageHandler(filters.ChatType.PRIVATE, di.forward_message_handler))
+    app.add_handler(MessageHandler(filters.REPLY, uow.wrap(di.reply_message_handler)))
+    app.add_handler(MessageHandler(filters.ChatType.PRIVATE, uow.wrap(di.forward_message_handler)))
 
     # обработчик ошибок
     app.add_error_handler(di.root_error_handler)
@@ -110,6 +154,7 @@ async def post_init(app: Application) -> None:
             (UnbanCommandHandler.name, UnbanCommandHandler.help_for_role(Role.ADMIN.value)),
             (DeleteHistoryCommandHandler.name, DeleteHistoryCommandHandler.help_for_role(Role.ADMIN.value)),
             (UserLogCommandHandler.name, UserLogCommandHandler.help_for_role(Role.ADMIN.value)),
+            (BroadcastCommandHandler.name, BroadcastCommandHandler.help_for_role(Role.ADMIN.value)),
         ],
         scope=BotCommandScopeChatAdministrators(chat_id=settings.CHAT_ID),
     )
@@ -117,11 +162,19 @@ async def post_init(app: Application) -> None:
     logger.info('POST-INIT: Bot ready, listening...')
 
 
+async def post_stop(app: Application) -> None:
+    # альбомы, которые еще собираются, пересылаются сразу: бот пока может отправлять сообщения
+    logger.debug('POST-STOP: Flushing media groups')
+    await get_media_group_collector().flush_all()
+
+
 app: Application = (
     Application
     .builder()
     .token(settings.TOKEN)
     .post_init(post_init)
-    .rate_limiter(AIORateLimiter())
+    .post_stop(post_stop)
+    .rate_limiter(PriorityRateLimiter())
+    .concurrent_updates(KeyedUpdateProcessor(settings.UPDATES_CONCURRENCY, settings.UPDATES_MAX_PENDING))
     .build()
 )
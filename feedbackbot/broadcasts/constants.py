@@ -0,0 +1,11 @@
+BROADCAST_USAGE = 'Отправьте команду ответом на сообщение, которое нужно разослать пользователям.'
+BROADCAST_ALREADY_RUNNING = 'Рассылка уже идет. Дождитесь ее завершения.'
+BROADCAST_PROGRESS = 'Рассылка... Отправлено: {sent} из {total}, заблокировали бот: {blocked}, ошибок: {failed}'
+BROADCAST_DONE = 'Рассылка завершена. Отправлено: {sent} из {total}, заблокировали бот: {blocked}, ошибок: {failed}'
+BROADCAST_ABORTED = (
+    'Рассылка остановлена: сообщение для рассылки удалено. Отправлено: {sent} из {total}, заблокировали бот: '
+    '{blocked}, ошибок: {failed}'
+)
+BROADCAST_FAILED = (
+    'Рассылка прервана из-за ошибки. Отправлено: {sent} из {total}, заблокировали бот: {blocked}, ошибок: {failed}'
+)
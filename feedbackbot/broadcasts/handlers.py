@@ -0,0 +1,64 @@
+import logging
+
+from telegram import Update, Bot, ChatMember
+from telegram.ext import ContextTypes
+
+from feedbackbot import settings
+from feedbackbot.broadcasts.constants import BROADCAST_USAGE
+from feedbackbot.broadcasts.services import BroadcastService
+from feedbackbot.core.db import on_commit
+from feedbackbot.core.handlers import BaseCommandHandler
+
+logger = logging.getLogger(__name__)
+
+
+class BroadcastCommandHandler(BaseCommandHandler):
+    """
+    Рассылка всем пользователям: сообщение, на которое команда отправлена ответом, копируется всем незабаненным
+    пользователям (см. BroadcastService).
+
+    Доступна только администраторам чата операторов и только в нем. Рассылка идет в фоне и запускается после
+    коммита записи о ней.
+    """
+    name = 'broadcast'
+    help = 'Разослать сообщение всем пользователям'
+    ADMIN_STATUSES = (ChatMember.ADMINISTRATOR, ChatMember.OWNER)
+
+    def __init__(self, bot: Bot, broadcast_service: BroadcastService):
+        self._bot = bot
+        self._broadcast_service = broadcast_service
+
+    async def __call__(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        # когда оператор редактирует старое сообщение
+        if not update.message:
+            return
+
+        # только из чата операторов: в личном чате с ботом команда не принимается даже от администратора
+        if update.message.chat_id != int(settings.CHAT_ID):
+            logger.debug(f'Broadcast is not allowed in chat: {update.message.chat_id}')
+            return
+
+        if not await self._is_admin(update.message.from_user.id):
+            logger.debug(f'Broadcast is not allowed for user: {update.message.from_user.id}')
+            return
+
+        # в форуме сообщение без ответа ссылается на служебное сообщение о создании топика
+        target_message = update.message.reply_to_message
+        if target_message is None or target_message.forum_topic_created is not None:
+            await self._bot.send_message(
+                update.message.chat_id,
+                message_thread_id=update.message.message_thread_id,
+                text=BROADCAST_USAGE,
+            )
+            return
+
+        broadcast_id = await self._broadcast_service.create_broadcast(
+            target_message, update.message.message_thread_id
+        )
+        if broadcast_id is not None:
+            logger.info(f'Starting broadcast {broadcast_id} of message {target_message.message_id}')
+            on_commit(lambda: context.application.create_task(self._broadcast_service.run_broadcast(broadcast_id)))
+
+    async def _is_admin(self, user_id: int) -> bool:
+        chat_member = await self._bot.get_chat_member(settings.CHAT_ID, user_id)
+        return chat_member.status in self.ADMIN_STATUSES
@@ -0,0 +1,40 @@
+__all__ = ('Broadcast',)
+import datetime
+
+from sqlalchemy import BigInteger, Integer, DateTime, func
+from sqlalchemy.orm import Mapped, mapped_column
+
+from feedbackbot.core.db import Base
+
+
+class Broadcast(Base):
+    """
+    Рассылка сообщения из чата операторов всем незабаненным пользователям (см. BroadcastService).
+
+    Пользователи обходятся по возрастанию ID, last_user_id – последний обработанный: после перезапуска рассылка
+    продолжается с него.
+    """
+    __tablename__ = 'broadcasts'
+
+    # SQLite генерирует значения только для колонки INTEGER PRIMARY KEY
+    id: Mapped[int] = mapped_column(
+        BigInteger().with_variant(Integer, 'sqlite'), primary_key=True, autoincrement=True
+    )
+
+    # копируемое сообщение
+    from_chat_id: Mapped[int] = mapped_column(BigInteger)
+    message_id: Mapped[int] = mapped_column(BigInteger)
+    # сообщение о ходе рассылки в чате операторов
+    progress_message_id: Mapped[int | None] = mapped_column(BigInteger)
+
+    last_user_id: Mapped[int] = mapped_column(BigInteger, default=0)
+    total: Mapped[int] = mapped_column(default=0)
+    sent: Mapped[int] = mapped_column(default=0)
+    # пользователь заблокировал бот или удалил аккаунт
+    blocked: Mapped[int] = mapped_column(default=0)
+    failed: Mapped[int] = mapped_column(default=0)
+
+    created_at: Mapped[datetime.datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now()
+    )
+    finished_at: Mapped[datetime.datetime | None] = mapped_column(DateTime(timezone=True))
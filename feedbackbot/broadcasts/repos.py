@@ -0,0 +1,39 @@
+import datetime
+from collections.abc import Sequence
+
+from feedbackbot.broadcasts.models import Broadcast
+from feedbackbot.core.db import BaseAsyncDBRepo
+
+
+class BroadcastRepo(BaseAsyncDBRepo[Broadcast]):
+    model_class = Broadcast
+
+    async def create_broadcast(self, from_chat_id: int, message_id: int, progress_message_id: int | None,
+                               total: int) -> Broadcast:
+        return await self.create(
+            from_chat_id=from_chat_id,
+            message_id=message_id,
+            progress_message_id=progress_message_id,
+            total=total,
+        )
+
+    async def get_broadcast(self, broadcast_id: int) -> Broadcast | None:
+        return await self.get(id=broadcast_id)
+
+    async def get_unfinished_broadcasts(self) -> Sequence[Broadcast]:
+        return await self.get_many(self.model_class.finished_at.is_(None), ordering=('id', 'asc'))
+
+    async def update_progress(self, broadcast_id: int, last_user_id: int, sent: int, blocked: int, failed: int):
+        return await self.update(
+            self.model_class.id==broadcast_id,
+            last_user_id=last_user_id,
+            sent=sent,
+            blocked=blocked,
+            failed=failed,
+        )
+
+    async def finish_broadcast(self, broadcast_id: int):
+        return await self.update(
+            self.model_class.id==broadcast_id,
+            finished_at=datetime.datetime.now(datetime.timezone.utc),
+        )
@@ -0,0 +1,236 @@
+import asyncio
+import logging
+import time
+from collections import Counter
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+
+from aiolimiter import AsyncLimiter
+from telegram import Bot, Message
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
+
+from feedbackbot import settings
+from feedbackbot.broadcasts.constants import (
+    BROADCAST_ALREADY_RUNNING, BROADCAST_PROGRESS, BROADCAST_DONE, BROADCAST_ABORTED, BROADCAST_FAILED,
+)
+from feedbackbot.broadcasts.models import Broadcast
+from feedbackbot.broadcasts.repos import BroadcastRepo
+from feedbackbot.core.enums import Priority
+from feedbackbot.core.ratelimit import request_priority
+from feedbackbot.users.repos import UserRepo
+
+logger = logging.getLogger(__name__)
+
+
+class BroadcastService:
+    """
+    Рассылка сообщения из чата операторов всем незабаненным пользователям.
+
+    Пользователи выбираются порциями по возрастанию ID (см. UserRepo.iterate_recipient_batches), после каждой порции
+    позиция и счетчики сохраняются в broadcasts. После перезапуска рассылка продолжается с последней сохраненной
+    позиции: сообщение повторно могут получить только пользователи из незавершенной порции.
+
+    Сообщения отправляются с приоритетом Priority.BROADCAST и не чаще BROADCAST_RATE в секунду: ответы операторов и
+    пересылка сообщений пользователей проходят общий лимит бота первыми (см. PriorityRateLimiter), рассылке достается
+    остаток. RetryAfter приостанавливает всю рассылку на указанное Телеграм время.
+
+    Рассылка завершается досрочно, если сообщение для рассылки удалено, и при любой другой ошибке: незавершенная
+    рассылка блокировала бы новые до перезапуска бота. Продолжается после перезапуска только рассылка, прерванная
+    остановкой бота.
+    """
+
+    # результаты отправки, они же счетчики в broadcasts
+    SENT = 'sent'
+    BLOCKED = 'blocked'
+    FAILED = 'failed'
+
+    # ответ Bot API на copy_message, если копируемое сообщение удалено
+    SOURCE_DELETED_ERROR = 'message to copy not found'
+
+    def __init__(self, bot: Bot, broadcast_repo: BroadcastRepo, user_repo: UserRepo):
+        self._bot = bot
+        self._broadcast_repo = broadcast_repo
+        self._user_repo = user_repo
+
+    async def create_broadcast(self, message: Message, message_thread_id: int | None) -> int | None:
+        """
+        Создает рассылку message и сообщение о ее ходе в топике message_thread_id. Одновременно идет только одна
+        рассылка.
+
+        :return: ID рассылки либо None, если уже идет другая
+        """
+        if await self._broadcast_repo.get_unfinished_broadcasts():
+            await self._bot.send_message(
+                message.chat_id,
+                message_thread_id=message_thread_id,
+                text=BROADCAST_ALREADY_RUNNING,
+            )
+            return None
+
+        total = await self._user_repo.count_recipients()
+        progress_message = await self._bot.send_message(
+            message.chat_id,
+            message_thread_id=message_thread_id,
+            text=BROADCAST_PROGRESS.format(sent=0, total=total, blocked=0, failed=0),
+        )
+        db_broadcast = await self._broadcast_repo.create_broadcast(
+            message.chat_id, message.message_id, progress_message.message_id, total
+        )
+
+        return db_broadcast.id
+
+    async def resume_broadcasts(self):
+        """
+        Продолжает рассылки, прерванные остановкой бота.
+        """
+        for db_broadcast in await self._broadcast_repo.get_unfinished_broadcasts():
+            logger.info(f'Resuming broadcast {db_broadcast.id} after user {db_broadcast.last_user_id}')
+            await self.run_broadcast(db_broadcast.id)
+
+    async def run_broadcast(self, broadcast_id: int):
+        db_broadcast = await self._broadcast_repo.get_broadcast(broadcast_id)
+
+        counters = Counter({
+            self.SENT: db_broadcast.sent,
+            self.BLOCKED: db_broadcast.blocked,
+            self.FAILED: db_broadcast.failed,
+        })
+        progress = _BroadcastProgress(self._bot, db_broadcast)
+
+        try:
+            await self._run(db_broadcast, counters, progress)
+        except _SourceMessageDeleted:
+            logger.warning(f'Broadcast {broadcast_id} aborted: message to copy was deleted')
+            await self._finish(broadcast_id, progress, BROADCAST_ABORTED, counters)
+        except Exception:
+            logger.exception(f'Broadcast {broadcast_id} failed')
+            await self._finish(broadcast_id, progress, BROADCAST_FAILED, counters)
+        else:
+            await self._finish(broadcast_id, progress, BROADCAST_DONE, counters)
+            logger.info(f'Broadcast {broadcast_id} finished: {dict(counters)}')
+
+    async def _run(self, db_broadcast: Broadcast, counters: Counter, progress: '_BroadcastProgress'):
+        pacing = _Pacing(settings.BROADCAST_RATE, settings.BROADCAST_CONCURRENCY)
+
+        async for db_users in self._user_repo.iterate_recipient_batches(
+            db_broadcast.last_user_id, batch_size=settings.BROADCAST_BATCH_SIZE
+        ):
+            results = await asyncio.gather(*(
+                self._send(db_broadcast, db_user.id, pacing) for db_user in db_users
+            ), return_exceptions=True)
+            for result in results:
+                if isinstance(result, Exception):
+                    raise result
+
+            counters.update(results)
+            await self._broadcast_repo.update_progress(
+                db_broadcast.id,
+                last_user_id=db_users[-1].id,
+                sent=counters[self.SENT],
+                blocked=counters[self.BLOCKED],
+                failed=counters[self.FAILED],
+            )
+            await progress.update(counters)
+
+    async def _finish(self, broadcast_id: int, progress: '_BroadcastProgress', template: str, counters: Counter):
+        await self._broadcast_repo.finish_broadcast(broadcast_id)
+        await progress.edit(template, counters)
+
+    async def _send(self, db_broadcast: Broadcast, user_id: int, pacing: '_Pacing') -> str:
+        for _ in range(settings.BROADCAST_MAX_RETRIES + 1):
+            async with pacing():
+                if pacing.stopped:
+                    raise _SourceMessageDeleted
+
+                try:
+                    with request_priority(Priority.BROADCAST):
+                        await self._bot.copy_message(
+                            chat_id=user_id,
+                            from_chat_id=db_broadcast.from_chat_id,
+                            message_id=db_broadcast.message_id,
+                        )
+                except RetryAfter as e:
+                    pacing.pause(e.retry_after)
+                    continue
+                except Forbidden:
+                    # пользователь заблокировал бот или удалил аккаунт
+                    return self.BLOCKED
+                except TelegramError as e:
+                    if isinstance(e, BadRequest) and self.SOURCE_DELETED_ERROR in e.message.lower():
+                        # остальные сообщения порции уже не отправляются
+                        pacing.stop()
+                        raise _SourceMessageDeleted from e
+                    logger.warning(f'Failed to send broadcast {db_broadcast.id} to user {user_id}: {e.message}')
+                    return self.FAILED
+
+                return self.SENT
+
+        logger.warning(f'Failed to send broadcast {db_broadcast.id} to user {user_id}: retries exceeded')
+        return self.FAILED
+
+
+class _SourceMessageDeleted(Exception):
+    """
+    Сообщение для рассылки удалено: его не получит ни один из оставшихся пользователей.
+    """
+
+
+class _Pacing:
+    """
+    Темп рассылки: не больше concurrency запросов одновременно и rate запросов в секунду, пауза после RetryAfter и
+    остановка рассылки.
+    """
+
+    def __init__(self, rate: float, concurrency: int):
+        self._limiter = AsyncLimiter(rate, 1)
+        self._workers = asyncio.Semaphore(concurrency)
+        self._resume_at = 0.0
+        self.stopped = False
+
+    def pause(self, seconds: float):
+        self._resume_at = max(self._resume_at, time.monotonic() + seconds)
+
+    def stop(self):
+        self.stopped = True
+
+    @asynccontextmanager
+    async def __call__(self) -> AsyncIterator[None]:
+        async with self._workers:
+            while (delay := self._resume_at - time.monotonic()) > 0:
+                await asyncio.sleep(delay)
+
+            await self._limiter.acquire()
+            yield
+
+
+class _BroadcastProgress:
+    """
+    Сообщение о ходе рассылки. Редактируется не чаще BROADCAST_PROGRESS_INTERVAL секунд, как и сообщение о ходе
+    удаления истории.
+    """
+
+    def __init__(self, bot: Bot, db_broadcast: Broadcast):
+        self._bot = bot
+        self._chat_id = db_broadcast.from_chat_id
+        self._message_id = db_broadcast.progress_message_id
+        self._total = db_broadcast.total
+        self._updated_at = time.monotonic()
+
+    async def update(self, counters: Counter):
+        if time.monotonic() - self._updated_at >= settings.BROADCAST_PROGRESS_INTERVAL:
+            self._updated_at = time.monotonic()
+            await self.edit(BROADCAST_PROGRESS, counters)
+
+    async def edit(self, template: str, counters: Counter):
+        if self._message_id is None:
+            return
+
+        try:
+            await self._bot.edit_message_text(
+                chat_id=self._chat_id,
+                message_id=self._message_id,
+                text=template.format(total=self._total, **counters),
+            )
+        except TelegramError as e:
+            # сообщение удалено, RetryAfter, сетевая ошибка – ход рассылки не влияет на ее результат
+            logger.warning(f'Failed to update broadcast progress: {e.message}')
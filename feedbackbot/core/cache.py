@@ -0,0 +1,157 @@
+__all__ = ('TTLCache', 'MappingIndex')
+
+import time
+from collections import OrderedDict
+from typing import Callable, Generic, Hashable, TypeVar
+
+K = TypeVar('K', bound=Hashable)
+V = TypeVar('V')
+
+
+class TTLCache(Generic[K, V]):
+    """
+    Ограниченный кэш в памяти процесса. Запись живет не дольше ttl секунд, при переполнении вытесняется самая давно
+    использованная запись (LRU).
+
+    Кэш не потокобезопасен: он рассчитан на использование из одного цикла событий.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, clock: Callable[[], float] = time.monotonic):
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._clock = clock
+        # ключ -> (момент устаревания, значение), от давно использованных к недавним
+        self._data: OrderedDict[K, tuple[float, V]] = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: K, default: V | None = None) -> V | None:
+        item = self._data.get(key)
+
+        if item is not None:
+            expires_at, value = item
+            if expires_at > self._clock():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+
+            del self._data[key]
+
+        self.misses += 1
+        return default
+
+    def set(self, key: K, value: V):
+        self._data[key] = (self._clock() + self._ttl, value)
+        self._data.move_to_end(key)
+
+        while len(self._data) > self._maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: K):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'maxsize': self._maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': round(self.hits / requests, 3) if requests else 0.0,
+        }
+
+
+class MappingIndex(Generic[K, V]):
+    """
+    Двунаправленный индекс в памяти процесса: значение доступно по прямому и по обратному ключу. Размер и возраст
+    записей ограничены, вытесняются самые старые записи (в порядке добавления). Чтение не продлевает жизнь записи:
+    индекс хранит только недавние соответствия.
+
+    Индекс не потокобезопасен: он рассчитан на использование из одного цикла событий.
+    """
+
+    def __init__(self, maxsize: int, max_age: float, clock: Callable[[], float] = time.monotonic):
+        self._maxsize = maxsize
+        self._max_age = max_age
+        self._clock = clock
+        # прямой ключ -> (момент добавления, обратный ключ, значение), от старых к новым
+        self._data: OrderedDict[K, tuple[float, K, V]] = OrderedDict()
+        # обратный ключ -> прямой ключ
+        self._reverse: dict[K, K] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def add(self, key: K, reverse_key: K, value: V):
+        self.remove(key)
+        self._data[key] = (self._clock(), reverse_key, value)
+        self._reverse[reverse_key] = key
+        self._evict()
+
+    def get(self, key: K) -> V | None:
+        self._evict()
+        return self._count(self._data.get(key))
+
+    def get_by_reverse(self, reverse_key: K) -> V | None:
+        self._evict()
+        key = self._reverse.get(reverse_key)
+        return self._count(self._data.get(key) if key is not None else None)
+
+    def remove(self, key: K):
+        item = self._data.pop(key, None)
+        if item is not None:
+            self._unlink(key, item[1])
+
+    def clear(self):
+        self._data.clear()
+        self._reverse.clear()
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'maxsize': self._maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': round(self.hits / requests, 3) if requests else 0.0,
+        }
+
+    def _count(self, item: tuple[float, K, V] | None) -> V | None:
+        if item is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return item[2]
+
+    def _unlink(self, key: K, reverse_key: K):
+        # обратный ключ мог быть уже переназначен более новой записи
+        if self._reverse.get(reverse_key) == key:
+            del self._reverse[reverse_key]
+
+    def _evict(self):
+        added_after = self._clock() - self._max_age
+
+        while self._data:
+            key, (added_at, reverse_key, _) = next(iter(self._data.items()))
+            if len(self._data) <= self._maxsize and added_at > added_after:
+                break
+
+            del self._data[key]
+            self._unlink(key, reverse_key)
+            self.evictions += 1
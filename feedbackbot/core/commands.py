@@ -13,9 +13,14 @@ def create_db():
         engine = get_engine()
         async with engine.begin() as con:
             await con.run_sync(Base.metadata.create_all)
+        await engine.dispose()
 
     asyncio.run(__inner())
 
+    # схема создана по моделям и соответствует последней миграции
+    from feedbackbot.core.migrations import stamp
+    stamp()
+
 
 @click.command(short_help='Create DB')
 def clean_db():
@@ -26,6 +31,44 @@ def clean_db():
         async with engine.begin() as con:
             for tbl in reversed(Base.metadata.sorted_tables):
                 await con.execute(tbl.delete())
+        await engine.dispose()
 
     asyncio.run(__inner())
 
+
+@click.command(short_help='Apply migrations')
+@click.argument('revision', default='head')
+@click.option('--down', is_flag=True, help='Downgrade to the revision instead of upgrading')
+def migrate(revision, down):
+    from feedbackbot.core.migrations import upgrade, downgrade
+
+    click.echo(f'Migrating the database to {revision}')
+    if down:
+        downgrade(revision)
+    else:
+        upgrade(revision)
+
+
+@click.command(short_help='Create a migration')
+@click.option('-m', '--message', required=True, help='Short description of the migration')
+@click.option('--empty', is_flag=True, help='Do not autogenerate operations from the models')
+def make_migrations(message, empty):
+    from feedbackbot.core.migrations import make_migration
+
+    click.echo('Creating a migration')
+    make_migration(message, autogenerate=not empty)
+
+
+@click.command(short_help='Purge expired data')
+def purge():
+    from feedbackbot.core.di import DIAsync
+
+    click.echo('Purging expired data')
+
+    async def __inner():
+        purged = await DIAsync.retention_service.purge()
+        await get_engine().dispose()
+        return purged
+
+    for table, count in asyncio.run(__inner()).items():
+        click.echo(f'{table}: {count}')
@@ -1,11 +1,20 @@
-from collections.abc import Sequence
-from typing import Callable, Type, TypeVar, Generic
+import random
+from pathlib import Path
+from collections.abc import Sequence, AsyncIterator, Awaitable, Iterable
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from functools import cache
+from typing import Callable, Type, TypeVar, Generic, NamedTuple
 
-from sqlalchemy import update, select, delete, BIGINT, NullPool
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, AsyncEngine
+from sqlalchemy import update, select, delete, insert, any_, bindparam, tuple_, BIGINT, Engine, URL, event, make_url
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession, AsyncEngine
 from sqlalchemy.orm import Session, DeclarativeBase
+from sqlalchemy.sql import Select
 
 from feedbackbot import settings
+from feedbackbot.core.metrics import metrics
+from feedbackbot.core.pool import InstrumentedAsyncQueuePool, pool_stats
 
 
 class Base(DeclarativeBase):
@@ -16,88 +25,571 @@ class Base(DeclarativeBase):
 
 T = TypeVar('T', bound=Base)
 
+# Сессия текущей единицы работы (см. UnitOfWork). Контекстная переменная своя у каждой asyncio-задачи, поэтому
+# параллельно обрабатываемые обновления не пересекаются.
+_current_session: ContextVar[AsyncSession | None] = ContextVar('current_session', default=None)
+# Признак записи в текущей единице работы: после нее чтение идет только из основной БД (см. RoutingSession)
+_primary_pinned: ContextVar[bool] = ContextVar('primary_pinned', default=False)
+# Действия, отложенные до коммита текущей единицы работы (см. on_commit)
+_commit_callbacks: ContextVar[list[Callable[[], None]] | None] = ContextVar('commit_callbacks', default=None)
+
+
+def pin_primary():
+    """
+    Направить все дальнейшие запросы текущей единицы работы в основную БД. Вне единицы работы – все дальнейшие
+    запросы текущей задачи, например для фоновой задачи, которая всегда должна читать актуальные данные.
+    """
+    _primary_pinned.set(True)
+
+
+def on_commit(callback: Callable[[], None]):
+    """
+    Выполнить callback после коммита текущей единицы работы. При откате callback не выполняется, поэтому кэши не
+    получают данных, которых нет в БД. Вне единицы работы запись уже закоммичена, и callback выполняется сразу.
+    """
+    callbacks = _commit_callbacks.get()
+    if callbacks is None:
+        callback()
+    else:
+        callbacks.append(callback)
+
+
+class UnitOfWork:
+    """
+    Единица работы: одна сессия и одна транзакция на весь блок.
+
+    Все репозитории внутри блока автоматически используют общую сессию, а коммит выполняется один раз при выходе из
+    блока (или откат, если блок завершился исключением). Вложенные блоки присоединяются к внешнему.
+
+        async with unit_of_work():
+            await user_repo.create_user(...)
+            await user_log_repo.create_user_log(...)
+
+    Соединение с БД удерживается до конца блока, в том числе во время запросов к Bot API.
+    """
+
+    def __init__(self, session: Callable[..., AsyncSession]):
+        self._session = session
+
+    @asynccontextmanager
+    async def __call__(self) -> AsyncIterator[AsyncSession]:
+        current = _current_session.get()
+        if current is not None:
+            yield current
+            return
+
+        callbacks = []
+        async with self._session() as session:
+            async with session.begin():
+                token = _current_session.set(session)
+                callbacks_token = _commit_callbacks.set(callbacks)
+                # запись закрепляет основную БД только до конца единицы работы
+                pinned_token = _primary_pinned.set(_primary_pinned.get())
+                try:
+                    yield session
+                finally:
+                    _current_session.reset(token)
+                    _commit_callbacks.reset(callbacks_token)
+                    _primary_pinned.reset(pinned_token)
+
+        for callback in callbacks:
+            callback()
+
+    def wrap(self, handler: Callable[..., Awaitable]) -> Callable[..., Awaitable]:
+        """
+        Оборачивает обработчик обновлений Телеграм, чтобы каждое обновление обрабатывалось в одной единице работы.
+        """
+        async def wrapped(update, context):
+            async with self():
+                return await handler(update, context)
+
+        return wrapped
+
+
+class FilterShape(NamedTuple):
+    """
+    Форма запроса filter(): набор полей фильтра и сортировка.
+    """
+    fields: tuple[str, ...]
+    ordering: tuple[str, str] | None = None
+
 
 class BaseAsyncDBRepo(Generic[T]):
     model_class: Type[T]
+    # Формы горячих запросов filter(): их выражения строятся при объявлении репозитория
+    hot_filters: tuple[FilterShape, ...] = ()
+
+    # Реестр готовых выражений filter() по форме запроса, свой у каждого репозитория
+    _statements: dict[FilterShape, Select]
 
     def __init__(self, session: Callable[..., AsyncSession]):
         self._session = session
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._statements = {}
+
+        for shape in cls.hot_filters:
+            cls._filter_statement(shape)
+
+    @classmethod
+    def _filter_statement(cls, shape: FilterShape) -> Select:
+        """
+        Готовое выражение SELECT для формы запроса. Значения фильтра передаются параметрами при выполнении, поэтому
+        выражение строится один раз, а его ключ кэша SQLAlchemy вычисляется и запоминается при первом выполнении.
+        Скомпилированный запрос берется из кэша SQLAlchemy, а prepared statement – из кэша соединения asyncpg.
+        """
+        shape = FilterShape(tuple(sorted(shape.fields)), shape.ordering)
+
+        stmt = cls._statements.get(shape)
+        if stmt is None:
+            stmt = select(cls.model_class).where(
+                *(getattr(cls.model_class, name) == bindparam(name) for name in shape.fields)
+            )
+            if shape.ordering:
+                stmt = stmt.order_by(getattr(getattr(cls.model_class, shape.ordering[0]), shape.ordering[1])())
+            cls._statements[shape] = stmt
+
+        return stmt
+
+    @classmethod
+    def hot_statements(cls) -> list[tuple[Select, dict]]:
+        """
+        Выражения горячих запросов с пустыми значениями параметров, для прогрева кэшей запросов.
+        """
+        return [(cls._filter_statement(shape), dict.fromkeys(shape.fields)) for shape in cls.hot_filters]
+
+    # Сессии
+
+    @asynccontextmanager
+    async def _reading(self) -> AsyncIterator[AsyncSession]:
+        """ Сессия для чтения: сессия текущей единицы работы или новая """
+        current = _current_session.get()
+        if current is not None:
+            yield current
+            return
+
+        async with self._session() as session:
+            yield session
+
+    @asynccontextmanager
+    async def _writing(self) -> AsyncIterator[AsyncSession]:
+        """
+        Сессия для записи. Внутри единицы работы изменения только сбрасываются в БД (flush), коммит выполнит сама
+        единица работы. Вне ее открывается отдельная транзакция.
+        """
+        current = _current_session.get()
+        if current is not None:
+            pin_primary()
+            yield current
+            await current.flush()
+            return
+
+        pinned_token = _primary_pinned.set(True)
+        try:
+            async with self._session() as session:
+                async with session.begin():
+                    yield session
+        finally:
+            _primary_pinned.reset(pinned_token)
+
+    def _insert(self, session: AsyncSession):
+        """
+        INSERT с поддержкой ON CONFLICT. Конструкция зависит от диалекта: в тестах используется SQLite.
+        """
+        if session.get_bind().dialect.name == 'sqlite':
+            return sqlite.insert(self.model_class)
+
+        return postgresql.insert(self.model_class)
+
+    def _in(self, session: AsyncSession, column, values: Sequence):
+        """
+        Условие вхождения в набор значений. В PostgreSQL это `= ANY(:values)` с одним параметром-массивом: форма
+        запроса не зависит от количества значений.
+        """
+        if session.get_bind().dialect.name == 'postgresql':
+            return column == any_(bindparam(None, list(values), type_=postgresql.ARRAY(column.type)))
+
+        return column.in_(values)
+
+    @property
+    def _primary_key(self) -> list[str]:
+        return [column.key for column in self.model_class.__mapper__.primary_key]
+
     # Низкоуровневые методы
 
     async def create(self, **model_kwargs) -> T:
         instance = self.model_class(**model_kwargs)
 
-        async with self._session() as session:
-            async with session.begin():
-                session.add(instance)
+        async with self._writing() as session:
+            session.add(instance)
 
-                return instance
+        return instance
 
     async def get(self, **get_kwargs) -> T:
-        async with self._session() as session:
+        async with self._reading() as session:
             user = await session.get(self.model_class, get_kwargs)
 
             return user
 
-    async def get_many(self, *filter_criteria, ordering: tuple[str, str] | None =None) -> Sequence[T]:
+    async def get_many(self, *filter_criteria, ordering: tuple[str, str] | None =None,
+                       limit: int | None = None) -> Sequence[T]:
         """
 
         :param filter_criteria:
         :param ordering: ('timestamp', 'desc')
+        :param limit: максимальное количество записей
         :return:
         """
-        async with self._session() as session:
+        async with self._reading() as session:
             q = select(self.model_class).where(*filter_criteria)
             if ordering:
                 q = q.order_by(getattr(getattr(self.model_class, ordering[0]), ordering[1])())
+            if limit is not None:
+                q = q.limit(limit)
             res = await session.execute(q)
             return res.scalars().all()
 
+    async def iterate_batches(self, *filter_criteria, batch_size: int | None = None,
+                              ordering: tuple[str, str] | None = None) -> AsyncIterator[Sequence[T]]:
+        """
+        Обход результата порциями с постраничной выборкой по ключу (keyset pagination): каждая порция – отдельный
+        запрос `WHERE (<поле сортировки>, <первичный ключ>) > (<последняя запись>) ORDER BY ... LIMIT batch_size`.
+        Стоимость порции не зависит от ее номера, в памяти одновременно держится только одна порция. Записи можно
+        удалять по ходу обхода.
+
+        :param filter_criteria:
+        :param batch_size: размер порции, по умолчанию settings.DB_BATCH_SIZE
+        :param ordering: ('timestamp', 'desc'), по умолчанию по первичному ключу
+        """
+        batch_size = batch_size or settings.DB_BATCH_SIZE
+        pk_column = self.model_class.__mapper__.primary_key[0]
+        descending = bool(ordering) and ordering[1] == 'desc'
+
+        # первичный ключ в конце делает порядок однозначным при совпадающих значениях поля сортировки
+        keys = [getattr(self.model_class, ordering[0])] if ordering and ordering[0] != pk_column.key else []
+        keys.append(getattr(self.model_class, pk_column.key))
+
+        last = None
+        while True:
+            q = select(self.model_class).where(*filter_criteria)
+            if last is not None:
+                key, bound = (tuple_(*keys), tuple_(*last)) if len(keys) > 1 else (keys[0], last[0])
+                q = q.where(key < bound if descending else key > bound)
+            q = q.order_by(*(key.desc() if descending else key.asc() for key in keys)).limit(batch_size)
+
+            async with self._reading() as session:
+                res = await session.execute(q)
+                batch = res.scalars().all()
+
+            if batch:
+                yield batch
+
+            if len(batch) < batch_size:
+                return
+
+            last = [getattr(batch[-1], key.key) for key in keys]
+
+    async def iterate(self, *filter_criteria, batch_size: int | None = None,
+                      ordering: tuple[str, str] | None = None) -> AsyncIterator[T]:
+        """
+        Обход результата по одной записи, см. iterate_batches.
+        """
+        async for batch in self.iterate_batches(*filter_criteria, batch_size=batch_size, ordering=ordering):
+            for instance in batch:
+                yield instance
+
     async def update(self, lookup_expr, **update_kwargs) -> T:
-        async with self._session() as session:
-            async with session.begin():
-                await session.execute(
-                    update(self.model_class)
-                    .where(lookup_expr)
-                    .values(**update_kwargs)
+        """
+        UPDATE ... RETURNING: обновление и получение обновленной записи одним запросом.
+        """
+        async with self._writing() as session:
+            res = await session.execute(
+                update(self.model_class)
+                .where(lookup_expr)
+                .values(**update_kwargs)
+                .returning(self.model_class),
+                execution_options={'populate_existing': True},
+            )
+            instance = res.scalar_one()
+
+        return instance
+
+    async def upsert(self, conflict_keys: Sequence[str] | None = None, update_fields: Sequence[str] | None = None,
+                     **model_kwargs) -> T:
+        """
+        INSERT ... ON CONFLICT DO UPDATE ... RETURNING: создание либо обновление записи одним запросом.
+
+        :param conflict_keys: колонки уникального ключа, по умолчанию первичный ключ
+        :param update_fields: поля, обновляемые при конфликте, по умолчанию все переданные, кроме ключа
+        """
+        conflict_keys = conflict_keys or self._primary_key
+        if update_fields is None:
+            update_fields = [name for name in model_kwargs if name not in conflict_keys]
+
+        return await self._insert_returning(conflict_keys, update_fields, model_kwargs)
+
+    async def get_or_create(self, conflict_keys: Sequence[str] | None = None, **model_kwargs) -> T:
+        """
+        Возвращает существующую запись либо создает новую без гонки между чтением и вставкой:
+        `INSERT ... ON CONFLICT DO NOTHING RETURNING`, а если запись уже есть – `SELECT` по уникальному ключу.
+        Существующая запись не перезаписывается, поэтому повторный вызов не блокирует строку и не создает ее новую
+        версию.
+
+        :param conflict_keys: колонки уникального ключа, по умолчанию первичный ключ
+        """
+        conflict_keys = conflict_keys or self._primary_key
+
+        async with self._writing() as session:
+            stmt = self._insert(session).values(**model_kwargs).on_conflict_do_nothing(index_elements=conflict_keys)
+            res = await session.execute(
+                stmt.returning(self.model_class),
+                execution_options={'populate_existing': True},
+            )
+            instance = res.scalar_one_or_none()
+
+            # DO NOTHING не возвращает существующую строку; после конфликта она уже закоммичена и видна запросу
+            if instance is None:
+                res = await session.execute(
+                    select(self.model_class).filter_by(**{name: model_kwargs[name] for name in conflict_keys}),
+                    execution_options={'populate_existing': True},
                 )
-                await session.commit()
+                instance = res.scalar_one()
+
+        return instance
 
-            res = await session.execute(select(self.model_class).where(lookup_expr))
+    async def _insert_returning(self, conflict_keys: Sequence[str], update_fields: Sequence[str],
+                                model_kwargs: dict) -> T:
+        async with self._writing() as session:
+            stmt = self._insert(session).values(**model_kwargs)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=conflict_keys,
+                set_={name: stmt.excluded[name] for name in update_fields},
+            )
+            res = await session.execute(
+                stmt.returning(self.model_class),
+                execution_options={'populate_existing': True},
+            )
             instance = res.scalar_one()
 
-            return instance
+        return instance
 
     async def delete(self, lookup_expr):
-        async with self._session() as session:
-            async with session.begin():
-                await session.execute(
+        async with self._writing() as session:
+            await session.execute(
+                delete(self.model_class)
+                .where(lookup_expr)
+            )
+
+    # Массовые операции
+
+    async def bulk_create(self, rows: Iterable[dict]):
+        """
+        Вставка множества записей одним executemany.
+
+        :param rows: словари с полями записей
+        """
+        rows = list(rows)
+        if not rows:
+            return
+
+        async with self._writing() as session:
+            await session.execute(insert(self.model_class), rows)
+
+    async def bulk_update(self, rows: Iterable[dict]):
+        """
+        Обновление множества записей по первичному ключу одним executemany.
+
+        :param rows: словари с полями записей, каждый обязательно содержит первичный ключ
+        """
+        rows = list(rows)
+        if not rows:
+            return
+
+        async with self._writing() as session:
+            await session.execute(update(self.model_class), rows)
+
+    async def bulk_delete(self, ids: Iterable) -> int:
+        """
+        Удаление множества записей по первичному ключу одним запросом.
+
+        :param ids: значения первичного ключа
+        :return: количество удаленных записей
+        """
+        ids = list(ids)
+        if not ids:
+            return 0
+
+        pk_column = self.model_class.__mapper__.primary_key[0]
+        async with self._writing() as session:
+            res = await session.execute(
+                delete(self.model_class)
+                .where(self._in(session, pk_column, ids))
+            )
+
+        return res.rowcount
+
+    async def purge(self, *criteria, batch_size: int | None = None) -> int:
+        """
+        Удаление всех записей по условию порциями. Каждая порция удаляется в своей транзакции, поэтому блокировки
+        держатся недолго и не мешают обработке обновлений. Вызывать вне единицы работы, иначе все порции попадут в
+        одну транзакцию.
+
+        :param criteria: условия WHERE
+        :param batch_size: размер порции, по умолчанию settings.DB_BATCH_SIZE
+        :return: количество удаленных записей
+        """
+        batch_size = batch_size or settings.DB_BATCH_SIZE
+        pk_column = self.model_class.__mapper__.primary_key[0]
+        total = 0
+
+        while True:
+            async with self._writing() as session:
+                res = await session.execute(
                     delete(self.model_class)
-                    .where(lookup_expr)
+                    .where(pk_column.in_(select(pk_column).where(*criteria).limit(batch_size)))
+                    .execution_options(synchronize_session=False)
                 )
-                await session.commit()
+            total += res.rowcount
+
+            if res.rowcount < batch_size:
+                return total
 
     # Удобные методы
 
     async def filter(self, ordering: tuple[str, str] | None =None, **kwargs):
-        criteria = []
+        params = {name: value for name, value in kwargs.items() if value is not None}
+        stmt = self._filter_statement(FilterShape(tuple(params), ordering))
+
+        async with self._reading() as session:
+            res = await session.execute(stmt, params)
+            return res.scalars().all()
+
+
+class RoutingSession(Session):
+    """
+    Сессия, которая направляет чтение на реплики, а запись – на основную БД.
+
+    На реплику уходят только SELECT вне flush. После первой записи в текущей единице работы (то есть в рамках
+    обработки одного обновления) все чтения идут в основную БД, чтобы не прочитать с реплики устаревшие данные.
+    """
+
+    def __init__(self, *args, replicas: Sequence[Engine] = (), **kwargs):
+        super().__init__(*args, **kwargs)
+        self._replicas = list(replicas)
 
-        for name, value in kwargs.items():
-            if value is not None:
-                criteria.append(getattr(self.model_class, name) == value)
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if (
+            self._replicas
+            and isinstance(clause, Select)
+            and not self._flushing
+            and not _primary_pinned.get()
+        ):
+            return random.choice(self._replicas)
 
-        return await self.get_many(*criteria, ordering=ordering)
+        return super().get_bind(mapper, clause=clause, **kwargs)
 
 
 class DBRefs:
 
-    def __init__(self, engine: AsyncEngine, session: Callable[..., AsyncSession]):
+    def __init__(self, engine: AsyncEngine, session: Callable[..., AsyncSession],
+                 replica_engines: Sequence[AsyncEngine] = ()):
         self.engine = engine
         self.session = session
+        self.replica_engines = replica_engines
+
+    def pool_stats(self) -> dict:
+        return pool_stats(self.engine.pool)
+
+
+def get_engine(uri: str | None = None) -> AsyncEngine:
+    """
+    Движок БД с пулом соединений. Один на процесс для каждой БД: все репозитории, команды и обработчики используют
+    общий пул.
+    """
+    return _create_engine(uri or settings.DB_URI)
+
 
+def get_replica_engines() -> list[AsyncEngine]:
+    replica_engines = [get_engine(uri) for uri in settings.DB_REPLICA_URIS]
+    # реплики различаются по номеру: у нескольких реплик может быть общий хост
+    for index, replica_engine in enumerate(replica_engines):
+        metrics.register(f'db.pool.replica.{index}', lambda engine=replica_engine: pool_stats(engine.pool))
 
-def get_engine():
+    return replica_engines
+
+
+def get_session_factory(engine: AsyncEngine, replica_engines: Sequence[AsyncEngine] = ()) -> async_sessionmaker:
+    if not replica_engines:
+        return async_sessionmaker(engine, expire_on_commit=False)
+
+    return async_sessionmaker(
+        engine,
+        expire_on_commit=False,
+        sync_session_class=RoutingSession,
+        replicas=[replica_engine.sync_engine for replica_engine in replica_engines],
+    )
+
+
+# WAL: чтение не блокируется записью, а коммит не ждет fsync (synchronous=NORMAL). Внешние ключи SQLite проверяет
+# только с foreign_keys=ON, а busy_timeout заставляет конкурирующую запись подождать вместо ошибки "database is locked".
+SQLITE_PRAGMAS = (
+    'journal_mode=WAL',
+    'synchronous=NORMAL',
+    'foreign_keys=ON',
+    'busy_timeout=5000',
+)
+
+
+def ensure_sqlite_directory(uri: str | URL):
+    """
+    SQLite создает файл БД сам, но не каталог для него.
+    """
+    url = make_url(uri)
+    if url.get_backend_name() == 'sqlite' and url.database and url.database != ':memory:':
+        Path(url.database).parent.mkdir(parents=True, exist_ok=True)
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(f'PRAGMA {pragma}')
+    cursor.close()
+
+
+@cache
+def _create_engine(uri: str) -> AsyncEngine:
     from feedbackbot.users.models import User, UserLog
     from feedbackbot.topics.models import Topic, Message, Reply
-    return create_async_engine(settings.DB_URI, echo=False, poolclass=NullPool)
+
+    url = make_url(uri)
+    is_sqlite = url.get_backend_name() == 'sqlite'
+
+    if is_sqlite:
+        ensure_sqlite_directory(url)
+        connect_args = {}
+    else:
+        connect_args = {
+            'prepared_statement_cache_size': settings.DB_PREPARED_STATEMENT_CACHE_SIZE,
+        }
+
+    engine = create_async_engine(
+        url,
+        echo=False,
+        poolclass=InstrumentedAsyncQueuePool,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_POOL_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+        query_cache_size=settings.DB_QUERY_CACHE_SIZE,
+        connect_args=connect_args,
+    )
+
+    if is_sqlite:
+        event.listen(engine.sync_engine, 'connect', _set_sqlite_pragmas)
+
+    if uri == settings.DB_URI:
+        metrics.register('db.pool', lambda: pool_stats(engine.pool))
+
+    return engine
@@ -1,27 +1,37 @@
 from dependencies import Injector, value
-from sqlalchemy import NullPool
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 
-from feedbackbot import settings
+from feedbackbot.broadcasts.handlers import BroadcastCommandHandler
+from feedbackbot.broadcasts.repos import BroadcastRepo
+from feedbackbot.broadcasts.services import BroadcastService
 from feedbackbot.common.handlers import StartCommandHandler, HelpCommandHandler
-from feedbackbot.core.db import DBRefs
+from feedbackbot.core.db import DBRefs, UnitOfWork, get_engine, get_replica_engines, get_session_factory
+from feedbackbot.core.enums import OutboxKind
+from feedbackbot.core.media_groups import get_media_group_collector
+from feedbackbot.core.services import RetentionService, WarmupService
 from feedbackbot.handlers import RootErrorHandler
+from feedbackbot.outbox.repos import OutboxRepo, get_outbox_wakeup
+from feedbackbot.outbox.services import OutboxDispatcher
 from feedbackbot.topics.handlers import (
     ReplyMessageHandler, DeleteCommandHandler, DeleteHistoryCommandHandler
 )
-from feedbackbot.topics.repos import TopicRepo, ReplyRepo, MessageRepo
-from feedbackbot.topics.services import TopicService
+from feedbackbot.topics.repos import (
+    TopicRepo, ReplyRepo, MessageRepo, get_topic_cache, get_message_index, get_reply_index
+)
+from feedbackbot.topics.services import TopicService, get_topic_name_cache
 from feedbackbot.users.handlers import (
     ForwardMessageHandler, BanCommandHandler, UnbanCommandHandler, UserLogCommandHandler
 )
-from feedbackbot.users.repos import UserRepo, UserLogRepo
-from feedbackbot.users.services import UserService
+from feedbackbot.users.repos import UserRepo, UserLogRepo, get_user_cache, get_banned_user_ids
+from feedbackbot.users.services import UserService, get_user_card_cache
 
 
 # noinspection PyMethodParameters
 class DIAsync(Injector):
     db = DBRefs
+    unit_of_work = UnitOfWork
     root_error_handler = RootErrorHandler
+    retention_service = RetentionService
+    warmup_service = WarmupService
 
     # common
     start_command_handler = StartCommandHandler
@@ -47,10 +57,70 @@ class DIAsync(Injector):
     delete_command_handler = DeleteCommandHandler
     delete_history_command_handler = DeleteHistoryCommandHandler
 
+    # broadcasts
+    broadcast_service = BroadcastService
+    broadcast_repo = BroadcastRepo
+
+    broadcast_command_handler = BroadcastCommandHandler
+
+    # outbox
+    outbox_repo = OutboxRepo
+
     @value
     def engine():
-        return create_async_engine(settings.DB_URI, echo=False, poolclass=NullPool)
+        # движок создается один раз на процесс, иначе у каждого обработчика был бы свой пул
+        return get_engine()
+
+    @value
+    def replica_engines():
+        return get_replica_engines()
+
+    @value
+    def session(engine, replica_engines):
+        return get_session_factory(engine, replica_engines)
+
+    @value
+    def topic_cache():
+        # кэш общий для всех обработчиков, как и движок
+        return get_topic_cache()
+
+    @value
+    def topic_name_cache():
+        return get_topic_name_cache()
+
+    @value
+    def message_index():
+        return get_message_index()
+
+    @value
+    def reply_index():
+        return get_reply_index()
+
+    @value
+    def user_cache():
+        return get_user_cache()
+
+    @value
+    def banned_user_ids():
+        return get_banned_user_ids()
+
+    @value
+    def user_card_cache():
+        return get_user_card_cache()
+
+    @value
+    def media_group_collector():
+        return get_media_group_collector()
+
+    @value
+    def outbox_wakeup():
+        return get_outbox_wakeup()
+
+    outbox_dispatcher = OutboxDispatcher
 
     @value
-    def session(engine):
-        return async_sessionmaker(engine, expire_on_commit=False)
+    def outbox_handlers(forward_message_handler, topic_service):
+        return {
+            OutboxKind.FORWARD_USER_PM.value: forward_message_handler.deliver,
+            OutboxKind.REPLY_USER_PM.value: topic_service.deliver_reply,
+        }
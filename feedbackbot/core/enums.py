@@ -1,6 +1,25 @@
-from enum import Enum
+from enum import Enum, IntEnum
 
 
 class Role(str, Enum):
     ADMIN = "админ"
     OPERATOR = "оператор"
+
+
+class Priority(IntEnum):
+    """
+    Классы приоритета исходящих запросов к Bot API, от высшего к низшему.
+    """
+    OPERATOR_REPLY = 0
+    USER_FORWARD = 1
+    HOUSEKEEPING = 2
+    # рассылка (/broadcast) получает только остаток общего лимита
+    BROADCAST = 3
+
+
+class OutboxKind(str, Enum):
+    """
+    Виды запросов в очереди outbox (см. OutboxDispatcher).
+    """
+    FORWARD_USER_PM = 'forward_user_pm'
+    REPLY_USER_PM = 'reply_user_pm'
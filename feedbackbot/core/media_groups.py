@@ -0,0 +1,169 @@
+__all__ = ('MediaGroupCollector', 'get_media_group_collector')
+
+import asyncio
+import contextvars
+import logging
+from collections.abc import Awaitable, Callable
+from functools import cache
+
+from telegram import Message
+
+from feedbackbot import settings
+from feedbackbot.core.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+FlushCallback = Callable[[list[Message]], Awaitable[None]]
+
+
+class _PendingGroup:
+    __slots__ = ('chat_id', 'message_thread_id', 'messages', 'flush', 'deadline', 'full', 'task', 'previous')
+
+    def __init__(self, message: Message, flush: FlushCallback):
+        self.chat_id = message.chat_id
+        self.message_thread_id = message.message_thread_id
+        self.messages: list[Message] = []
+        self.flush = flush
+        self.deadline = 0.0
+        self.full = asyncio.Event()
+        self.task: asyncio.Task | None = None
+        # предыдущий незавершенный альбом из того же чата и топика
+        self.previous: _PendingGroup | None = None
+
+    @property
+    def key(self) -> tuple[int, int | None]:
+        return self.chat_id, self.message_thread_id
+
+
+class MediaGroupCollector:
+    """
+    Сборщик альбомов (media group).
+
+    Телеграм присылает каждое сообщение альбома отдельным обновлением. Сборщик копит сообщения с одним media_group_id,
+    пока новые приходят чаще, чем раз в window секунд (или пока альбом не заполнится), и передает весь альбом в flush
+    одним списком – альбом пересылается одним запросом к Bot API и записывается в БД одной транзакцией.
+
+    flush выполняется в отдельной задаче с чистым контекстом: контекстные переменные обновления, которое начало альбом
+    (сессия единицы работы, отложенные до коммита действия), к моменту сборки альбома уже недействительны, поэтому
+    flush сам открывает единицу работы.
+
+    Задача альбома выполняется вне блокировки ключа KeyedUpdateProcessor, поэтому альбомы одного чата и топика
+    отправляются по очереди: flush альбома ждет завершения предыдущего. Иначе два альбома нового пользователя (например,
+    20 фото, которые Телеграм делит на два альбома) одновременно создали бы ему два топика.
+    """
+
+    # максимальное количество сообщений в альбоме
+    MAX_SIZE = 10
+
+    def __init__(self, window: float, max_size: int = MAX_SIZE):
+        self._window = window
+        self._max_size = max_size
+        # альбомы, в которые еще добавляются сообщения, по media_group_id
+        self._collecting: dict[str, _PendingGroup] = {}
+        # все незавершенные альбомы, в том числе уже отправляемые
+        self._pending: set[_PendingGroup] = set()
+        # последний незавершенный альбом каждого чата и топика
+        self._tails: dict[tuple[int, int | None], _PendingGroup] = {}
+
+        self.groups_flushed = 0
+        self.messages_flushed = 0
+        self.errors = 0
+
+    def add(self, message: Message, flush: FlushCallback):
+        """
+        Добавляет сообщение в альбом. Обработчик альбома – flush из первого сообщения альбома.
+        """
+        loop = asyncio.get_running_loop()
+
+        group = self._collecting.get(message.media_group_id)
+        if group is None:
+            group = self._collecting[message.media_group_id] = _PendingGroup(message, flush)
+            group.previous = self._tails.get(group.key)
+            self._tails[group.key] = group
+            self._pending.add(group)
+            group.task = loop.create_task(
+                self._wait_and_flush(message.media_group_id, group), context=contextvars.Context()
+            )
+
+        group.messages.append(message)
+        group.deadline = loop.time() + self._window
+        if len(group.messages) >= self._max_size:
+            group.full.set()
+
+    async def flush_preceding(self, message: Message):
+        """
+        Отправляет незавершенные альбомы из того же чата и топика, что и message, не дожидаясь окна сбора. Вызывается
+        перед обработкой обычного сообщения, чтобы оно не обогнало отправленный раньше альбом.
+        """
+        await self._flush_now(
+            group for group in self._pending
+            if group.chat_id == message.chat_id and group.message_thread_id == message.message_thread_id
+        )
+
+    async def flush_all(self):
+        """
+        Отправляет все незавершенные альбомы, например при остановке бота.
+        """
+        await self._flush_now(self._pending)
+
+    async def _flush_now(self, groups):
+        tasks = []
+        for group in list(groups):
+            group.full.set()
+            tasks.append(group.task)
+
+        if tasks:
+            await asyncio.gather(*tasks)
+
+    def stats(self) -> dict:
+        return {
+            'pending': len(self._pending),
+            'groups_flushed': self.groups_flushed,
+            'messages_flushed': self.messages_flushed,
+            'errors': self.errors,
+        }
+
+    async def _wait_and_flush(self, media_group_id: str, group: _PendingGroup):
+        loop = asyncio.get_running_loop()
+
+        # окно сбора отсчитывается от последнего полученного сообщения
+        while not group.full.is_set() and (delay := group.deadline - loop.time()) > 0:
+            try:
+                await asyncio.wait_for(group.full.wait(), delay)
+            except TimeoutError:
+                pass
+
+        # опоздавшие сообщения начнут новый альбом
+        del self._collecting[media_group_id]
+
+        # обновления могли прийти не по порядку, а Bot API ожидает возрастающие ID сообщений
+        messages = sorted(group.messages, key=lambda message: message.id)
+
+        try:
+            if group.previous is not None:
+                # wait, а не await: отмена предыдущего альбома не должна отменять этот
+                await asyncio.wait([group.previous.task])
+            await group.flush(messages)
+        except Exception:
+            # задача фоновая: обработчик ошибок приложения ее исключений не увидит
+            self.errors += 1
+            logger.exception(f'Failed to process media group: {media_group_id}')
+        else:
+            self.groups_flushed += 1
+            self.messages_flushed += len(messages)
+        finally:
+            self._pending.discard(group)
+            group.previous = None
+            if self._tails.get(group.key) is group:
+                del self._tails[group.key]
+
+
+@cache
+def get_media_group_collector() -> MediaGroupCollector:
+    """
+    Сборщик альбомов. Один на процесс, как и кэши.
+    """
+    collector = MediaGroupCollector(settings.MEDIA_GROUP_WINDOW)
+    metrics.register('media_groups', collector.stats)
+
+    return collector
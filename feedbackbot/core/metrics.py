@@ -0,0 +1,37 @@
+__all__ = ('MetricsRegistry', 'metrics')
+
+import asyncio
+import logging
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+
+class MetricsRegistry:
+    """
+    Реестр метрик приложения.
+
+    Компоненты регистрируют под своим именем функцию, возвращающую словарь со статистикой. Метрики собираются по
+    требованию либо периодически выводятся в лог.
+    """
+
+    def __init__(self):
+        self._providers: dict[str, Callable[[], dict]] = {}
+
+    def register(self, name: str, provider: Callable[[], dict]):
+        self._providers[name] = provider
+
+    def unregister(self, name: str):
+        self._providers.pop(name, None)
+
+    def collect(self) -> dict[str, dict]:
+        return {name: provider() for name, provider in self._providers.items()}
+
+    async def log_periodically(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            for name, values in self.collect().items():
+                logger.info(f'METRICS {name}: {values}')
+
+
+metrics = MetricsRegistry()
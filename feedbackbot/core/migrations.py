@@ -0,0 +1,42 @@
+__all__ = ('get_config', 'upgrade', 'downgrade', 'stamp', 'make_migration')
+
+from alembic import command
+from alembic.config import Config
+from alembic.script import ScriptDirectory
+
+from feedbackbot import settings
+
+MIGRATIONS_PATH = settings.ROOT_PATH / 'feedbackbot' / 'migrations'
+
+
+def get_config() -> Config:
+    """
+    Конфигурация Alembic. Файл alembic.ini не используется: все настройки берутся из settings.
+    """
+    config = Config()
+    config.set_main_option('script_location', str(MIGRATIONS_PATH))
+    config.set_main_option('file_template', '%%(rev)s_%%(slug)s')
+
+    return config
+
+
+def upgrade(revision: str = 'head'):
+    command.upgrade(get_config(), revision)
+
+
+def downgrade(revision: str):
+    command.downgrade(get_config(), revision)
+
+
+def stamp(revision: str = 'head'):
+    command.stamp(get_config(), revision)
+
+
+def make_migration(message: str, autogenerate: bool = True):
+    config = get_config()
+
+    # ревизии нумеруются последовательно: 0001, 0002, ...
+    head = ScriptDirectory.from_config(config).get_current_head()
+    rev_id = f'{int(head) + 1:04d}' if head and head.isdigit() else None
+
+    command.revision(config, message=message, autogenerate=autogenerate, rev_id=rev_id)
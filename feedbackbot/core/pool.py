@@ -0,0 +1,82 @@
+__all__ = ('PoolStats', 'InstrumentedAsyncQueuePool', 'pool_stats')
+
+import time
+
+from sqlalchemy import AsyncAdaptedQueuePool, Pool
+
+
+class PoolStats:
+    """
+    Статистика пула соединений: количество выдач соединений, время ожидания и события overflow.
+    """
+
+    def __init__(self):
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.overflows = 0
+
+    def record_checkout(self, wait: float):
+        self.checkouts += 1
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+
+    def record_overflow(self):
+        self.overflows += 1
+
+    def as_dict(self) -> dict:
+        return {
+            'checkouts': self.checkouts,
+            'wait_avg_ms': round(self.wait_total / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+            'wait_max_ms': round(self.wait_max * 1000, 3),
+            'overflow_events': self.overflows,
+        }
+
+
+class InstrumentedPoolMixin:
+    """
+    Примесь к QueuePool, которая собирает статистику. Время ожидания включает в себя ожидание свободного соединения,
+    установку нового соединения и pre-ping.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            self.stats.record_checkout(time.perf_counter() - started)
+
+    def _create_connection(self):
+        # QueuePool увеличивает счетчик overflow до создания соединения, поэтому положительное значение значит, что
+        # соединение создается сверх pool_size
+        if self._overflow > 0:
+            self.stats.record_overflow()
+        return super()._create_connection()
+
+
+class InstrumentedAsyncQueuePool(InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def pool_stats(pool: Pool) -> dict:
+    """
+    Статистика пула: текущее состояние и накопленные счетчики, если пул их собирает.
+    """
+    stats = {}
+
+    if hasattr(pool, 'checkedout'):
+        stats.update({
+            'size': pool.size(),
+            'checked_out': pool.checkedout(),
+            'checked_in': pool.checkedin(),
+            'overflow': pool.overflow(),
+        })
+
+    if isinstance(pool, InstrumentedPoolMixin):
+        stats.update(pool.stats.as_dict())
+
+    return stats
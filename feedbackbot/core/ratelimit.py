@@ -0,0 +1,236 @@
+__all__ = ('PriorityRateLimiter', 'PriorityGate', 'get_request_priority', 'request_priority')
+
+import asyncio
+import time
+from collections import deque
+from collections.abc import AsyncIterator, Hashable, Iterator
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from functools import partial
+
+from telegram.ext import AIORateLimiter
+
+from feedbackbot.core.enums import Priority
+from feedbackbot.core.metrics import metrics
+
+# Приоритет по методу Bot API. Ответы оператора по методу и чату не отличить от служебных сообщений и рассылки,
+# поэтому их класс задает вызывающий код (см. request_priority)
+ENDPOINT_PRIORITIES = {
+    # пересылка сообщений пользователя в чат операторов (и создание топика для нее)
+    'forwardMessage': Priority.USER_FORWARD,
+    'forwardMessages': Priority.USER_FORWARD,
+    'createForumTopic': Priority.USER_FORWARD,
+    # массовое удаление (/delhistory) идет и в личные чаты, но не должно тормозить ответы
+    'deleteMessage': Priority.HOUSEKEEPING,
+    'deleteMessages': Priority.HOUSEKEEPING,
+}
+
+# Приоритет и чат текущего запроса: AIORateLimiter передает в _run_request только признак группы
+_current_request: ContextVar[tuple[Priority, Hashable] | None] = ContextVar('current_request', default=None)
+# Приоритет, заданный вызывающим кодом (см. request_priority)
+_priority_override: ContextVar[Priority | None] = ContextVar('priority_override', default=None)
+
+
+@contextmanager
+def request_priority(priority: Priority) -> Iterator[None]:
+    """
+    Задает класс приоритета всем запросам к Bot API внутри блока, например ответу оператора или рассылке: по чату и
+    методу их не отличить друг от друга и от служебных сообщений.
+
+        with request_priority(Priority.OPERATOR_REPLY):
+            await bot.copy_message(...)
+    """
+    token = _priority_override.set(priority)
+    try:
+        yield
+    finally:
+        _priority_override.reset(token)
+
+
+def get_request_priority(endpoint: str) -> Priority:
+    """
+    Класс приоритета запроса к Bot API, если вызывающий код не задал его сам (см. request_priority).
+
+    Пересылка сообщений пользователей определяется по методу. Все остальное, в том числе сообщения в личный чат
+    пользователю (оповещения о бане, ответы бота на команды), – служебные запросы.
+    """
+    return ENDPOINT_PRIORITIES.get(endpoint, Priority.HOUSEKEEPING)
+
+
+class _Waiter:
+    __slots__ = ('priority', 'chat_id', 'future')
+
+    def __init__(self, priority: Priority, chat_id: Hashable, future: asyncio.Future):
+        self.priority = priority
+        self.chat_id = chat_id
+        self.future = future
+
+
+class _FairQueue:
+    """
+    Очередь одного класса приоритета: чаты обслуживаются по кругу, запросы внутри чата – по порядку.
+    """
+    __slots__ = ('chats', 'rotation', 'size')
+
+    def __init__(self):
+        self.chats: dict[Hashable, deque[_Waiter]] = {}
+        self.rotation: deque[Hashable] = deque()
+        self.size = 0
+
+    def push(self, waiter: _Waiter):
+        waiters = self.chats.get(waiter.chat_id)
+        if waiters is None:
+            waiters = self.chats[waiter.chat_id] = deque()
+            self.rotation.append(waiter.chat_id)
+        waiters.append(waiter)
+        self.size += 1
+
+    def pop(self) -> _Waiter:
+        chat_id = self.rotation.popleft()
+        waiters = self.chats[chat_id]
+        waiter = waiters.popleft()
+        self.size -= 1
+
+        if waiters:
+            self.rotation.append(chat_id)
+        else:
+            del self.chats[chat_id]
+
+        return waiter
+
+    def remove(self, waiter: _Waiter):
+        waiters = self.chats[waiter.chat_id]
+        waiters.remove(waiter)
+        self.size -= 1
+
+        if not waiters:
+            del self.chats[waiter.chat_id]
+            self.rotation.remove(waiter.chat_id)
+
+
+class PriorityGate:
+    """
+    Очередь к общему ресурсу с одним местом: место достается запросу с высшим приоритетом, внутри приоритета – чатам
+    по кругу.
+    """
+
+    def __init__(self):
+        self._queues = {priority: _FairQueue() for priority in Priority}
+        self._busy = False
+
+    def queued(self, priority: Priority) -> int:
+        return self._queues[priority].size
+
+    @asynccontextmanager
+    async def __call__(self, priority: Priority, chat_id: Hashable) -> AsyncIterator[None]:
+        if self._busy or any(queue.size for queue in self._queues.values()):
+            waiter = _Waiter(priority, chat_id, asyncio.get_running_loop().create_future())
+            self._queues[priority].push(waiter)
+
+            try:
+                await waiter.future
+            except asyncio.CancelledError:
+                if waiter.future.cancelled():
+                    self._queues[priority].remove(waiter)
+                else:
+                    # место уже передано этому запросу: отдаем его следующему
+                    self._release()
+                raise
+        else:
+            self._busy = True
+
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _release(self):
+        for queue in self._queues.values():
+            if queue.size:
+                # место переходит к следующему запросу, не освобождаясь
+                queue.pop().future.set_result(None)
+                return
+
+        self._busy = False
+
+
+class _PriorityStats:
+    __slots__ = ('processed', 'wait_total', 'wait_max')
+
+    def __init__(self):
+        self.processed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record(self, wait: float):
+        self.processed += 1
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+
+
+class PriorityRateLimiter(AIORateLimiter):
+    """
+    AIORateLimiter с классами приоритета (см. Priority и get_request_priority).
+
+    Переопределяет внутренний AIORateLimiter._run_request и использует его лимитеры (_base_limiter,
+    _get_group_limiter, _retry_after_event): версия PTB закреплена в requirements.txt, а тест
+    test_ptb_internals проверяет, что они не изменились.
+
+    Лимиты те же, что у AIORateLimiter: общий на бота и отдельный на каждую группу. Лимит группы ожидается первым и
+    независимо для каждого чата, поэтому исчерпанный лимит чата операторов не задерживает ответы пользователям. Общий
+    лимит распределяется через PriorityGate: когда он исчерпан, следующим проходит запрос высшего класса, а внутри
+    класса чаты чередуются, и поток запросов в один чат не занимает весь лимит. Приоритеты строгие: задержка ответов
+    оператора ограничена временем ожидания общего лимита и не зависит от количества служебных запросов в очереди.
+    """
+
+    __slots__ = ('_gate', '_stats')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._gate = PriorityGate()
+        self._stats = {priority: _PriorityStats() for priority in Priority}
+
+    async def initialize(self):
+        for priority in Priority:
+            metrics.register(f'ratelimit.{priority.name.lower()}', partial(self.stats, priority))
+
+    async def shutdown(self):
+        for priority in Priority:
+            metrics.unregister(f'ratelimit.{priority.name.lower()}')
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get('chat_id')
+        priority = _priority_override.get()
+        if priority is None:
+            priority = get_request_priority(endpoint)
+
+        token = _current_request.set((priority, chat_id))
+        try:
+            return await super().process_request(callback, args, kwargs, endpoint, data, rate_limit_args)
+        finally:
+            _current_request.reset(token)
+
+    async def _run_request(self, chat, group, callback, args, kwargs):
+        priority, chat_id = _current_request.get() or (Priority.HOUSEKEEPING, None)
+        started = time.perf_counter()
+
+        if group and self._group_max_rate:
+            await self._get_group_limiter(group).acquire()
+
+        if chat and self._base_limiter:
+            async with self._gate(priority, chat_id):
+                await self._base_limiter.acquire()
+
+        await self._retry_after_event.wait()
+        self._stats[priority].record(time.perf_counter() - started)
+
+        return await callback(*args, **kwargs)
+
+    def stats(self, priority: Priority) -> dict:
+        stats = self._stats[priority]
+        return {
+            'queued': self._gate.queued(priority),
+            'processed': stats.processed,
+            'wait_avg_ms': round(stats.wait_total / stats.processed * 1000, 3) if stats.processed else 0.0,
+            'wait_max_ms': round(stats.wait_max * 1000, 3),
+        }
@@ -0,0 +1,125 @@
+import asyncio
+import datetime
+import logging
+import time
+
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from feedbackbot import settings
+from feedbackbot.core.cache import TTLCache
+from feedbackbot.core.db import DBRefs
+from feedbackbot.outbox.repos import OutboxRepo
+from feedbackbot.topics.repos import TopicRepo, MessageRepo, ReplyRepo
+from feedbackbot.users.repos import UserRepo, UserLogRepo
+from feedbackbot.users.services import UserCard
+
+logger = logging.getLogger(__name__)
+
+
+class WarmupService:
+    """
+    Прогрев БД перед обработкой обновлений. После деплоя первыми приходят все накопившиеся обновления, и они не должны
+    ждать установки соединений, подготовки запросов и чтения данных с диска.
+
+    Прогреваются пулы основной БД и всех реплик: при настроенных репликах большая часть чтений идет в них.
+    """
+
+    def __init__(self, db: DBRefs, topic_repo: TopicRepo, message_repo: MessageRepo, reply_repo: ReplyRepo,
+                 user_repo: UserRepo, user_log_repo: UserLogRepo):
+        self._db = db
+        self._topic_repo = topic_repo
+        self._user_repo = user_repo
+        self._repos = (topic_repo, message_repo, reply_repo, user_repo, user_log_repo)
+
+    async def warm_up(self) -> float:
+        """
+        :return: длительность прогрева в секундах
+        """
+        started = time.perf_counter()
+
+        engines = (self._db.engine, *self._db.replica_engines)
+        await asyncio.gather(*(self._warm_up_pool(engine) for engine in engines))
+
+        # последние топики и их пользователи сразу попадают в кэши
+        topic_refs = await self._topic_repo.preload_topics(settings.DB_WARMUP_TOPICS)
+        users_count = await self._user_repo.preload_users({topic_ref.user_id for topic_ref in topic_refs})
+
+        duration = time.perf_counter() - started
+        logger.info(
+            f'Warm-up finished in {duration:.3f}s: {len(engines)} pools of {settings.DB_POOL_SIZE} connections, '
+            f'{len(topic_refs)} topics, {users_count} users'
+        )
+
+        return duration
+
+    async def _warm_up_pool(self, engine: AsyncEngine):
+        # соединения открываются одновременно, иначе пул выдавал бы одно и то же соединение
+        ready = asyncio.Barrier(settings.DB_POOL_SIZE)
+        await asyncio.gather(*(self._warm_up_connection(engine, ready) for _ in range(settings.DB_POOL_SIZE)))
+
+    async def _warm_up_connection(self, engine: AsyncEngine, ready: asyncio.Barrier):
+        async with engine.connect() as con:
+            await ready.wait()
+
+            # запросы компилируются один раз на процесс, а prepared statements создаются на каждом соединении
+            for repo in self._repos:
+                for stmt, params in repo.hot_statements():
+                    await con.execute(stmt, params)
+
+
+class RetentionService:
+    """
+    Удаление устаревших данных согласно настройкам RETENTION_*.
+    """
+
+    def __init__(self, message_repo: MessageRepo, reply_repo: ReplyRepo, user_log_repo: UserLogRepo,
+                 outbox_repo: OutboxRepo, user_card_cache: TTLCache[int, UserCard]):
+        self._message_repo = message_repo
+        self._reply_repo = reply_repo
+        self._user_log_repo = user_log_repo
+        self._outbox_repo = outbox_repo
+        self._user_card_cache = user_card_cache
+
+    @property
+    def enabled(self) -> bool:
+        return bool(
+            settings.RETENTION_MESSAGES_DAYS or settings.RETENTION_USER_LOGS_DAYS or settings.RETENTION_OUTBOX_DAYS
+        )
+
+    async def purge(self) -> dict[str, int]:
+        """
+        Удаляет устаревшие записи порциями.
+
+        :return: количество удаленных записей по таблицам
+        """
+        now = datetime.datetime.now(datetime.timezone.utc)
+        purged = {}
+
+        if settings.RETENTION_MESSAGES_DAYS:
+            older_than = now - datetime.timedelta(days=settings.RETENTION_MESSAGES_DAYS)
+            purged['messages'] = await self._message_repo.purge_messages(older_than)
+            purged['replies'] = await self._reply_repo.purge_replies(older_than)
+
+        if settings.RETENTION_USER_LOGS_DAYS:
+            older_than = now - datetime.timedelta(days=settings.RETENTION_USER_LOGS_DAYS)
+            purged['user_logs'] = await self._user_log_repo.purge_user_logs(older_than)
+            # карточки пользователей собраны в том числе из удаленных записей
+            self._user_card_cache.clear()
+
+        if settings.RETENTION_OUTBOX_DAYS:
+            older_than = now - datetime.timedelta(days=settings.RETENTION_OUTBOX_DAYS)
+            purged['outbox'] = await self._outbox_repo.purge_processed(older_than)
+
+        logger.info(f'Purged expired records: {purged}')
+
+        return purged
+
+    async def purge_periodically(self, interval: float):
+        while True:
+            try:
+                await self.purge()
+            except Exception:
+                # очистка повторится через интервал, падение задачи остановило бы ее навсегда
+                logger.exception('Failed to purge expired records')
+
+            await asyncio.sleep(interval)
@@ -0,0 +1,129 @@
+__all__ = ('KeyedUpdateProcessor', 'get_update_key')
+
+import asyncio
+import time
+from collections.abc import AsyncIterator, Awaitable, Callable, Hashable
+from contextlib import asynccontextmanager
+from typing import Any
+
+from telegram import Chat, Update
+from telegram.ext import BaseUpdateProcessor
+
+from feedbackbot.core.metrics import metrics
+
+
+def get_update_key(update: object) -> Hashable | None:
+    """
+    Ключ упорядочивания обновления: личный чат пользователя, топик группы либо сам чат. Обновления без чата (например,
+    изменения статуса бота) ни с чем не упорядочиваются.
+    """
+    if not isinstance(update, Update) or update.effective_chat is None:
+        return None
+
+    chat = update.effective_chat
+    if chat.type == Chat.PRIVATE:
+        return 'user', chat.id
+
+    message = update.effective_message
+    if message is not None and message.is_topic_message:
+        return 'topic', chat.id, message.message_thread_id
+
+    return 'chat', chat.id
+
+
+class _KeyLock:
+    __slots__ = ('lock', 'users')
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        # обновления с этим ключом, которые обрабатываются или ждут очереди
+        self.users = 0
+
+
+class KeyedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Параллельная обработка обновлений с сохранением порядка внутри ключа (см. get_update_key).
+
+    Обновления одного пользователя или топика обрабатываются строго по очереди, обновления разных ключей – параллельно,
+    не больше concurrency одновременно. Базовый класс ограничивает количество принятых обновлений (max_pending): слот
+    занимают и ожидающие своей очереди обновления, поэтому лимит параллельности применяется отдельно, уже после
+    получения блокировки ключа – иначе поток сообщений от одного пользователя занял бы все слоты.
+
+    Порядок сохраняется, потому что Application создает задачи обновлений в порядке получения, а блокировки и семафоры
+    asyncio пропускают ожидающих в порядке очереди.
+    """
+
+    def __init__(self, concurrency: int, max_pending: int,
+                 get_key: Callable[[object], Hashable | None] = get_update_key):
+        super().__init__(max(concurrency, max_pending))
+        self._concurrency = concurrency
+        self._workers = asyncio.BoundedSemaphore(concurrency)
+        self._get_key = get_key
+        self._keys: dict[Hashable, _KeyLock] = {}
+
+        self.pending = 0
+        self.in_progress = 0
+        self.processed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]):
+        received = time.perf_counter()
+        started = False
+        self.pending += 1
+
+        try:
+            async with self._key_lock(self._get_key(update)), self._workers:
+                started = True
+                self.pending -= 1
+                self.in_progress += 1
+                self._record_wait(time.perf_counter() - received)
+
+                await coroutine
+
+        finally:
+            if started:
+                self.in_progress -= 1
+                self.processed += 1
+            else:
+                self.pending -= 1
+
+    async def initialize(self):
+        metrics.register('updates', self.stats)
+
+    async def shutdown(self):
+        metrics.unregister('updates')
+
+    def stats(self) -> dict:
+        return {
+            'concurrency': self._concurrency,
+            'pending': self.pending,
+            'in_progress': self.in_progress,
+            'processed': self.processed,
+            'keys': len(self._keys),
+            'wait_avg_ms': round(self.wait_total / self.processed * 1000, 3) if self.processed else 0.0,
+            'wait_max_ms': round(self.wait_max * 1000, 3),
+        }
+
+    @asynccontextmanager
+    async def _key_lock(self, key: Hashable | None) -> AsyncIterator[None]:
+        if key is None:
+            yield
+            return
+
+        key_lock = self._keys.get(key)
+        if key_lock is None:
+            key_lock = self._keys[key] = _KeyLock()
+        key_lock.users += 1
+
+        try:
+            async with key_lock.lock:
+                yield
+        finally:
+            key_lock.users -= 1
+            if not key_lock.users:
+                del self._keys[key]
+
+    def _record_wait(self, wait: float):
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
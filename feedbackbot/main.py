@@ -1,9 +1,40 @@
+import secrets
+
+from feedbackbot import settings
 from feedbackbot.bot import app
 
 
-if __name__ == '__main__':
+def run_webhook():
+    """
+    Встроенный HTTP-сервер PTB: обновления приходят сразу, без задержки интервала опроса. Запросы без верного
+    секретного токена отклоняются.
+    """
+    app.run_webhook(
+        listen=settings.WEBHOOK_LISTEN,
+        port=settings.WEBHOOK_PORT,
+        url_path=settings.WEBHOOK_PATH,
+        webhook_url=f'{settings.WEBHOOK_URL.rstrip("/")}/{settings.WEBHOOK_PATH}',
+        secret_token=settings.WEBHOOK_SECRET_TOKEN or secrets.token_urlsafe(32),
+        max_connections=settings.WEBHOOK_MAX_CONNECTIONS,
+        # установить на True чтобы бот не получал пропущенные уведомления
+        drop_pending_updates=False,
+    )
+
+
+def run_polling():
+    # при запуске опроса PTB удаляет вебхук, если он был установлен
     app.run_polling(
-        poll_interval=1,
+        poll_interval=settings.POLL_INTERVAL,
         # установить на True чтобы бот не получал пропущенные уведомления
         drop_pending_updates=False
     )
+
+
+if __name__ == '__main__':
+    if settings.UPDATES_MODE == 'webhook':
+        # деплой, настроенный на вебхук, не должен незаметно перейти на опрос
+        if not settings.WEBHOOK_URL:
+            raise RuntimeError('TG_UPDATES_MODE=webhook requires TG_WEBHOOK_URL')
+        run_webhook()
+    else:
+        run_polling()
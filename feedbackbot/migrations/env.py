@@ -0,0 +1,62 @@
+import asyncio
+
+from alembic import context
+from sqlalchemy import NullPool
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from feedbackbot import settings
+from feedbackbot.core.db import Base, ensure_sqlite_directory
+from feedbackbot.users.models import User, UserLog
+from feedbackbot.topics.models import Topic, Message, Reply
+from feedbackbot.outbox.models import OutboxEntry
+from feedbackbot.broadcasts.models import Broadcast
+
+config = context.config
+target_metadata = Base.metadata
+
+
+def run_migrations_offline() -> None:
+    context.configure(
+        url=settings.DB_URI,
+        target_metadata=target_metadata,
+        literal_binds=True,
+        dialect_opts={'paramstyle': 'named'},
+    )
+
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def do_run_migrations(connection: Connection) -> None:
+    context.configure(
+        connection=connection,
+        target_metadata=target_metadata,
+        # каждая миграция в своей транзакции, чтобы миграции с autocommit_block (CREATE INDEX CONCURRENTLY) не
+        # влияли на соседние
+        transaction_per_migration=True,
+    )
+
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+async def run_async_migrations() -> None:
+    # миграции используют отдельный движок без пула: они выполняются в своем цикле событий
+    ensure_sqlite_directory(settings.DB_URI)
+    engine = create_async_engine(settings.DB_URI, poolclass=NullPool)
+
+    async with engine.connect() as connection:
+        await connection.run_sync(do_run_migrations)
+
+    await engine.dispose()
+
+
+def run_migrations_online() -> None:
+    asyncio.run(run_async_migrations())
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
@@ -0,0 +1,78 @@
+"""initial
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = '0001'
+down_revision: Union[str, Sequence[str], None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _create_table(name, *columns):
+    # до появления миграций схема создавалась через Base.metadata.create_all, в таких базах таблицы уже есть
+    if not sa.inspect(op.get_bind()).has_table(name):
+        op.create_table(name, *columns)
+
+
+def upgrade() -> None:
+    _create_table(
+        'users',
+        sa.Column('id', sa.BigInteger(), nullable=False),
+        sa.Column('version', sa.BigInteger(), nullable=False),
+        sa.Column('is_banned', sa.Boolean(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    _create_table(
+        'user_logs',
+        sa.Column('id', sa.BigInteger().with_variant(sa.Integer(), 'sqlite'), autoincrement=True, nullable=False),
+        sa.Column('user_id', sa.BigInteger(), nullable=False),
+        sa.Column('timestamp', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+        sa.Column('field', sa.String(), nullable=False),
+        sa.Column('value', sa.String(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    _create_table(
+        'topics',
+        sa.Column('id', sa.BigInteger(), nullable=False),
+        sa.Column('user_id', sa.BigInteger(), nullable=False),
+        sa.Column('version', sa.BigInteger(), nullable=False),
+        sa.Column('is_open', sa.Boolean(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    _create_table(
+        'messages',
+        sa.Column('id', sa.BigInteger(), nullable=False),
+        sa.Column('topic_id', sa.BigInteger(), nullable=False),
+        sa.Column('version', sa.BigInteger(), nullable=False),
+        sa.Column('bot_message_id', sa.BigInteger(), nullable=False),
+        sa.ForeignKeyConstraint(['topic_id'], ['topics.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    _create_table(
+        'replies',
+        sa.Column('id', sa.BigInteger(), nullable=False),
+        sa.Column('topic_id', sa.BigInteger(), nullable=False),
+        sa.Column('version', sa.BigInteger(), nullable=False),
+        sa.Column('bot_message_id', sa.BigInteger(), nullable=False),
+        sa.ForeignKeyConstraint(['topic_id'], ['topics.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('replies')
+    op.drop_table('messages')
+    op.drop_table('topics')
+    op.drop_table('user_logs')
+    op.drop_table('users')
@@ -0,0 +1,38 @@
+"""hot path indexes
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 12:10:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+revision: str = '0002'
+down_revision: Union[str, Sequence[str], None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+INDEXES = (
+    ('ix_messages_bot_message_id', 'messages', ['bot_message_id']),
+    ('ix_messages_topic_id', 'messages', ['topic_id']),
+    ('ix_replies_topic_id', 'replies', ['topic_id']),
+    ('ix_topics_user_id', 'topics', ['user_id']),
+    ('ix_user_logs_user_id_field_timestamp', 'user_logs', ['user_id', 'field', 'timestamp']),
+)
+
+
+def upgrade() -> None:
+    # CREATE INDEX CONCURRENTLY не блокирует запись в таблицу, но не может выполняться в транзакции
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, if_not_exists=True, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, _ in INDEXES:
+            op.drop_index(name, table_name=table, if_exists=True, postgresql_concurrently=True)
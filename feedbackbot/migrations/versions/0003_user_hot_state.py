@@ -0,0 +1,51 @@
+"""user hot state
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 12:20:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = '0003'
+down_revision: Union[str, Sequence[str], None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+BACKFILL = '''
+UPDATE users SET
+    full_name = (
+        SELECT value FROM user_logs
+        WHERE user_logs.user_id = users.id AND user_logs.field = 'full_name'
+        ORDER BY user_logs.timestamp DESC, user_logs.id DESC
+        LIMIT 1
+    ),
+    username = (
+        SELECT value FROM user_logs
+        WHERE user_logs.user_id = users.id AND user_logs.field = 'username'
+        ORDER BY user_logs.timestamp DESC, user_logs.id DESC
+        LIMIT 1
+    ),
+    active_topic_id = (
+        SELECT max(topics.id) FROM topics WHERE topics.user_id = users.id
+    )
+'''
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('full_name', sa.String(), nullable=True))
+    op.add_column('users', sa.Column('username', sa.String(), nullable=True))
+    op.add_column('users', sa.Column('active_topic_id', sa.BigInteger(), nullable=True))
+
+    op.execute(BACKFILL)
+
+
+def downgrade() -> None:
+    op.drop_column('users', 'active_topic_id')
+    op.drop_column('users', 'username')
+    op.drop_column('users', 'full_name')
@@ -0,0 +1,54 @@
+"""created at and retention indexes
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 12:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = '0004'
+down_revision: Union[str, Sequence[str], None] = '0003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+TABLES = ('messages', 'replies')
+
+INDEXES = (
+    ('ix_messages_created_at', 'messages', ['created_at']),
+    ('ix_replies_created_at', 'replies', ['created_at']),
+    ('ix_user_logs_timestamp', 'user_logs', ['timestamp']),
+)
+
+
+def upgrade() -> None:
+    # SQLite не добавляет колонку с непостоянным значением по умолчанию, поэтому там таблица пересоздается.
+    # В PostgreSQL колонка добавляется без перезаписи таблицы, существующие записи получают время миграции.
+    recreate = 'always' if op.get_context().dialect.name == 'sqlite' else 'auto'
+    for table in TABLES:
+        with op.batch_alter_table(table, recreate=recreate) as batch_op:
+            batch_op.add_column(
+                sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False)
+            )
+
+    # BRIN-индексы по времени: очистка устаревших записей не сканирует таблицы целиком
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(
+                name, table, columns, if_not_exists=True, postgresql_using='brin', postgresql_concurrently=True
+            )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, _ in INDEXES:
+            op.drop_index(name, table_name=table, if_exists=True, postgresql_concurrently=True)
+
+    for table in TABLES:
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('created_at')
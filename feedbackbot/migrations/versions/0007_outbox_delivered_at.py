@@ -0,0 +1,56 @@
+"""outbox delivered at
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = '0007'
+down_revision: Union[str, Sequence[str], None] = '0006'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+PENDING = sa.text('delivered_at IS NULL AND dropped_at IS NULL')
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('outbox') as batch_op:
+        batch_op.add_column(sa.Column('delivered_at', sa.DateTime(timezone=True), nullable=True))
+        batch_op.add_column(sa.Column('dropped_at', sa.DateTime(timezone=True), nullable=True))
+
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_outbox_pending_ordering_key_id', 'outbox', ['ordering_key', 'id'], if_not_exists=True,
+            postgresql_where=PENDING, sqlite_where=PENDING, postgresql_concurrently=True,
+        )
+        op.create_index(
+            'ix_outbox_delivered_at', 'outbox', ['delivered_at'], if_not_exists=True, postgresql_using='brin',
+            postgresql_concurrently=True,
+        )
+        op.drop_index('ix_outbox_ordering_key_id', table_name='outbox', if_exists=True, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    # выполненные запросы удалялись из очереди сразу
+    op.execute(sa.text('DELETE FROM outbox WHERE delivered_at IS NOT NULL OR dropped_at IS NOT NULL'))
+
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_outbox_ordering_key_id', 'outbox', ['ordering_key', 'id'], if_not_exists=True,
+            postgresql_concurrently=True,
+        )
+        op.drop_index('ix_outbox_delivered_at', table_name='outbox', if_exists=True, postgresql_concurrently=True)
+        op.drop_index(
+            'ix_outbox_pending_ordering_key_id', table_name='outbox', if_exists=True, postgresql_concurrently=True
+        )
+
+    with op.batch_alter_table('outbox') as batch_op:
+        batch_op.drop_column('dropped_at')
+        batch_op.drop_column('delivered_at')
@@ -0,0 +1,50 @@
+__all__ = ('OutboxEntry',)
+import datetime
+
+from sqlalchemy import BigInteger, Integer, DateTime, Index, JSON, func, text
+from sqlalchemy.orm import Mapped, mapped_column
+
+from feedbackbot.core.db import Base
+
+
+class OutboxEntry(Base):
+    """
+    Отложенный запрос к Bot API. Записывается в одной транзакции с данными, к которым относится, и выполняется
+    диспетчером после коммита (см. OutboxDispatcher).
+
+    Выполненные и отброшенные запросы остаются в таблице до очистки (RETENTION_OUTBOX_DAYS): ключ идемпотентности
+    отсеивает и обновления, которые Телеграм прислал повторно уже после выполнения запроса.
+    """
+    __tablename__ = 'outbox'
+    __table_args__ = (
+        # голова очереди каждого ordering_key: только невыполненные запросы
+        Index(
+            'ix_outbox_pending_ordering_key_id', 'ordering_key', 'id',
+            postgresql_where=text('delivered_at IS NULL AND dropped_at IS NULL'),
+            sqlite_where=text('delivered_at IS NULL AND dropped_at IS NULL'),
+        ),
+        Index('ix_outbox_delivered_at', 'delivered_at', postgresql_using='brin'),
+    )
+
+    # SQLite генерирует значения только для колонки INTEGER PRIMARY KEY
+    id: Mapped[int] = mapped_column(
+        BigInteger().with_variant(Integer, 'sqlite'), primary_key=True, autoincrement=True
+    )
+
+    # ключ идемпотентности: повторно полученное обновление не ставит запрос в очередь второй раз
+    key: Mapped[str] = mapped_column(unique=True)
+    kind: Mapped[str] = mapped_column()
+    payload: Mapped[dict] = mapped_column(JSON)
+    # запросы с одним ordering_key выполняются строго по очереди
+    ordering_key: Mapped[str] = mapped_column()
+
+    attempts: Mapped[int] = mapped_column(default=0)
+    next_attempt_at: Mapped[datetime.datetime] = mapped_column(DateTime(timezone=True))
+    last_error: Mapped[str | None] = mapped_column()
+    delivered_at: Mapped[datetime.datetime | None] = mapped_column(DateTime(timezone=True))
+    # запрос отброшен после неисправимой ошибки или исчерпания попыток
+    dropped_at: Mapped[datetime.datetime | None] = mapped_column(DateTime(timezone=True))
+
+    created_at: Mapped[datetime.datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now()
+    )
@@ -0,0 +1,136 @@
+import asyncio
+import datetime
+from collections.abc import Sequence
+from functools import cache
+from typing import Callable
+
+from sqlalchemy import select, exists, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+
+from feedbackbot.core.db import BaseAsyncDBRepo, on_commit
+from feedbackbot.outbox.models import OutboxEntry
+
+
+class OutboxRepo(BaseAsyncDBRepo[OutboxEntry]):
+    model_class = OutboxEntry
+
+    def __init__(self, session: Callable[..., AsyncSession], outbox_wakeup: asyncio.Event):
+        super().__init__(session)
+        self._outbox_wakeup = outbox_wakeup
+
+    async def enqueue(self, key: str, kind: str, payload: dict, ordering_key: str) -> OutboxEntry:
+        """
+        Ставит запрос в очередь. Запрос с уже известным ключом не добавляется повторно. После коммита диспетчер
+        будится сразу, не дожидаясь следующего опроса.
+        """
+        db_entry = await self.get_or_create(
+            ('key',),
+            key=key,
+            kind=kind,
+            payload=payload,
+            ordering_key=ordering_key,
+            next_attempt_at=datetime.datetime.now(datetime.timezone.utc),
+        )
+        on_commit(self._outbox_wakeup.set)
+
+        return db_entry
+
+    async def get_due(self, limit: int) -> Sequence[OutboxEntry]:
+        """
+        Запросы, которые пора выполнить: только первые среди невыполненных в очереди своего ordering_key, поэтому
+        запрос, ожидающий повтора, задерживает следующие за ним.
+        """
+        now = datetime.datetime.now(datetime.timezone.utc)
+        earlier = aliased(self.model_class)
+
+        async with self._reading() as session:
+            res = await session.execute(
+                select(self.model_class)
+                .where(
+                    *self._pending(self.model_class),
+                    self.model_class.next_attempt_at <= now,
+                    ~exists().where(
+                        *self._pending(earlier),
+                        earlier.ordering_key == self.model_class.ordering_key,
+                        earlier.id < self.model_class.id,
+                    ),
+                )
+                .order_by(self.model_class.id)
+                .limit(limit)
+            )
+            return res.scalars().all()
+
+    async def claim(self, entry_ids: Sequence[int], lease: datetime.timedelta) -> Sequence[OutboxEntry]:
+        """
+        Захватывает запросы для выполнения: переносит next_attempt_at на время аренды lease одним UPDATE. Запрос, уже
+        захваченный другим диспетчером, не проходит условие next_attempt_at <= now и не возвращается, поэтому
+        каждый запрос выполняет только один диспетчер. Если диспетчер не отметил запрос до конца аренды (например,
+        из-за перезапуска), запрос снова станет доступен для выборки.
+
+        :return: захваченные запросы в порядке возрастания ID
+        """
+        if not entry_ids:
+            return []
+
+        now = datetime.datetime.now(datetime.timezone.utc)
+
+        async with self._writing() as session:
+            res = await session.execute(
+                update(self.model_class)
+                .where(
+                    self._in(session, self.model_class.id, entry_ids),
+                    *self._pending(self.model_class),
+                    self.model_class.next_attempt_at <= now,
+                )
+                .values(next_attempt_at=now + lease)
+                .returning(self.model_class),
+                execution_options={'synchronize_session': False, 'populate_existing': True},
+            )
+            db_entries = res.scalars().all()
+
+        return sorted(db_entries, key=lambda db_entry: db_entry.id)
+
+    async def mark_delivered(self, entry_id: int):
+        return await self.update(
+            self.model_class.id==entry_id,
+            delivered_at=datetime.datetime.now(datetime.timezone.utc),
+        )
+
+    async def mark_dropped(self, entry_id: int, attempts: int, last_error: str):
+        return await self.update(
+            self.model_class.id==entry_id,
+            attempts=attempts,
+            last_error=last_error,
+            dropped_at=datetime.datetime.now(datetime.timezone.utc),
+        )
+
+    async def reschedule(self, entry_id: int, attempts: int, next_attempt_at: datetime.datetime, last_error: str):
+        return await self.update(
+            self.model_class.id==entry_id,
+            attempts=attempts,
+            next_attempt_at=next_attempt_at,
+            last_error=last_error,
+        )
+
+    async def purge_processed(self, older_than: datetime.datetime, batch_size: int | None = None) -> int:
+        """
+        Удаляет выполненные и отброшенные запросы старше older_than. После удаления повторно полученное обновление
+        снова поставит запрос в очередь, поэтому срок хранения должен перекрывать срок повторной доставки обновлений.
+        """
+        return (
+            await self.purge(self.model_class.delivered_at < older_than, batch_size=batch_size)
+            + await self.purge(self.model_class.dropped_at < older_than, batch_size=batch_size)
+        )
+
+    @staticmethod
+    def _pending(model) -> tuple:
+        return model.delivered_at.is_(None), model.dropped_at.is_(None)
+
+
+@cache
+def get_outbox_wakeup() -> asyncio.Event:
+    """
+    Сигнал диспетчеру о новых запросах в очереди. Один на процесс, как и кэши.
+    """
+    return asyncio.Event()
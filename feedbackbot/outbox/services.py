@@ -0,0 +1,145 @@
+import asyncio
+import datetime
+import logging
+from collections.abc import Awaitable, Callable
+
+from sqlalchemy.exc import OperationalError
+from telegram.error import BadRequest, NetworkError, RetryAfter
+
+from feedbackbot import settings
+from feedbackbot.core.db import UnitOfWork, pin_primary
+from feedbackbot.core.metrics import metrics
+from feedbackbot.outbox.models import OutboxEntry
+from feedbackbot.outbox.repos import OutboxRepo
+
+logger = logging.getLogger(__name__)
+
+
+class OutboxDispatcher:
+    """
+    Диспетчер очереди запросов к Bot API (outbox).
+
+    Обработчики обновлений только записывают запрос в очередь в своей транзакции и завершаются после коммита. Диспетчер
+    выполняет запрос обработчиком его вида (outbox_handlers в DI) и отмечает его выполненным в одной транзакции с
+    записями, которые делает обработчик, например с соответствием пересланного сообщения. Запрос, не выполненный из-за
+    сбоя или перезапуска, выполняется повторно: доставка «как минимум один раз».
+
+    Повторяются только временные ошибки (см. RETRYABLE_ERRORS) – с экспоненциальной задержкой, RetryAfter – через
+    указанное Телеграм время и без учета в количестве попыток. Запрос с неисправимой ошибкой и запрос, исчерпавший
+    OUTBOX_MAX_ATTEMPTS попыток, отбрасывается с записью в лог: он не должен задерживать следующие запросы
+    пользователя.
+
+    Выбранные запросы захватываются на OUTBOX_CLAIM_TIMEOUT секунд (см. OutboxRepo.claim): при нескольких запущенных
+    экземплярах бота каждый запрос выполняет только один из них.
+    """
+
+    # Временные ошибки: сеть, таймауты, ответы Bot API 5xx (PTB выдает их как NetworkError) и потеря соединения с БД.
+    # BadRequest в PTB – тоже NetworkError, но повтор его не исправит.
+    RETRYABLE_ERRORS = (NetworkError, OperationalError)
+    NON_RETRYABLE_ERRORS = (BadRequest,)
+
+    def __init__(self, unit_of_work: UnitOfWork, outbox_repo: OutboxRepo, outbox_wakeup: asyncio.Event,
+                 outbox_handlers: dict[str, Callable[[dict], Awaitable[None]]]):
+        self._unit_of_work = unit_of_work
+        self._outbox_repo = outbox_repo
+        self._outbox_wakeup = outbox_wakeup
+        self._handlers = outbox_handlers
+
+        self.delivered = 0
+        self.retried = 0
+        self.dropped = 0
+
+    async def dispatch_due(self) -> int:
+        """
+        Выполняет запросы, которые пора выполнить. Запросы с разными ordering_key выполняются параллельно.
+
+        :return: количество выбранных запросов
+        """
+        db_entries = await self._outbox_repo.get_due(settings.OUTBOX_BATCH_SIZE)
+        db_entries = await self._outbox_repo.claim(
+            [db_entry.id for db_entry in db_entries], datetime.timedelta(seconds=settings.OUTBOX_CLAIM_TIMEOUT)
+        )
+
+        workers = asyncio.Semaphore(settings.OUTBOX_CONCURRENCY)
+
+        async def dispatch(db_entry: OutboxEntry):
+            async with workers:
+                await self._dispatch(db_entry)
+
+        await asyncio.gather(*(dispatch(db_entry) for db_entry in db_entries))
+
+        return len(db_entries)
+
+    async def run(self):
+        metrics.register('outbox', self.stats)
+        # очередь читается только из основной БД: на реплике может не быть только что добавленных запросов, а уже
+        # выполненные там могут еще числиться невыполненными
+        pin_primary()
+
+        while True:
+            # сигнал сбрасывается до выборки: запросы, добавленные во время выборки, разбудят следующую итерацию
+            self._outbox_wakeup.clear()
+
+            try:
+                selected = await self.dispatch_due()
+            except Exception:
+                # падение задачи остановило бы доставку навсегда
+                logger.exception('Failed to dispatch outbox')
+                selected = 0
+
+            # полная порция: в очереди могут быть еще запросы
+            if selected == settings.OUTBOX_BATCH_SIZE:
+                continue
+
+            try:
+                await asyncio.wait_for(self._outbox_wakeup.wait(), settings.OUTBOX_POLL_INTERVAL)
+            except TimeoutError:
+                pass
+
+    def stats(self) -> dict:
+        return {
+            'delivered': self.delivered,
+            'retried': self.retried,
+            'dropped': self.dropped,
+        }
+
+    async def _dispatch(self, db_entry: OutboxEntry):
+        try:
+            async with self._unit_of_work():
+                await self._handlers[db_entry.kind](db_entry.payload)
+                await self._outbox_repo.mark_delivered(db_entry.id)
+
+        except RetryAfter as e:
+            await self._retry(db_entry, db_entry.attempts, datetime.timedelta(seconds=e.retry_after), e)
+
+        except Exception as e:
+            attempts = db_entry.attempts + 1
+
+            if not self._is_retryable(e):
+                logger.exception(f'Outbox entry dropped after non-retryable error: {db_entry.key}')
+                await self._drop(db_entry, attempts, e)
+                return
+
+            if attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+                logger.exception(f'Outbox entry dropped after {attempts} attempts: {db_entry.key}')
+                await self._drop(db_entry, attempts, e)
+                return
+
+            logger.warning(f'Outbox entry failed, attempt {attempts}: {db_entry.key}', exc_info=True)
+            delay = min(settings.OUTBOX_BACKOFF_BASE * 2 ** (attempts - 1), settings.OUTBOX_BACKOFF_MAX)
+            await self._retry(db_entry, attempts, datetime.timedelta(seconds=delay), e)
+
+        else:
+            self.delivered += 1
+
+    def _is_retryable(self, error: Exception) -> bool:
+        return isinstance(error, self.RETRYABLE_ERRORS) and not isinstance(error, self.NON_RETRYABLE_ERRORS)
+
+    async def _drop(self, db_entry: OutboxEntry, attempts: int, error: Exception):
+        await self._outbox_repo.mark_dropped(db_entry.id, attempts, repr(error))
+        self.dropped += 1
+
+    async def _retry(self, db_entry: OutboxEntry, attempts: int, delay: datetime.timedelta, error: Exception):
+        next_attempt_at = datetime.datetime.now(datetime.timezone.utc) + delay
+        await self._outbox_repo.reschedule(db_entry.id, attempts, next_attempt_at, repr(error))
+        self.retried += 1
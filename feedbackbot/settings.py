@@ -15,7 +15,6 @@ ENVIRONMENT = os.getenv('ENVIRONMENT', 'development')
 # Paths
 
 ROOT_PATH = Path(__file__).resolve().parents[1]
-TMP_PATH = ROOT_PATH / 'data' / 'tmp'
 
 
 # Logging
@@ -57,12 +56,92 @@ LOGGING = {
 
 # DB
 
+# Хранилище: postgresql – отдельный сервер PostgreSQL, sqlite – файл БД рядом с ботом (установка на одном сервере без
+# контейнера с PostgreSQL)
+DB_BACKEND = os.getenv('DB_BACKEND', 'postgresql')
+
 DB_USERNAME = os.getenv('DB_USERNAME')
 DB_PASSWORD = os.getenv('DB_PASSWORD')
 DB_HOST = os.getenv('DB_HOST')
 DB_PORT = os.getenv('DB_PORT')
 DB_NAME = os.getenv('DB_NAME')
-DB_URI = f'postgresql+asyncpg://{DB_USERNAME}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}'
+
+# файл БД для DB_BACKEND=sqlite
+DB_SQLITE_PATH = Path(os.getenv('DB_SQLITE_PATH', ROOT_PATH / 'data' / 'feedbackbot.sqlite3'))
+
+if DB_BACKEND == 'sqlite':
+    DB_URI = f'sqlite+aiosqlite:///{DB_SQLITE_PATH}'
+else:
+    DB_URI = f'postgresql+asyncpg://{DB_USERNAME}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}'
+
+# Реплики только для чтения: строки подключения через запятую, в том же формате, что и DB_URI. Чтение уходит на
+# реплики, запись и чтение после записи в рамках одного обновления – в основную БД.
+DB_REPLICA_URIS = [uri.strip() for uri in os.getenv('DB_REPLICA_URIS', '').split(',') if uri.strip()]
+
+# Пул соединений
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+DB_POOL_MAX_OVERFLOW = int(os.getenv('DB_POOL_MAX_OVERFLOW', 10))
+# сколько секунд ждать свободное соединение
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))
+# через сколько секунд пересоздавать соединение
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true'
+
+# Кэши запросов: скомпилированные запросы SQLAlchemy (на процесс) и prepared statements asyncpg (на соединение пула)
+DB_QUERY_CACHE_SIZE = int(os.getenv('DB_QUERY_CACHE_SIZE', 500))
+DB_PREPARED_STATEMENT_CACHE_SIZE = int(os.getenv('DB_PREPARED_STATEMENT_CACHE_SIZE', 500))
+
+# размер порции при обходе больших выборок
+DB_BATCH_SIZE = int(os.getenv('DB_BATCH_SIZE', 500))
+
+# применять миграции при запуске бота
+DB_MIGRATE_ON_STARTUP = os.getenv('DB_MIGRATE_ON_STARTUP', 'true').lower() == 'true'
+
+# Прогрев при запуске: соединения пулов основной БД и реплик, горячие запросы, последние топики и их пользователи
+# загружаются до начала обработки обновлений
+DB_WARMUP = os.getenv('DB_WARMUP', 'true').lower() == 'true'
+# сколько последних топиков (вместе с их пользователями) загружать в кэш при прогреве
+DB_WARMUP_TOPICS = int(os.getenv('DB_WARMUP_TOPICS', 200))
+
+
+# Cache
+
+# кэш топиков по ID ветки: количество записей и время жизни записи в секундах
+TOPIC_CACHE_SIZE = int(os.getenv('TOPIC_CACHE_SIZE', 10000))
+TOPIC_CACHE_TTL = int(os.getenv('TOPIC_CACHE_TTL', 60 * 60))
+
+# кэш состояния пользователей по ID: количество записей и время жизни записи в секундах
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', 10000))
+USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', 60 * 60))
+
+# кэш карточек пользователей (/userlog): количество записей и время жизни записи в секундах
+USER_CARD_CACHE_SIZE = int(os.getenv('USER_CARD_CACHE_SIZE', 1000))
+USER_CARD_CACHE_TTL = int(os.getenv('USER_CARD_CACHE_TTL', 60 * 60))
+
+# индексы недавних соответствий сообщений (отдельно для сообщений пользователей и ответов операторов):
+# количество записей и максимальный возраст записи в секундах
+MESSAGE_INDEX_SIZE = int(os.getenv('MESSAGE_INDEX_SIZE', 50000))
+MESSAGE_INDEX_MAX_AGE = int(os.getenv('MESSAGE_INDEX_MAX_AGE', 24 * 60 * 60))
+
+
+# Retention
+
+# Сколько дней хранить соответствия сообщений и ответов в чатах, 0 – хранить всегда. После удаления записи
+# редактирование и удаление старого сообщения через бота становятся недоступны.
+RETENTION_MESSAGES_DAYS = int(os.getenv('RETENTION_MESSAGES_DAYS', 0))
+# сколько дней хранить историю изменений пользователей, 0 – хранить всегда
+RETENTION_USER_LOGS_DAYS = int(os.getenv('RETENTION_USER_LOGS_DAYS', 0))
+# Сколько дней хранить выполненные запросы очереди outbox, 0 – хранить всегда. Ключи идемпотентности хранятся вместе с
+# ними: срок должен перекрывать повторную доставку обновлений Телеграм (до суток).
+RETENTION_OUTBOX_DAYS = int(os.getenv('RETENTION_OUTBOX_DAYS', 2))
+# интервал запуска очистки в секундах
+RETENTION_INTERVAL = int(os.getenv('RETENTION_INTERVAL', 24 * 60 * 60))
+
+
+# Metrics
+
+# интервал вывода метрик в лог в секундах, 0 – не выводить
+METRICS_LOG_INTERVAL = int(os.getenv('METRICS_LOG_INTERVAL', 300))
 
 
 # Commands
@@ -70,6 +149,10 @@ DB_URI = f'postgresql+asyncpg://{DB_USERNAME}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/
 COMMANDS = {
     'createdb': 'feedbackbot.core.commands.create_db',
     'cleandb': 'feedbackbot.core.commands.clean_db',
+    'migrate': 'feedbackbot.core.commands.migrate',
+    'makemigrations': 'feedbackbot.core.commands.make_migrations',
+    'backfillusers': 'feedbackbot.users.commands.backfill_users',
+    'purge': 'feedbackbot.core.commands.purge',
 }
 
 
@@ -79,6 +162,54 @@ TOKEN = os.getenv('TG_TOKEN')
 BOT_ID = int(TOKEN.split(':')[0]) if TOKEN else None
 CHAT_ID = os.getenv('TG_CHAT_ID')
 
+# получение обновлений: polling (опрос Bot API) или webhook (Телеграм сам присылает обновления на WEBHOOK_URL)
+UPDATES_MODE = os.getenv('TG_UPDATES_MODE', 'polling')
+POLL_INTERVAL = float(os.getenv('TG_POLL_INTERVAL', 1))
+
+# вебхук: публичный HTTPS-адрес (обычно за обратным прокси) и адрес встроенного сервера
+WEBHOOK_URL = os.getenv('TG_WEBHOOK_URL')
+WEBHOOK_PATH = os.getenv('TG_WEBHOOK_PATH', 'telegram')
+WEBHOOK_LISTEN = os.getenv('TG_WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('TG_WEBHOOK_PORT', 8080))
+# секрет из заголовка X-Telegram-Bot-Api-Secret-Token; если не задан, генерируется при каждом запуске
+WEBHOOK_SECRET_TOKEN = os.getenv('TG_WEBHOOK_SECRET_TOKEN')
+# максимальное количество одновременных HTTPS-соединений Телеграм с вебхуком (1-100)
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('TG_WEBHOOK_MAX_CONNECTIONS', 40))
+
+# параллельная обработка обновлений: обновления одного пользователя или топика идут по очереди, разных – параллельно.
+# Каждое обрабатываемое обновление занимает соединение с БД, поэтому по умолчанию параллельность равна размеру пула.
+UPDATES_CONCURRENCY = int(os.getenv('UPDATES_CONCURRENCY', DB_POOL_SIZE))
+# сколько принятых обновлений может ждать своей очереди, дальше Application перестает принимать новые
+UPDATES_MAX_PENDING = int(os.getenv('UPDATES_MAX_PENDING', 1000))
+
+# альбомы: сколько секунд ждать следующее сообщение альбома, прежде чем переслать собранные одним запросом
+MEDIA_GROUP_WINDOW = float(os.getenv('MEDIA_GROUP_WINDOW', 1))
+
+# Очередь запросов к Bot API (outbox): размер выборки, количество одновременных запросов, интервал опроса очереди в
+# секундах (новые запросы будят диспетчер сразу), количество попыток и экспоненциальная задержка между ними в секундах
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', 100))
+OUTBOX_CONCURRENCY = int(os.getenv('OUTBOX_CONCURRENCY', 4))
+OUTBOX_POLL_INTERVAL = float(os.getenv('OUTBOX_POLL_INTERVAL', 5))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', 10))
+OUTBOX_BACKOFF_BASE = float(os.getenv('OUTBOX_BACKOFF_BASE', 1))
+OUTBOX_BACKOFF_MAX = float(os.getenv('OUTBOX_BACKOFF_MAX', 300))
+# на сколько секунд диспетчер захватывает выбранный запрос: дольше самого долгого запроса к Bot API, иначе запрос
+# может выполнить и другой экземпляр бота
+OUTBOX_CLAIM_TIMEOUT = float(os.getenv('OUTBOX_CLAIM_TIMEOUT', 60))
+
+# /delhistory: количество одновременных запросов deleteMessages и интервал обновления сообщения о ходе удаления
+DELETE_HISTORY_CONCURRENCY = int(os.getenv('DELETE_HISTORY_CONCURRENCY', 4))
+DELETE_HISTORY_PROGRESS_INTERVAL = float(os.getenv('DELETE_HISTORY_PROGRESS_INTERVAL', 5))
+
+# /broadcast: скорость рассылки в сообщениях в секунду (общий лимит бота – 30 сообщений в секунду, остаток достается
+# обычной переписке), количество одновременных запросов, размер порции пользователей (после каждой порции позиция
+# рассылки сохраняется в БД), количество повторов после RetryAfter и интервал обновления сообщения о ходе рассылки
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', 20))
+BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', 8))
+BROADCAST_BATCH_SIZE = int(os.getenv('BROADCAST_BATCH_SIZE', 100))
+BROADCAST_MAX_RETRIES = int(os.getenv('BROADCAST_MAX_RETRIES', 5))
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv('BROADCAST_PROGRESS_INTERVAL', 10))
+
 
 # Sentry
 
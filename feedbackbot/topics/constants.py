@@ -1 +1,3 @@
-UNSUPPORTED_CONTENT = 'Данный тип контента не поддерживается. Возможно отправка следующих типов: текстовые сообщения, изображения.'
\ No newline at end of file
+UNSUPPORTED_CONTENT = 'Данный тип сообщения невозможно переслать пользователю.'
+DELETE_HISTORY_PROGRESS = 'Удаление истории... Удалено сообщений: {deleted}'
+DELETE_HISTORY_DONE = 'История удалена. Удалено сообщений: {deleted}'
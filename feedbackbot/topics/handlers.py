@@ -1,10 +1,12 @@
 import logging
 
-from telegram import Update
+from telegram import Update, Message
 from telegram.ext import ContextTypes
 
 from feedbackbot import settings
+from feedbackbot.core.db import UnitOfWork
 from feedbackbot.core.handlers import BaseCommandHandler
+from feedbackbot.core.media_groups import MediaGroupCollector
 from feedbackbot.topics.services import TopicService
 
 logger = logging.getLogger(__name__)
@@ -19,9 +21,13 @@ class ReplyMessageHandler:
     2. У форварднутого сообщения от пользователя будет update.message.reply_to_message.api_kwargs['forward_date'] или
        есть update.message.reply_to_message.forward_origin
     3. Из форвардов нас интересует тот, у которого reply_to_message.from_user.id == id бота (бот делал форвард)
+    4. Сообщения альбома собираются сборщиком альбомов и отправляются пользователю вместе (см. MediaGroupCollector)
     """
-    def __init__(self, topic_service: TopicService):
+    def __init__(self, unit_of_work: UnitOfWork, topic_service: TopicService,
+                 media_group_collector: MediaGroupCollector):
+        self._unit_of_work = unit_of_work
         self._service = topic_service
+        self._media_group_collector = media_group_collector
 
     async def __call__(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Редактируем
@@ -36,8 +42,21 @@ class ReplyMessageHandler:
             is_forwarded = getattr(update.message.reply_to_message, 'forward_origin', None) is not None
 
             # Отвечаем только если это форвард от бота
-            if is_forwarded and is_reply_to_bot_forwarded:
-                await self._service.reply_user_pm(update.message)
+            if not (is_forwarded and is_reply_to_bot_forwarded):
+                return
+
+            if update.message.media_group_id:
+                self._media_group_collector.add(update.message, self._reply_media_group)
+                return
+
+            # альбом, отправленный раньше, уходит первым
+            await self._media_group_collector.flush_preceding(update.message)
+            await self._service.reply_user_pm([update.message])
+
+    async def _reply_media_group(self, messages: list[Message]):
+        # альбом собирается вне обработки обновления, поэтому единица работы своя
+        async with self._unit_of_work():
+            await self._service.reply_user_pm(messages)
 
 
 class DeleteCommandHandler(BaseCommandHandler):
@@ -89,8 +108,13 @@ class DeleteCommandHandler(BaseCommandHandler):
 
 
 class DeleteHistoryCommandHandler(BaseCommandHandler):
+    """
+    Команда удаления истории переписки у пользователя. С аргументом all (/delhistory all) история удаляется и в чате
+    операторов.
+    """
     name = 'delhistory'
     help = 'Очистить историю у пользователя'
+    PURGE_GROUP_ARG = 'all'
 
     def __init__(self, topic_service: TopicService):
         self._topic_service = topic_service
@@ -101,6 +125,8 @@ class DeleteHistoryCommandHandler(BaseCommandHandler):
             return
 
         topic_id = update.message.message_thread_id
-        logger.debug(f'Deleting user history for topic: {topic_id}')
+        args = (update.message.text or '').split()[1:]
+        purge_group = self.PURGE_GROUP_ARG in args
+        logger.debug(f'Deleting user history for topic: {topic_id}, purge group: {purge_group}')
 
-        await self._topic_service.delete_history(topic_id)
+        await self._topic_service.delete_history(topic_id, purge_group=purge_group)
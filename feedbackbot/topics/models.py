@@ -1,5 +1,7 @@
 __all__ = ('Topic', 'Message', 'Reply', '')
-from sqlalchemy import BigInteger, ForeignKey
+import datetime
+
+from sqlalchemy import BigInteger, ForeignKey, DateTime, Index, func
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from feedbackbot.core.db import Base
@@ -10,7 +12,7 @@ class Topic(Base):
 
     id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
 
-    user_id: Mapped[int] = mapped_column(BigInteger, ForeignKey('users.id'))
+    user_id: Mapped[int] = mapped_column(BigInteger, ForeignKey('users.id'), index=True)
     user: Mapped['User'] = relationship('User', backref='topics', lazy='joined')
 
     version: Mapped[int] = mapped_column(default=0)
@@ -19,23 +21,38 @@ class Topic(Base):
 
 class Message(Base):
     __tablename__ = 'messages'
+    __table_args__ = (
+        # BRIN: записи добавляются в порядке времени, поэтому индекс занимает несколько страниц на всю таблицу
+        Index('ix_messages_created_at', 'created_at', postgresql_using='brin'),
+    )
 
     id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
 
-    topic_id: Mapped[int] = mapped_column(BigInteger, ForeignKey('topics.id'))
+    topic_id: Mapped[int] = mapped_column(BigInteger, ForeignKey('topics.id'), index=True)
     topic: Mapped['Topic'] = relationship('Topic', backref='messages', lazy='joined')
 
     version: Mapped[int] = mapped_column(default=0)
-    bot_message_id: Mapped[int] = mapped_column(BigInteger)
+    bot_message_id: Mapped[int] = mapped_column(BigInteger, index=True)
+
+    created_at: Mapped[datetime.datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now()
+    )
 
 
 class Reply(Base):
     __tablename__ = 'replies'
+    __table_args__ = (
+        Index('ix_replies_created_at', 'created_at', postgresql_using='brin'),
+    )
 
     id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
 
-    topic_id: Mapped[int] = mapped_column(BigInteger, ForeignKey('topics.id'))
+    topic_id: Mapped[int] = mapped_column(BigInteger, ForeignKey('topics.id'), index=True)
     topic: Mapped['Topic'] = relationship('Topic', backref='replies', lazy='joined')
 
     version: Mapped[int] = mapped_column(default=0)
     bot_message_id: Mapped[int] = mapped_column(BigInteger)
+
+    created_at: Mapped[datetime.datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now()
+    )
@@ -1,59 +1,277 @@
-from feedbackbot.core.db import BaseAsyncDBRepo
+import datetime
+from collections.abc import Iterable
+from functools import cache, partial
+from typing import Callable, NamedTuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from feedbackbot import settings
+from feedbackbot.core.cache import TTLCache, MappingIndex
+from feedbackbot.core.db import BaseAsyncDBRepo, FilterShape, on_commit
+from feedbackbot.core.metrics import metrics
 from feedbackbot.topics.models import Topic, Reply, Message
 from feedbackbot.users.models import User
 
 
+class TopicRef(NamedTuple):
+    """
+    Топик без связанных объектов: ID топика и ID пользователя, которому он принадлежит.
+    """
+    id: int
+    user_id: int
+
+
+class MessageRef(NamedTuple):
+    """
+    Соответствие сообщений без связанных объектов: ID исходного сообщения, ID копии, отправленной ботом, и ID топика.
+    Подходит и для сообщений пользователя (Message), и для ответов оператора (Reply).
+    """
+    id: int
+    bot_message_id: int
+    topic_id: int
+
+    @classmethod
+    def from_model(cls, db_message: Message | Reply) -> 'MessageRef':
+        return cls(db_message.id, db_message.bot_message_id, db_message.topic_id)
+
+
 class TopicRepo(BaseAsyncDBRepo[Topic]):
     model_class = Topic
+    hot_filters = (
+        FilterShape(('user_id',), ('id', 'desc')),
+    )
+
+    def __init__(self, session: Callable[..., AsyncSession], topic_cache: TTLCache[int, TopicRef]):
+        super().__init__(session)
+        self._topic_cache = topic_cache
 
-    async def create_topic(self, topic_id: int, user: User):
-        return await self.create(
+    async def create_topic(self, topic_id: int, user_id: int):
+        db_topic = await self.create(
             id=topic_id,
-            user=user
+            user_id=user_id,
         )
+        self._topic_cache.invalidate(topic_id)
+
+        return db_topic
+
+    async def get_topic(self, topic_id: int) -> TopicRef | None:
+        """
+        Топик по ID ветки (message_thread_id). Результат кэшируется: топик не меняет владельца, поэтому в устойчивом
+        состоянии чтения из БД не требуется.
+        """
+        topic_ref = self._topic_cache.get(topic_id)
+
+        if topic_ref is None:
+            async with self._reading() as session:
+                res = await session.execute(
+                    select(self.model_class.id, self.model_class.user_id).where(self.model_class.id==topic_id)
+                )
+                row = res.first()
+
+            # отсутствие топика не кэшируется: он может быть создан следующим же обновлением
+            if row is None:
+                return None
 
-    async def get_topic(self, topic_id: int):
-        return await self.get(id=topic_id)
+            topic_ref = TopicRef(*row)
+            # внутри единицы работы топик может быть еще не закоммичен: в кэш он попадет только после коммита
+            on_commit(partial(self._topic_cache.set, topic_id, topic_ref))
+
+        return topic_ref
+
+    async def preload_topics(self, limit: int) -> list[TopicRef]:
+        """
+        Загружает в кэш последние созданные топики.
+
+        :return: загруженные топики
+        """
+        db_topics = await self.get_many(ordering=('id', 'desc'), limit=limit)
+        topic_refs = [TopicRef(db_topic.id, db_topic.user_id) for db_topic in db_topics]
+        for topic_ref in topic_refs:
+            self._topic_cache.set(topic_ref.id, topic_ref)
+
+        return topic_refs
 
     async def filter_topics(self, user: User | int | None = None, **kwargs):
-        return await self.filter(user=user, **kwargs)
+        user_id = user.id if isinstance(user, User) else user
+        return await self.filter(user_id=user_id, **kwargs)
 
 
 class MessageRepo(BaseAsyncDBRepo[Message]):
+    """
+    Репозиторий пересланных сообщений пользователей. Недавние соответствия хранятся в индексе в памяти, поэтому
+    удаление и редактирование свежих сообщений обходится без запросов к БД.
+    """
     model_class = Message
+    hot_filters = (
+        FilterShape(('bot_message_id',)),
+        FilterShape(('topic_id',)),
+    )
+
+    def __init__(self, session: Callable[..., AsyncSession], message_index: MappingIndex[int, MessageRef]):
+        super().__init__(session)
+        self._message_index = message_index
 
-    async def create_message(self, message_id: int, bot_message_id: int, topic: Topic):
-        return await self.create(
+    async def create_message(self, message_id: int, bot_message_id: int, topic_id: int):
+        db_message = await self.create(
             id=message_id,
             bot_message_id=bot_message_id,
-            topic=topic,
+            topic_id=topic_id,
         )
+        on_commit(partial(
+            self._message_index.add, message_id, bot_message_id, MessageRef(message_id, bot_message_id, topic_id)
+        ))
+
+        return db_message
+
+    async def create_messages(self, message_refs: Iterable[MessageRef]):
+        """
+        Записывает соответствия нескольких сообщений (например, альбома) одним запросом.
+        """
+        message_refs = list(message_refs)
+        await self.bulk_create(message_ref._asdict() for message_ref in message_refs)
+        on_commit(partial(self._add_to_index, message_refs))
+
+    def _add_to_index(self, message_refs: list[MessageRef]):
+        for message_ref in message_refs:
+            self._message_index.add(message_ref.id, message_ref.bot_message_id, message_ref)
+
+    async def get_message(self, message_id: int) -> MessageRef | None:
+        message_ref = self._message_index.get(message_id)
+
+        if message_ref is None:
+            db_message = await self.get(id=message_id)
+            message_ref = MessageRef.from_model(db_message) if db_message else None
+
+        return message_ref
 
-    async def get_message(self, message_id: int):
-        return await self.get(id=message_id)
+    async def get_message_by_bot_message_id(self, bot_message_id: int) -> MessageRef | None:
+        message_ref = self._message_index.get_by_reverse(bot_message_id)
+
+        if message_ref is None:
+            # в чате операторов у пересланного сообщения одно соответствие
+            db_messages = await self.filter_messages(bot_message_id=bot_message_id)
+            message_ref = MessageRef.from_model(db_messages[0]) if db_messages else None
+
+        return message_ref
 
     async def filter_messages(self, bot_message_id: int | None = None, topic_id: int | None = None):
         return await self.filter(bot_message_id=bot_message_id, topic_id=topic_id)
 
     async def delete_message(self, message_id: int):
+        self._message_index.remove(message_id)
         return await self.delete(self.model_class.id==message_id)
 
+    def iterate_message_batches(self, topic_id: int, batch_size: int | None = None):
+        return self.iterate_batches(self.model_class.topic_id==topic_id, batch_size=batch_size)
+
+    async def delete_messages(self, message_ids: Iterable[int]):
+        message_ids = list(message_ids)
+        for message_id in message_ids:
+            self._message_index.remove(message_id)
+        return await self.bulk_delete(message_ids)
+
+    async def purge_messages(self, older_than: datetime.datetime, batch_size: int | None = None):
+        # индекс не знает, какие записи удалены, а очистка выполняется редко
+        self._message_index.clear()
+        return await self.purge(self.model_class.created_at < older_than, batch_size=batch_size)
+
 
 class ReplyRepo(BaseAsyncDBRepo[Reply]):
+    """
+    Репозиторий ответов операторов. Недавние соответствия хранятся в индексе в памяти, как и у MessageRepo.
+    """
     model_class = Reply
+    hot_filters = (
+        FilterShape(('topic_id',)),
+    )
+
+    def __init__(self, session: Callable[..., AsyncSession], reply_index: MappingIndex[int, MessageRef]):
+        super().__init__(session)
+        self._reply_index = reply_index
 
-    async def create_reply(self, reply_id: int, bot_message_id: int, topic: Topic):
-        return await self.create(
+    async def create_reply(self, reply_id: int, bot_message_id: int, topic_id: int):
+        db_reply = await self.create(
             id=reply_id,
             bot_message_id=bot_message_id,
-            topic=topic,
+            topic_id=topic_id,
         )
+        on_commit(partial(
+            self._reply_index.add, reply_id, bot_message_id, MessageRef(reply_id, bot_message_id, topic_id)
+        ))
 
-    async def get_reply(self, reply_id: int):
-        return await self.get(id=reply_id)
+        return db_reply
+
+    async def create_replies(self, reply_refs: Iterable[MessageRef]):
+        """
+        Записывает соответствия нескольких ответов (например, альбома) одним запросом.
+        """
+        reply_refs = list(reply_refs)
+        await self.bulk_create(reply_ref._asdict() for reply_ref in reply_refs)
+        on_commit(partial(self._add_to_index, reply_refs))
+
+    def _add_to_index(self, reply_refs: list[MessageRef]):
+        for reply_ref in reply_refs:
+            self._reply_index.add(reply_ref.id, reply_ref.bot_message_id, reply_ref)
+
+    async def get_reply(self, reply_id: int) -> MessageRef | None:
+        reply_ref = self._reply_index.get(reply_id)
+
+        if reply_ref is None:
+            db_reply = await self.get(id=reply_id)
+            reply_ref = MessageRef.from_model(db_reply) if db_reply else None
+
+        return reply_ref
 
     async def filter_replies(self, bot_message_id: int | None = None, topic_id: int | None = None):
         return await self.filter(bot_message_id=bot_message_id, topic_id=topic_id)
 
     async def delete_reply(self, reply_id: int):
+        self._reply_index.remove(reply_id)
         return await self.delete(self.model_class.id==reply_id)
+
+    def iterate_reply_batches(self, topic_id: int, batch_size: int | None = None):
+        return self.iterate_batches(self.model_class.topic_id==topic_id, batch_size=batch_size)
+
+    async def delete_replies(self, reply_ids: Iterable[int]):
+        reply_ids = list(reply_ids)
+        for reply_id in reply_ids:
+            self._reply_index.remove(reply_id)
+        return await self.bulk_delete(reply_ids)
+
+    async def purge_replies(self, older_than: datetime.datetime, batch_size: int | None = None):
+        self._reply_index.clear()
+        return await self.purge(self.model_class.created_at < older_than, batch_size=batch_size)
+
+
+@cache
+def get_topic_cache() -> TTLCache[int, TopicRef]:
+    """
+    Кэш топиков по ID ветки. Один на процесс, как и движок БД.
+    """
+    topic_cache = TTLCache(settings.TOPIC_CACHE_SIZE, settings.TOPIC_CACHE_TTL)
+    metrics.register('cache.topics', topic_cache.stats)
+
+    return topic_cache
+
+
+@cache
+def get_message_index() -> MappingIndex[int, MessageRef]:
+    """
+    Индекс недавних сообщений пользователей: ID сообщения <-> ID пересланного сообщения.
+    """
+    message_index = MappingIndex(settings.MESSAGE_INDEX_SIZE, settings.MESSAGE_INDEX_MAX_AGE)
+    metrics.register('index.messages', message_index.stats)
+
+    return message_index
+
+
+@cache
+def get_reply_index() -> MappingIndex[int, MessageRef]:
+    """
+    Индекс недавних ответов операторов: ID ответа <-> ID сообщения, отправленного пользователю.
+    """
+    reply_index = MappingIndex(settings.MESSAGE_INDEX_SIZE, settings.MESSAGE_INDEX_MAX_AGE)
+    metrics.register('index.replies', reply_index.stats)
+
+    return reply_index
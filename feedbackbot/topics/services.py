@@ -1,113 +1,287 @@
+import asyncio
 import logging
-from uuid import uuid4
+import time
+from collections.abc import Sequence
+from functools import cache
 
-from telegram import Bot, Chat, User as TGUser, Message, InputMediaPhoto
-from telegram.error import Forbidden, BadRequest
+from telegram import (
+    Bot, Chat, User as TGUser, Message, InputMediaPhoto, InputMediaVideo, InputMediaAnimation,
+    InputMediaAudio, InputMediaDocument,
+)
+from telegram.error import Forbidden, BadRequest, TelegramError
 
 from feedbackbot import settings
-from feedbackbot.topics.constants import UNSUPPORTED_CONTENT
+from feedbackbot.core.cache import TTLCache
+from feedbackbot.core.db import UnitOfWork, pin_primary
+from feedbackbot.core.enums import OutboxKind, Priority
+from feedbackbot.core.metrics import metrics
+from feedbackbot.core.ratelimit import request_priority
+from feedbackbot.topics.constants import UNSUPPORTED_CONTENT, DELETE_HISTORY_PROGRESS, DELETE_HISTORY_DONE
 from feedbackbot.users.constants import USER_BLOCKED_BOT
-from feedbackbot.users.models import User as DBUSer
+from feedbackbot.users.repos import UserRepo, UserState
+from feedbackbot.outbox.repos import OutboxRepo
 from feedbackbot.topics.models import Topic
-from feedbackbot.topics.repos import TopicRepo, ReplyRepo, MessageRepo
+from feedbackbot.topics.repos import TopicRepo, ReplyRepo, MessageRepo, TopicRef, MessageRef
 
 logger = logging.getLogger(__name__)
 
 
 class TopicService:
-
-    def __init__(self, bot: Bot, topic_repo: TopicRepo, message_repo: MessageRepo, reply_repo: ReplyRepo):
+    # ошибки Bot API при отправке в топик, удаленный в Телеграм
+    TOPIC_DELETED_ERRORS = ('Message thread not found', 'Topic_deleted')
+    # максимальное количество сообщений в одном вызове deleteMessages
+    DELETE_MESSAGES_LIMIT = 100
+    # ошибка Bot API для сообщений, которые нельзя скопировать (служебные сообщения, викторины и т.п.)
+    MESSAGE_CANT_BE_COPIED_ERROR = "Message can't be copied"
+    # медиа, которое можно заменить в отправленном сообщении (editMessageMedia). У анимации заполнено и поле document,
+    # поэтому она проверяется раньше документа.
+    INPUT_MEDIA_TYPES = {
+        'photo': InputMediaPhoto,
+        'video': InputMediaVideo,
+        'animation': InputMediaAnimation,
+        'audio': InputMediaAudio,
+        'document': InputMediaDocument,
+    }
+
+    def __init__(self, bot: Bot, unit_of_work: UnitOfWork, topic_repo: TopicRepo, message_repo: MessageRepo,
+                 reply_repo: ReplyRepo, user_repo: UserRepo, outbox_repo: OutboxRepo,
+                 topic_name_cache: TTLCache[int, str]):
         self._bot = bot
         self._chat = Chat(settings.CHAT_ID, Chat.SUPERGROUP)
+        self._unit_of_work = unit_of_work
+        self._topic_name_cache = topic_name_cache
 
         self._topic_repo = topic_repo
+        self._user_repo = user_repo
         self._reply_repo = reply_repo
         self._message_repo = message_repo
+        self._outbox_repo = outbox_repo
+
+    async def get_or_create_user_topic(self, tg_user: TGUser, db_user: UserState) -> tuple[bool, Topic | TopicRef]:
+        """
+        Активный топик пользователя, при необходимости созданный заново.
+
+        Название топика обновляется в Телеграм, только если оно отличается от последнего примененного (кэш названий
+        по ID топика). Удаление топика в Телеграм обнаруживается здесь только при переименовании, в остальных случаях –
+        при пересылке сообщения (см. forward_user_pm).
+        """
+        topic_name = self._get_topic_name(tg_user)
 
-    async def get_or_create_user_topic(self, tg_user: TGUser, db_user: DBUSer) -> tuple[bool, Topic]:
-        topic_name = f'{tg_user.full_name} ({tg_user.username})'
-        db_topics = await self._topic_repo.filter_topics(db_user, ordering=('id', 'desc'))
+        # Активный топик – последний созданный для пользователя.
+        # Новый топик может понадобиться, если оператор удалил предыдущий чат, а пользователь снова написал.
+        db_topic = None
+        if db_user.active_topic_id is not None:
+            db_topic = await self._topic_repo.get_topic(db_user.active_topic_id)
 
         # 1 вариант: топиков нет, и мы создаем новый
-        if not db_topics:
-            tg_topic = await self._bot.create_forum_topic(settings.CHAT_ID, topic_name)
-            db_topic = await self._topic_repo.create_topic(tg_topic.message_thread_id, db_user)
-            return True, db_topic
-
-        # Топики создаются в возрастающем порядке, мы всегда берем последний созданный.
-        # Такая ситуация может возникнуть если оператор удалил предыдущий чат, а пользователь снова написал.
-        db_topic = db_topics[0]
+        if not db_topic:
+            return True, await self._create_user_topic(topic_name, db_user)
+
+        # 2 вариант: название не менялось с последнего обновления, Телеграм не вызываем
+        if self._topic_name_cache.get(db_topic.id) == topic_name:
+            return False, db_topic
+
         try:
             await self._bot.edit_forum_topic(settings.CHAT_ID, db_topic.id, name=topic_name)
 
         except BadRequest as e:
-            # 2 вариант: топик есть в базе и в телеге
+            # 3 вариант: топик есть в базе и в телеге, название уже актуально
             if e.message == 'Topic_not_modified':
+                self._topic_name_cache.set(db_topic.id, topic_name)
                 return False, db_topic
 
-            # 3 вариант: топик есть в базе, но был удален в телеге
+            # 4 вариант: топик есть в базе, но был удален в телеге
             if e.message == 'Topic_id_invalid':
-                tg_topic = await self._bot.create_forum_topic(settings.CHAT_ID, topic_name)
-                db_topic = await self._topic_repo.create_topic(tg_topic.message_thread_id, db_user)
-                return True, db_topic
+                return True, await self._create_user_topic(topic_name, db_user)
 
             else:
                 raise
 
-        # 4 вариант: топик есть в базе и в телеге, но оператор переименовал его
+        # 5 вариант: топик есть в базе и в телеге, название изменилось (пользователь сменил имя или оператор переименовал
+        # топик)
+        self._topic_name_cache.set(db_topic.id, topic_name)
         return False, db_topic
 
-    async def forward_user_pm(self, message: Message, db_topic: Topic):
+    async def recreate_user_topic(self, db_user: UserState) -> Topic:
         """
-        Метод перенаправляет сообщение пользователя из чата пользователь-бот в чат операторов.
+        Создает пользователю новый топик взамен удаленного в Телеграм. Название берется из последних известных данных
+        пользователя.
+        """
+        return await self._create_user_topic(self._get_topic_name(db_user), db_user)
 
-        :param message: Оригинальное сообщение пользователя
-        :param db_topic: ID топика
+    async def _create_user_topic(self, topic_name: str, db_user: UserState) -> Topic:
+        """
+        Создает топик в Телеграм и делает его активным топиком пользователя.
         """
-        bot_message = await message.forward(chat_id=settings.CHAT_ID, message_thread_id=db_topic.id)
-        await self._message_repo.create_message(message.id, bot_message.id, db_topic)
+        tg_topic = await self._bot.create_forum_topic(settings.CHAT_ID, topic_name)
 
-    async def reply_user_pm(self, message: Message):
+        async with self._unit_of_work():
+            db_topic = await self._topic_repo.create_topic(tg_topic.message_thread_id, db_user.id)
+            await self._user_repo.update_user(db_user.id, active_topic_id=db_topic.id)
+
+        self._topic_name_cache.set(db_topic.id, topic_name)
+
+        return db_topic
+
+    def _get_topic_name(self, tg_user: TGUser | UserState) -> str:
+        return f'{tg_user.full_name} ({tg_user.username})'
+
+    async def forward_user_pm(self, messages: Sequence[Message], db_topic: Topic | TopicRef):
         """
-        Отправляет ответ пользователю и логирует ответ в базу.
+        Ставит в очередь пересылку сообщения (или альбома) пользователя в его топик. Пересылка выполняется после
+        коммита (см. deliver_user_pm).
 
-        :param message: Пользовательское сообщение, на которое мы отвечаем
+        :param messages: Сообщение пользователя либо все сообщения альбома в порядке возрастания ID
+        :param db_topic: Топик пользователя
+        """
+        message = messages[0]
+        await self._outbox_repo.enqueue(
+            key=f'forward:{message.chat_id}:{message.id}',
+            kind=OutboxKind.FORWARD_USER_PM.value,
+            payload={
+                'user_id': db_topic.user_id,
+                'from_chat_id': message.chat_id,
+                'message_ids': [message.id for message in messages],
+                'topic_id': db_topic.id,
+            },
+            # пересылки и ответы одного пользователя не зависят друг от друга: у каждого направления своя очередь,
+            # ответ оператора не ждет повторов застрявшей пересылки
+            ordering_key=f'fwd:{db_topic.user_id}',
+        )
+
+    async def deliver_user_pm(self, payload: dict, topic_id: int | None = None) -> bool:
         """
+        Пересылает сообщения пользователя в чат операторов и записывает соответствия. Альбом пересылается одним
+        запросом (forwardMessages), группировка альбома сохраняется.
+
+        :param payload: Запрос из очереди, см. forward_user_pm
+        :param topic_id: ID топика, если отличается от указанного в запросе
+        :return: было ли сообщение переслано; False, если топик удален в Телеграм
+        """
+        topic_id = topic_id or payload['topic_id']
+        message_ids = payload['message_ids']
+
+        try:
+            if len(message_ids) == 1:
+                bot_message = await self._bot.forward_message(
+                    chat_id=settings.CHAT_ID,
+                    from_chat_id=payload['from_chat_id'],
+                    message_id=message_ids[0],
+                    message_thread_id=topic_id,
+                )
+                bot_message_ids = [bot_message.message_id]
+            else:
+                bot_message_ids = [
+                    bot_message_id.message_id for bot_message_id in await self._bot.forward_messages(
+                        chat_id=settings.CHAT_ID,
+                        from_chat_id=payload['from_chat_id'],
+                        message_ids=message_ids,
+                        message_thread_id=topic_id,
+                    )
+                ]
+
+        except BadRequest as e:
+            if e.message in self.TOPIC_DELETED_ERRORS:
+                logger.info(f'Topic was deleted in telegram: {topic_id}')
+                self._topic_name_cache.invalidate(topic_id)
+                return False
+            raise
+
+        await self._message_repo.create_messages(self._map_message_ids(message_ids, bot_message_ids, topic_id))
+
+        return True
+
+    async def reply_user_pm(self, messages: Sequence[Message]):
+        """
+        Ставит в очередь отправку ответа (или альбома) оператора пользователю. Ответ отправляется после коммита (см.
+        deliver_reply).
+
+        :param messages: Ответ оператора либо все сообщения альбома в порядке возрастания ID
+        """
+        message = messages[0]
         db_topic = await self._topic_repo.get_topic(message.message_thread_id)
 
         if not db_topic:
             logger.warning(f'Not a tracked telegram topic, skipping: {message.message_thread_id}')
             return
 
+        await self._outbox_repo.enqueue(
+            key=f'reply:{message.chat_id}:{message.id}',
+            kind=OutboxKind.REPLY_USER_PM.value,
+            payload={
+                'user_id': db_topic.user_id,
+                'from_chat_id': message.chat_id,
+                'message_ids': [message.id for message in messages],
+                'topic_id': db_topic.id,
+            },
+            ordering_key=f'reply:{db_topic.user_id}',
+        )
+
+    async def deliver_reply(self, payload: dict):
+        """
+        Копирует ответ оператора пользователю и записывает соответствия.
+
+        Ответ копируется на стороне Телеграм (copyMessage): подходит любой тип контента, файлы не скачиваются и не
+        загружаются заново. Альбом копируется одним запросом (copyMessages), группировка альбома сохраняется.
+
+        :param payload: Запрос из очереди, см. reply_user_pm
+        """
+        message_ids = payload['message_ids']
+
         try:
-            if message.text:
-                bot_message = await self._bot.send_message(chat_id=db_topic.user.id, text=message.text)
-
-            elif message.photo:
-                if not settings.TMP_PATH.exists():
-                    settings.TMP_PATH.mkdir(parents=True, exist_ok=True)
-                save_path = settings.TMP_PATH / str(uuid4())
-                msg_file = await message.effective_attachment[-1].get_file()
-                dl_file = await msg_file.download_to_drive(save_path)
-                bot_message = await self._bot.send_photo(
-                    chat_id=db_topic.user.id,
-                    photo=dl_file,
-                    caption=message.caption
-                )
-                dl_file.unlink(missing_ok=True)
+            with request_priority(Priority.OPERATOR_REPLY):
+                if len(message_ids) == 1:
+                    bot_message_ids = [await self._bot.copy_message(
+                        chat_id=payload['user_id'],
+                        from_chat_id=payload['from_chat_id'],
+                        message_id=message_ids[0],
+                    )]
+                else:
+                    bot_message_ids = await self._bot.copy_messages(
+                        chat_id=payload['user_id'],
+                        from_chat_id=payload['from_chat_id'],
+                        message_ids=message_ids,
+                    )
 
-            else:
-                await message.reply_text(UNSUPPORTED_CONTENT)
+        except Forbidden:
+            await self._notify_operator(payload, USER_BLOCKED_BOT)
+            return
+
+        except BadRequest as e:
+            if e.message == self.MESSAGE_CANT_BE_COPIED_ERROR:
+                await self._notify_operator(payload, UNSUPPORTED_CONTENT)
                 return
+            raise
 
-            await self._reply_repo.create_reply(
-                message.id,
-                bot_message_id=bot_message.id,
-                topic=db_topic
-            )
+        await self._reply_repo.create_replies(self._map_message_ids(
+            message_ids, [bot_message_id.message_id for bot_message_id in bot_message_ids], payload['topic_id']
+        ))
 
-        except Forbidden:
-            await message.reply_text(USER_BLOCKED_BOT)
+    async def _notify_operator(self, payload: dict, text: str):
+        """
+        Ответ бота на сообщение оператора, которое не удалось доставить пользователю.
+        """
+        await self._bot.send_message(
+            chat_id=payload['from_chat_id'],
+            message_thread_id=payload['topic_id'],
+            reply_to_message_id=payload['message_ids'][0],
+            text=text,
+        )
+
+    def _map_message_ids(self, message_ids: Sequence[int], bot_message_ids: Sequence[int],
+                         topic_id: int) -> list[MessageRef]:
+        """
+        Соответствия сообщений и их копий. Bot API возвращает ID копий альбома в порядке исходных сообщений, но
+        пропускает те, которые переслать не удалось: тогда соответствие установить нельзя, и альбом не записывается.
+        """
+        if len(bot_message_ids) != len(message_ids):
+            logger.warning(f'Media group was relayed partially, mappings are not saved: {message_ids}')
+            return []
+
+        return [
+            MessageRef(message_id, bot_message_id, topic_id)
+            for message_id, bot_message_id in zip(message_ids, bot_message_ids)
+        ]
 
     async def edit_operator_reply(self, message: Message):
         """
@@ -127,22 +301,20 @@ class TopicService:
 
         try:
             if message.text:
-                bot_message = await self._bot.edit_message_text(
-                    text=message.text,
-                    chat_id=db_topic.user.id,
-                    message_id=db_reply.bot_message_id
-                )
-
-            elif message.photo:
-                # Для редактирования медиа нужно использовать file_id
-                # Сначала получаем file_id из оригинального фото
-                photo_file_id = message.effective_attachment[-1].file_id
-                media = InputMediaPhoto(media=photo_file_id, caption=message.caption)
-                bot_message = await self._bot.edit_message_media(
-                    media=media,
-                    chat_id=db_topic.user.id,
-                    message_id=db_reply.bot_message_id
-                )
+                with request_priority(Priority.OPERATOR_REPLY):
+                    bot_message = await self._bot.edit_message_text(
+                        text=message.text,
+                        chat_id=db_topic.user_id,
+                        message_id=db_reply.bot_message_id
+                    )
+
+            elif media := self._get_input_media(message):
+                with request_priority(Priority.OPERATOR_REPLY):
+                    bot_message = await self._bot.edit_message_media(
+                        media=media,
+                        chat_id=db_topic.user_id,
+                        message_id=db_reply.bot_message_id
+                    )
 
             else:
                 await message.reply_text(UNSUPPORTED_CONTENT)
@@ -151,6 +323,19 @@ class TopicService:
         except Forbidden:
             await message.reply_text(USER_BLOCKED_BOT)
 
+    def _get_input_media(self, message: Message):
+        """
+        Новое медиа для редактирования ответа. Файл передается по file_id, без скачивания.
+        """
+        for media_type, input_media_class in self.INPUT_MEDIA_TYPES.items():
+            attachment = getattr(message, media_type)
+            if attachment:
+                # у фото несколько размеров, последний – самый большой
+                file_id = attachment[-1].file_id if media_type == 'photo' else attachment.file_id
+                return input_media_class(media=file_id, caption=message.caption)
+
+        return None
+
     async def delete_message_user(self, message_id: int):
         """
         Удаляет собственное сообщение пользователя
@@ -162,7 +347,7 @@ class TopicService:
         # Удаляем только если сообщение есть в базе
         if db_message:
             db_topic = await self._topic_repo.get_topic(db_message.topic_id)
-            await self._bot.delete_message(db_topic.user.id, db_message.id)
+            await self._bot.delete_message(db_topic.user_id, db_message.id)
             await self._message_repo.delete_message(db_message.id)
             await self._bot.delete_message(settings.CHAT_ID, db_message.bot_message_id)
         else:
@@ -174,14 +359,12 @@ class TopicService:
 
         :param message_id: ID перенаправленного сообщения от пользователя (сообщение бота)
         """
-        db_messages = await self._message_repo.filter_messages(bot_message_id=message_id)
+        db_message = await self._message_repo.get_message_by_bot_message_id(message_id)
 
         # Удаляем только если сообщение есть в базе
-        if db_messages:
-            # В пользовательском чате у этого сообщения есть одно соответствие
-            db_message = db_messages[0]
+        if db_message:
             db_topic = await self._topic_repo.get_topic(db_message.topic_id)
-            await self._bot.delete_message(db_topic.user.id, db_message.id)
+            await self._bot.delete_message(db_topic.user_id, db_message.id)
             # решено, что оператор чата чистит руками
             # await self._bot.delete_message(settings.CHAT_ID, message_id)
             await self._message_repo.delete_message(db_message.id)
@@ -200,22 +383,112 @@ class TopicService:
         # Удаляем только если ответ еще не удален
         if db_reply:
             db_topic = await self._topic_repo.get_topic(db_reply.topic_id)
-            await self._bot.delete_message(db_topic.user.id, db_reply.bot_message_id)
+            await self._bot.delete_message(db_topic.user_id, db_reply.bot_message_id)
             # решено, что оператор чата чистит руками
             # await self._bot.delete_message(settings.CHAT_ID, message_id)
             await self._reply_repo.delete_reply(db_reply.id)
         else:
             logger.debug(f'delete_reply: Not a tracked reply')
 
-    async def delete_history(self, message_thread_id: int):
+    async def delete_history(self, message_thread_id: int, purge_group: bool = False):
+        """
+        Удаление всей истории переписки у пользователя. История обходится порциями, поэтому память не зависит от
+        размера топика. Сообщения удаляются пачками deleteMessages по несколько запросов одновременно, ход удаления
+        показывается в топике сообщением, которое обновляется на месте.
+
+        Вызывается вне единицы работы: удаление длится минуты, поэтому каждая порция удаляется из БД в своей
+        транзакции. Соединение с БД не удерживается во время запросов к Bot API, а уже удаленное сохраняется, даже
+        если удаление прервано.
+
+        :param message_thread_id: ID топика
+        :param purge_group: удалить также пересланные сообщения и ответы в чате операторов
+        """
+        # история читается из основной БД: на реплике может не быть последних сообщений
+        pin_primary()
+
         db_topic = await self._topic_repo.get_topic(message_thread_id)
-        db_messages = await self._message_repo.filter_messages(topic_id=db_topic.id)
-        db_replies = await self._reply_repo.filter_replies(topic_id=db_topic.id)
+        if not db_topic:
+            logger.warning(f'Not a tracked telegram topic, skipping: {message_thread_id}')
+            return
 
-        for db_message in db_messages:
-            await self._bot.delete_message(db_topic.user.id, db_message.id)
-            await self._message_repo.delete_message(db_message.id)
+        progress = _DeleteProgress(
+            await self._bot.send_message(
+                settings.CHAT_ID,
+                message_thread_id=db_topic.id,
+                text=DELETE_HISTORY_PROGRESS.format(deleted=0),
+            )
+        )
+
+        # у сообщения пользователя копия в чате операторов – bot_message_id, у ответа оператора наоборот
+        async for db_messages in self._message_repo.iterate_message_batches(db_topic.id):
+            await self._delete_chat_messages(db_topic.user_id, [db_message.id for db_message in db_messages])
+            if purge_group:
+                await self._delete_chat_messages(
+                    settings.CHAT_ID, [db_message.bot_message_id for db_message in db_messages]
+                )
+            await self._message_repo.delete_messages(db_message.id for db_message in db_messages)
+            await progress.add(len(db_messages))
 
-        for db_reply in db_replies:
-            await self._bot.delete_message(db_topic.user.id, db_reply.bot_message_id)
-            await self._reply_repo.delete_reply(db_reply.id)
+        async for db_replies in self._reply_repo.iterate_reply_batches(db_topic.id):
+            await self._delete_chat_messages(db_topic.user_id, [db_reply.bot_message_id for db_reply in db_replies])
+            if purge_group:
+                await self._delete_chat_messages(settings.CHAT_ID, [db_reply.id for db_reply in db_replies])
+            await self._reply_repo.delete_replies(db_reply.id for db_reply in db_replies)
+            await progress.add(len(db_replies))
+
+        await progress.done()
+
+    async def _delete_chat_messages(self, chat_id: int, message_ids: Sequence[int]):
+        """
+        Удаляет сообщения в чате пачками по DELETE_MESSAGES_LIMIT, не больше DELETE_HISTORY_CONCURRENCY запросов
+        одновременно. Ошибка одной пачки не останавливает удаление остальных.
+        """
+        semaphore = asyncio.Semaphore(settings.DELETE_HISTORY_CONCURRENCY)
+
+        async def delete_chunk(chunk: Sequence[int]):
+            async with semaphore:
+                try:
+                    await self._bot.delete_messages(chat_id, chunk)
+                except TelegramError as e:
+                    # в том числе Forbidden: пользователь заблокировал бот
+                    logger.warning(f'Failed to delete messages in chat {chat_id}: {e.message}')
+
+        await asyncio.gather(*(
+            delete_chunk(message_ids[i:i + self.DELETE_MESSAGES_LIMIT])
+            for i in range(0, len(message_ids), self.DELETE_MESSAGES_LIMIT)
+        ))
+
+
+class _DeleteProgress:
+    """
+    Сообщение о ходе удаления истории. Редактируется не чаще DELETE_HISTORY_PROGRESS_INTERVAL секунд: Телеграм
+    ограничивает частоту сообщений в группах, включая редактирование.
+    """
+
+    def __init__(self, message: Message):
+        self._message = message
+        self._updated_at = time.monotonic()
+        self.deleted = 0
+
+    async def add(self, count: int):
+        self.deleted += count
+
+        if time.monotonic() - self._updated_at >= settings.DELETE_HISTORY_PROGRESS_INTERVAL:
+            self._updated_at = time.monotonic()
+            await self._message.edit_text(DELETE_HISTORY_PROGRESS.format(deleted=self.deleted))
+
+    async def done(self):
+        await self._message.edit_text(DELETE_HISTORY_DONE.format(deleted=self.deleted))
+
+
+@cache
+def get_topic_name_cache() -> TTLCache[int, str]:
+    """
+    Кэш последних примененных названий топиков по ID топика. Наличие записи значит также, что топик существовал в
+    Телеграм на момент переименования. Время жизни ограничивает, как долго сохраняется переименование топика
+    оператором.
+    """
+    topic_name_cache = TTLCache(settings.TOPIC_CACHE_SIZE, settings.TOPIC_CACHE_TTL)
+    metrics.register('cache.topic_names', topic_name_cache.stats)
+
+    return topic_name_cache
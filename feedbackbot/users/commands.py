@@ -0,0 +1,22 @@
+import asyncio
+
+import click
+
+from feedbackbot.core.db import get_engine, get_session_factory
+
+
+@click.command(short_help='Rebuild users state from logs')
+def backfill_users():
+    from feedbackbot.users.repos import UserRepo, get_user_cache, get_banned_user_ids
+
+    click.echo('Backfilling users state')
+
+    async def __inner():
+        engine = get_engine()
+        count = await UserRepo(
+            get_session_factory(engine), get_user_cache(), get_banned_user_ids()
+        ).backfill_users()
+        await engine.dispose()
+        return count
+
+    click.echo(f'Users updated: {asyncio.run(__inner())}')
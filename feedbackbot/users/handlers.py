@@ -1,10 +1,12 @@
 import logging
 
-from telegram import Update, Bot
+from telegram import Update, Bot, Message
 from telegram.ext import ContextTypes
 
 from feedbackbot import settings
+from feedbackbot.core.db import UnitOfWork
 from feedbackbot.core.handlers import BaseCommandHandler
+from feedbackbot.core.media_groups import MediaGroupCollector
 from feedbackbot.topics.services import TopicService
 from feedbackbot.users.constants import USER_BANNED
 from feedbackbot.users.services import UserService
@@ -13,37 +15,93 @@ logger = logging.getLogger(__name__)
 
 
 class ForwardMessageHandler:
-    """ Обработчик сообщений от пользователя """
+    """
+    Обработчик сообщений от пользователя.
 
-    def __init__(self, bot: Bot, user_service: UserService, topic_service: TopicService):
+    Сообщения альбома собираются сборщиком альбомов и пересылаются вместе, одним запросом (см. MediaGroupCollector).
+    """
+
+    def __init__(self, bot: Bot, unit_of_work: UnitOfWork, user_service: UserService, topic_service: TopicService,
+                 media_group_collector: MediaGroupCollector):
         self._bot = bot
+        self._unit_of_work = unit_of_work
         self._user_service = user_service
         self._topic_service = topic_service
+        self._media_group_collector = media_group_collector
 
     async def __call__(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not update.message:
             # когда пользователь редактирует старое сообщение
             return
 
-        tg_user = update.message.from_user
+        if update.message.media_group_id:
+            self._media_group_collector.add(update.message, self._forward_media_group)
+            return
+
+        # альбом, отправленный раньше, пересылается первым
+        await self._media_group_collector.flush_preceding(update.message)
+        await self._forward(update.message)
+
+    async def _forward_media_group(self, messages: list[Message]):
+        # альбом собирается вне обработки обновления, поэтому единица работы своя
+        async with self._unit_of_work():
+            await self._forward(messages[0], messages)
+
+    async def _forward(self, message: Message, media_group: list[Message] | None = None):
+        """
+        Ставит в очередь пересылку сообщения или альбома пользователя в его топик.
+
+        :param message: Сообщение пользователя, для альбома – первое сообщение
+        :param media_group: Все сообщения альбома
+        """
+        tg_user = message.from_user
+
+        # Проверяем бан: известные забаненные пользователи отсекаются без обращения к БД
+        if self._user_service.is_banned(tg_user):
+            await message.reply_text(USER_BANNED)
+            return
 
         db_user = await self._user_service.get_or_create_user(tg_user)
 
-        # Проверяем бан
         if db_user.is_banned:
-            await update.message.reply_text(USER_BANNED)
+            await message.reply_text(USER_BANNED)
             return
 
         created, db_topic = await self._topic_service.get_or_create_user_topic(tg_user, db_user)
 
-        await self._user_service.log_user_changes(tg_user, db_topic.id)
+        await self._user_service.log_user_changes(tg_user, db_user, db_topic.id)
 
         # при создании топика прикрепляем начальную карточку пользователя
         if created:
-            message = await self._user_service.send_userlog_message(db_topic.id)
-            await self._bot.pin_chat_message(settings.CHAT_ID, message_id=message.id)
+            await self._pin_user_card(db_topic.id)
+
+        await self._topic_service.forward_user_pm(media_group or [message], db_topic)
+
+    async def deliver(self, payload: dict):
+        """
+        Доставка пересылки из очереди outbox (см. TopicService.forward_user_pm).
+
+        Удаление топика в Телеграм выясняется при пересылке, а не проверкой на каждом сообщении. Тогда пересылка идет в
+        активный топик пользователя, а если он и есть удаленный – в новый топик с карточкой пользователя.
+        """
+        if await self._topic_service.deliver_user_pm(payload):
+            return
+
+        db_user = await self._user_service.get_user_state(payload['user_id'])
+        topic_id = db_user.active_topic_id
+
+        # топик мог быть пересоздан предыдущей пересылкой
+        if topic_id == payload['topic_id']:
+            db_topic = await self._topic_service.recreate_user_topic(db_user)
+            await self._pin_user_card(db_topic.id)
+            topic_id = db_topic.id
+
+        if not await self._topic_service.deliver_user_pm(payload, topic_id=topic_id):
+            raise RuntimeError(f'Topic was deleted right after creation: {topic_id}')
 
-        await self._topic_service.forward_user_pm(update.message, db_topic)
+    async def _pin_user_card(self, topic_id: int):
+        message = await self._user_service.send_userlog_message(topic_id)
+        await self._bot.pin_chat_message(settings.CHAT_ID, message_id=message.id)
 
 
 class BanCommandHandler(BaseCommandHandler):
@@ -1,7 +1,7 @@
 __all__ = ('User', 'UserLog')
 import datetime
 
-from sqlalchemy import BigInteger, ForeignKey, DateTime, func
+from sqlalchemy import BigInteger, Integer, ForeignKey, DateTime, Index, func
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from feedbackbot.core.db import Base
@@ -14,11 +14,26 @@ class User(Base):
     version: Mapped[int] = mapped_column(default=0)
     is_banned: Mapped[bool] = mapped_column(default=False)
 
+    # Текущее состояние пользователя: последние записанные в user_logs значения полей и последний созданный топик.
+    # Обновляются в одной транзакции с записью лога и созданием топика (см. UserService и TopicService), восстановить
+    # их по истории можно командой backfillusers.
+    full_name: Mapped[str | None] = mapped_column()
+    username: Mapped[str | None] = mapped_column()
+    # внешнего ключа нет: topics уже ссылается на users
+    active_topic_id: Mapped[int | None] = mapped_column(BigInteger)
+
 
 class UserLog(Base):
     __tablename__ = 'user_logs'
+    __table_args__ = (
+        Index('ix_user_logs_user_id_field_timestamp', 'user_id', 'field', 'timestamp'),
+        Index('ix_user_logs_timestamp', 'timestamp', postgresql_using='brin'),
+    )
 
-    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    # SQLite генерирует значения только для колонки INTEGER PRIMARY KEY
+    id: Mapped[int] = mapped_column(
+        BigInteger().with_variant(Integer, 'sqlite'), primary_key=True, autoincrement=True
+    )
 
     user_id: Mapped[int] = mapped_column(BigInteger, ForeignKey('users.id'))
     user: Mapped['User'] = relationship('User', backref='logs', lazy='joined')
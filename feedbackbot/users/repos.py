@@ -1,31 +1,244 @@
-from feedbackbot.core.db import BaseAsyncDBRepo
+import datetime
+from functools import cache, partial
+from collections.abc import Collection
+from typing import Callable, NamedTuple
+
+from sqlalchemy import select, update, func, exists
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from feedbackbot import settings
+from feedbackbot.core.cache import TTLCache
+from feedbackbot.core.db import BaseAsyncDBRepo, FilterShape, on_commit
+from feedbackbot.core.metrics import metrics
+from feedbackbot.topics.models import Topic
+from feedbackbot.users.enums import UserLogField
 from feedbackbot.users.models import User, UserLog
 
 
+class UserState(NamedTuple):
+    """
+    Текущее состояние пользователя без привязки к сессии БД.
+    """
+    id: int
+    is_banned: bool
+    full_name: str | None
+    username: str | None
+    active_topic_id: int | None
+
+    @classmethod
+    def from_user(cls, db_user: User) -> 'UserState':
+        return cls(db_user.id, db_user.is_banned, db_user.full_name, db_user.username, db_user.active_topic_id)
+
+
 class UserRepo(BaseAsyncDBRepo[User]):
+    """
+    Репозиторий пользователей.
+
+    Состояние пользователей кэшируется, а ID забаненных пользователей хранятся в памяти целиком, поэтому проверки на
+    входящем пути не обращаются к БД. Кэши обновляются только после коммита записи (см. on_commit).
+    """
     model_class = User
 
+    def __init__(self, session: Callable[..., AsyncSession], user_cache: TTLCache[int, UserState],
+                 banned_user_ids: set[int]):
+        super().__init__(session)
+        self._user_cache = user_cache
+        self._banned_user_ids = banned_user_ids
+
     async def create_user(self, user_id: int):
         return await self.create(
             id=user_id,
         )
 
+    async def get_or_create_user(self, user_id: int) -> UserState:
+        user_state = self._user_cache.get(user_id)
+
+        if user_state is None:
+            db_user = await self.get_or_create(
+                id=user_id,
+            )
+            user_state = UserState.from_user(db_user)
+            on_commit(partial(self._remember_user, user_state))
+
+        return user_state
+
     async def get_user(self, user_id: int):
         return await self.get(id=user_id)
 
+    async def get_user_state(self, user_id: int) -> UserState | None:
+        user_state = self._user_cache.get(user_id)
+
+        if user_state is None:
+            db_user = await self.get_user(user_id)
+            if db_user is None:
+                return None
+
+            user_state = UserState.from_user(db_user)
+            self._remember_user(user_state)
+
+        return user_state
+
     async def update_user(self, user_id: int, **kwargs):
-        return await self.update(self.model_class.id==user_id, **kwargs)
+        db_user = await self.update(self.model_class.id==user_id, **kwargs)
+        on_commit(partial(self._remember_user, UserState.from_user(db_user)))
+
+        return db_user
+
+    def is_banned(self, user_id: int) -> bool:
+        return user_id in self._banned_user_ids
+
+    async def load_banned_users(self) -> int:
+        """
+        Загружает в память ID всех забаненных пользователей.
+
+        :return: количество забаненных пользователей
+        """
+        async with self._reading() as session:
+            res = await session.execute(select(self.model_class.id).where(self.model_class.is_banned))
+            user_ids = set(res.scalars())
+
+        self._banned_user_ids.clear()
+        self._banned_user_ids.update(user_ids)
+
+        return len(user_ids)
+
+    async def preload_users(self, user_ids: Collection[int]) -> int:
+        """
+        Загружает в кэш состояние пользователей user_ids одним запросом.
+
+        :return: количество загруженных пользователей
+        """
+        if not user_ids:
+            return 0
+
+        async with self._reading() as session:
+            res = await session.execute(
+                select(self.model_class).where(self._in(session, self.model_class.id, list(user_ids)))
+            )
+            db_users = res.scalars().all()
+
+        for db_user in db_users:
+            self._remember_user(UserState.from_user(db_user))
+
+        return len(db_users)
+
+    async def count_recipients(self) -> int:
+        """
+        Количество незабаненных пользователей – получателей рассылки.
+        """
+        async with self._reading() as session:
+            res = await session.execute(
+                select(func.count()).select_from(self.model_class).where(~self.model_class.is_banned)
+            )
+            return res.scalar_one()
+
+    def iterate_recipient_batches(self, after_user_id: int = 0, batch_size: int | None = None):
+        """
+        Незабаненные пользователи с ID больше after_user_id по возрастанию ID, порциями (см. iterate_batches).
+        """
+        return self.iterate_batches(
+            self.model_class.id > after_user_id,
+            ~self.model_class.is_banned,
+            batch_size=batch_size,
+        )
+
+    def _remember_user(self, user_state: UserState):
+        self._user_cache.set(user_state.id, user_state)
+
+        if user_state.is_banned:
+            self._banned_user_ids.add(user_state.id)
+        else:
+            self._banned_user_ids.discard(user_state.id)
+
+    async def backfill_users(self) -> int:
+        """
+        Восстанавливает текущее состояние всех пользователей (имя, имя пользователя, активный топик) по user_logs и
+        topics.
+
+        :return: количество обновленных пользователей
+        """
+        def last_value(field: UserLogField):
+            return (
+                select(UserLog.value)
+                .where(UserLog.user_id==User.id, UserLog.field==field.value)
+                .order_by(UserLog.timestamp.desc(), UserLog.id.desc())
+                .limit(1)
+                .scalar_subquery()
+            )
+
+        async with self._writing() as session:
+            res = await session.execute(
+                update(User).values(
+                    full_name=last_value(UserLogField.FULL_NAME),
+                    username=last_value(UserLogField.USERNAME),
+                    active_topic_id=select(func.max(Topic.id)).where(Topic.user_id==User.id).scalar_subquery(),
+                ),
+                execution_options={'synchronize_session': False},
+            )
+
+        return res.rowcount
 
 
 class UserLogRepo(BaseAsyncDBRepo[UserLog]):
     model_class = UserLog
+    hot_filters = (
+        FilterShape(('user_id', 'field')),
+        FilterShape(('user_id',), ('timestamp', 'asc')),
+    )
+
+    async def create_user_log(self, user_id: int, field: str, value: str,
+                              timestamp: datetime.datetime | None = None):
+        kwargs = {}
+        # без явного значения время записи проставляет БД: None записался бы как NULL
+        if timestamp is not None:
+            kwargs['timestamp'] = timestamp
 
-    async def create_user_log(self, user_id: int, field: str, value: str):
         return await self.create(
             user_id=user_id,
             field=field,
             value=value,
+            **kwargs,
         )
 
     async def filter_user_logs(self, user_id: int, field: str | None = None, **kwargs):
         return await self.filter(user_id=user_id, field=field, **kwargs)
+
+    async def has_user_logs(self, user_id: int, field: str) -> bool:
+        """
+        Есть ли у пользователя записи лога по полю field. Проверка EXISTS: записи не загружаются.
+        """
+        async with self._reading() as session:
+            res = await session.execute(
+                select(exists().where(self.model_class.user_id==user_id, self.model_class.field==field))
+            )
+            return res.scalar_one()
+
+    def iterate_user_logs(self, user_id: int, batch_size: int | None = None):
+        return self.iterate(
+            self.model_class.user_id==user_id,
+            batch_size=batch_size,
+            ordering=('timestamp', 'asc'),
+        )
+
+    async def purge_user_logs(self, older_than: datetime.datetime, batch_size: int | None = None):
+        return await self.purge(self.model_class.timestamp < older_than, batch_size=batch_size)
+
+
+@cache
+def get_user_cache() -> TTLCache[int, UserState]:
+    """
+    Кэш состояния пользователей по ID. Один на процесс, как и движок БД.
+    """
+    user_cache = TTLCache(settings.USER_CACHE_SIZE, settings.USER_CACHE_TTL)
+    metrics.register('cache.users', lambda: {**user_cache.stats(), 'banned': len(get_banned_user_ids())})
+
+    return user_cache
+
+
+@cache
+def get_banned_user_ids() -> set[int]:
+    """
+    ID забаненных пользователей. Множество загружается при старте (см. UserRepo.load_banned_users) и
+    поддерживается репозиторием при изменении статуса бана.
+    """
+    return set()
@@ -1,16 +1,32 @@
+import datetime
 import logging
+from functools import cache, partial
 
 from telegram import User as TGUser, Bot, Message
 
 from feedbackbot import settings
+from feedbackbot.core.cache import TTLCache
+from feedbackbot.core.db import UnitOfWork, on_commit
+from feedbackbot.core.metrics import metrics
 from feedbackbot.topics.repos import TopicRepo
 from feedbackbot.users.enums import UserLogField, UserLogValue
-from feedbackbot.users.models import User as DBUser
-from feedbackbot.users.repos import UserRepo, UserLogRepo
+from feedbackbot.users.repos import UserRepo, UserLogRepo, UserState
 
 logger = logging.getLogger(__name__)
 
 
+class UserCard:
+    """
+    Карточка пользователя (/userlog): первичная информация – первые записи имени и имени пользователя, остальные
+    записи лога – строки истории изменений. Карточка собирается по логу один раз и дальше дополняется новыми записями.
+    """
+    INITIAL_FIELDS = (UserLogField.FULL_NAME.value, UserLogField.USERNAME.value)
+
+    def __init__(self):
+        self.initial_values: dict[str, str] = {}
+        self.history: list[str] = []
+
+
 class UserService:
     USERLOG_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
     FIELD_NAME_HUMAN_READABLE_MAPPING = {
@@ -19,19 +35,32 @@ class UserService:
         'is_banned': 'статус бана',
     }
 
-    def __init__(self, bot: Bot, topic_repo: TopicRepo, user_repo: UserRepo, user_log_repo: UserLogRepo):
+    def __init__(self, bot: Bot, unit_of_work: UnitOfWork, topic_repo: TopicRepo, user_repo: UserRepo,
+                 user_log_repo: UserLogRepo, user_card_cache: TTLCache[int, UserCard]):
         self._bot = bot
+        self._unit_of_work = unit_of_work
+        self._user_card_cache = user_card_cache
         self._topic_repo = topic_repo
         self._user_repo = user_repo
         self._user_log_repo = user_log_repo
 
-    async def get_or_create_user(self, tg_user: TGUser) -> DBUser:
-        db_user = await self._user_repo.get(id=tg_user.id)
+    async def get_or_create_user(self, tg_user: TGUser) -> UserState:
+        return await self._user_repo.get_or_create_user(tg_user.id)
+
+    async def get_user_state(self, user_id: int) -> UserState | None:
+        return await self._user_repo.get_user_state(user_id)
+
+    def is_banned(self, tg_user: TGUser) -> bool:
+        """
+        Проверка бана по множеству забаненных пользователей в памяти, без обращения к БД.
+        """
+        return self._user_repo.is_banned(tg_user.id)
 
-        if not db_user:
-            db_user = await self._user_repo.create_user(tg_user.id)
+    async def load_banned_users(self) -> int:
+        count = await self._user_repo.load_banned_users()
+        logger.info(f'Banned users loaded: {count}')
 
-        return db_user
+        return count
 
     async def set_user_ban_by_topic(self, message_thread_id: int, ban_status: bool):
         """
@@ -41,36 +70,47 @@ class UserService:
 
         if db_topic:
             logger.debug(f'Setting user {db_topic.user_id} ban status  for the topic: {message_thread_id}')
-            await self._user_repo.update_user(db_topic.user_id, is_banned=ban_status)
-            await self._log_user_detail_change(
-                db_topic.user_id,
-                UserLogValue.TRUE.value if ban_status else UserLogValue.FALSE.value,
-                UserLogField.IS_BANNED.value,
-                db_topic.id
-            )
+            db_user = await self._user_repo.get_user_state(db_topic.user_id)
+            # пока пользователя ни разу не банили, истории поля нет, и о первом бане не оповещаем
+            prev_value = None
+            if await self._user_log_repo.has_user_logs(db_topic.user_id, UserLogField.IS_BANNED.value):
+                prev_value = UserLogValue.TRUE.value if db_user.is_banned else UserLogValue.FALSE.value
+            new_value = UserLogValue.TRUE.value if ban_status else UserLogValue.FALSE.value
+
+            async with self._unit_of_work():
+                await self._user_repo.update_user(db_topic.user_id, is_banned=ban_status)
+                await self._log_user_detail_change(
+                    db_topic.user_id, prev_value, new_value, UserLogField.IS_BANNED.value, db_topic.id
+                )
 
         else:
             logger.debug(f'Not a tracked topic, no external user associated with it: {message_thread_id}')
 
-    async def log_user_changes(self, tg_user: TGUser, topic_id: int):
+    async def log_user_changes(self, tg_user: TGUser, db_user: UserState, topic_id: int):
         """
-        Логгирует в базу и топик изменения деталей пользователя
+        Логгирует в базу и топик изменения деталей пользователя. Предыдущие значения берутся из текущего состояния
+        пользователя, запись лога и обновление состояния выполняются в одной транзакции.
 
         :param tg_user: объект пользователя Телеграм
+        :param db_user: пользователь в базе
         :param topic_id: ID топика для вывода оповещения об изменении
         """
-        await self._log_user_detail_change(
-            tg_user.id, tg_user.full_name,
-            UserLogField.FULL_NAME.value,
-            topic_id
-        )
-        # имя пользователя можно удалить совсем
-        await self._log_user_detail_change(
-            tg_user.id, tg_user.username or UserLogValue.EMPTY.value,
-            UserLogField.USERNAME.value,
-            topic_id
+        changes = {}
+        fields = (
+            (UserLogField.FULL_NAME.value, tg_user.full_name),
+            # имя пользователя можно удалить совсем
+            (UserLogField.USERNAME.value, tg_user.username or UserLogValue.EMPTY.value),
         )
 
+        async with self._unit_of_work():
+            for field_name, new_value in fields:
+                prev_value = getattr(db_user, field_name)
+                if await self._log_user_detail_change(db_user.id, prev_value, new_value, field_name, topic_id):
+                    changes[field_name] = new_value
+
+            if changes:
+                await self._user_repo.update_user(db_user.id, **changes)
+
     async def send_userlog_message(self, message_thread_id) -> Message:
         """
         Вывести в топик сообщение с информацией о пользователе и его изменениях.
@@ -89,51 +129,74 @@ class UserService:
 
         return message
 
-    async def _log_user_detail_change(self, user_id: int, new_value: str, field_name: str, topic_id: int):
-        prev_value = None
-
-        logs = await self._user_log_repo.filter_user_logs(user_id, field_name)
-        if logs:
-            prev_value = logs[-1].value
-
-        if new_value != prev_value:
-            # оповещаем только если уже есть история
-            if prev_value:
-                await self._bot.send_message(
-                    settings.CHAT_ID,
-                    message_thread_id=topic_id,
-                    text=(
-                        f'Пользователь изменил поле "{self._get_hr_field_name(field_name)}": '
-                        f'`{prev_value}` -> `{new_value}`'
-                    ),
-                    parse_mode='Markdown'
-                )
-            await self._user_log_repo.create_user_log(user_id, field=field_name, value=new_value)
+    async def _log_user_detail_change(self, user_id: int, prev_value: str | None, new_value: str, field_name: str,
+                                      topic_id: int) -> bool:
+        """
+        Записывает новое значение поля в лог, если оно изменилось.
+
+        :return: было ли значение изменено
+        """
+        if new_value == prev_value:
+            return False
+
+        # оповещаем только если уже есть история
+        if prev_value:
+            await self._bot.send_message(
+                settings.CHAT_ID,
+                message_thread_id=topic_id,
+                text=(
+                    f'Пользователь изменил поле "{self._get_hr_field_name(field_name)}": '
+                    f'`{prev_value}` -> `{new_value}`'
+                ),
+                parse_mode='Markdown'
+            )
+        timestamp = datetime.datetime.now(datetime.timezone.utc)
+        await self._user_log_repo.create_user_log(user_id, field=field_name, value=new_value, timestamp=timestamp)
+        # закэшированная карточка дополняется новой записью после коммита, без повторного чтения лога
+        on_commit(partial(self._append_to_cached_card, user_id, field_name, new_value, timestamp))
+
+        return True
 
     async def _build_user_info(self, user_id: int) -> str:
-        all_logs = await self._user_log_repo.filter_user_logs(user_id, ordering=('timestamp', 'asc'))
-        full_name_logs = list(filter(lambda e: e.field == UserLogField.FULL_NAME.value, all_logs))
-        username_logs = list(filter(lambda e: e.field == UserLogField.USERNAME.value, all_logs))
+        user_card = self._user_card_cache.get(user_id)
+
+        if user_card is None:
+            user_card = UserCard()
+            async for log_record in self._user_log_repo.iterate_user_logs(user_id):
+                self._add_to_card(user_card, log_record.field, log_record.value, log_record.timestamp)
+
+            on_commit(partial(self._user_card_cache.set, user_id, user_card))
 
         msg = (f'Пользователь {user_id}:\n'
                f'\n'
                f'*Первичная информация*\n'
-               f'Полное имя: {full_name_logs[0].value}\n'
+               f'Полное имя: {user_card.initial_values.get(UserLogField.FULL_NAME.value)}\n'
                f'Имя пользователя: '
-               f'[@{self._escape_username(username_logs[0].value)}](tg://user?id={user_id})\n'
+               f'[@{self._escape_username(user_card.initial_values.get(UserLogField.USERNAME.value, ""))}]'
+               f'(tg://user?id={user_id})\n'
                f'\n')
 
         # если есть записи, кроме первичного лога
-        if len(all_logs) > 2:
+        if user_card.history:
             msg += f'*Полная история изменений*\n'
-            for log_record in all_logs[2:]:
-                msg += (
-                    f'- {log_record.timestamp.strftime(self.USERLOG_DATE_FORMAT)}: '
-                    f'Поле "{self._get_hr_field_name(log_record.field)}" изменено на `{log_record.value}`\n'
-                )
+            msg += ''.join(user_card.history)
 
         return msg
 
+    def _append_to_cached_card(self, user_id: int, field_name: str, value: str, timestamp: datetime.datetime):
+        user_card = self._user_card_cache.get(user_id)
+        if user_card is not None:
+            self._add_to_card(user_card, field_name, value, timestamp)
+
+    def _add_to_card(self, user_card: UserCard, field_name: str, value: str, timestamp: datetime.datetime):
+        if field_name in UserCard.INITIAL_FIELDS and field_name not in user_card.initial_values:
+            user_card.initial_values[field_name] = value
+        else:
+            user_card.history.append(
+                f'- {timestamp.strftime(self.USERLOG_DATE_FORMAT)}: '
+                f'Поле "{self._get_hr_field_name(field_name)}" изменено на `{value}`\n'
+            )
+
     def _get_hr_field_name(self, field_name):
         return self.FIELD_NAME_HUMAN_READABLE_MAPPING.get(field_name) or field_name
 
@@ -143,3 +206,14 @@ class UserService:
             .replace('[', '')
             .replace(']', '')
         )
+
+
+@cache
+def get_user_card_cache() -> TTLCache[int, UserCard]:
+    """
+    Кэш карточек пользователей (/userlog) по ID пользователя.
+    """
+    user_card_cache = TTLCache(settings.USER_CARD_CACHE_SIZE, settings.USER_CARD_CACHE_TTL)
+    metrics.register('cache.user_cards', user_card_cache.stats)
+
+    return user_card_cache
@@ -16,6 +16,10 @@ from tests.factories import (
     TgMessageOriginFactory,
     TgUpdateFactory,
 )  # yapf: disable
+from feedbackbot.topics.repos import get_topic_cache, get_message_index, get_reply_index
+from feedbackbot.topics.services import get_topic_name_cache
+from feedbackbot.users.repos import get_user_cache, get_banned_user_ids
+from feedbackbot.users.services import get_user_card_cache
 from tests.factories.telegram import MockBot
 from tests.utils.db import AsyncContextManagerWrapper, AsyncSessionMock
 
@@ -84,6 +88,22 @@ def setup_factory_session(mocked_session):
     DbReplyFactory._meta.sqlalchemy_session = mocked_session
 
 
+# Cache
+
+@pytest.fixture(scope='function', autouse=True)
+def clear_caches():
+    """
+    Кэши общие на процесс, а БД у каждого теста своя.
+    """
+    get_topic_cache().clear()
+    get_topic_name_cache().clear()
+    get_message_index().clear()
+    get_reply_index().clear()
+    get_user_cache().clear()
+    get_banned_user_ids().clear()
+    get_user_card_cache().clear()
+
+
 # Telegram
 
 @pytest.fixture(scope='function')
@@ -1,11 +1,9 @@
 __all__ = ('MockBot', 'TgUserFactory', 'TgChatFactory', 'TgMessageFactory', 'TgMessageOriginFactory', 'TgUpdateFactory')
 
-from unittest.mock import AsyncMock
-
 import factory
 import factory.fuzzy
 from faker import Faker
-from telegram import Update, Message, Chat, User, ForumTopic, MessageOrigin
+from telegram import Update, Message, Chat, ChatMemberMember, User, ForumTopic, MessageOrigin, MessageId
 from telegram.constants import ChatType
 
 fake = Faker()
@@ -16,7 +14,7 @@ class MockBot:
         self.sent_messages = []
         self.forwarded_messages = []
         self.edited_messages = []
-        self.attachment_file = AsyncMock()
+        self.copied_message_ids = []
 
     async def send_message(self, *args, **kwargs):
         init_kwargs = {}
@@ -31,13 +29,30 @@ class MockBot:
 
         return msg
 
-    async def send_photo(self, *args, **kwargs):
-        msg = TgMessageFactory()
-        msg._bot = self
+    async def copy_message(self, *args, **kwargs):
+        message_id = MessageId(fake.pyint(min_value=1000000000, max_value=9999999999))
 
-        self.sent_messages.append(msg)
+        self.copied_message_ids.append(message_id)
 
-        return msg
+        return message_id
+
+    async def copy_messages(self, *args, **kwargs):
+        message_ids = tuple(
+            MessageId(fake.pyint(min_value=1000000000, max_value=9999999999)) for _ in kwargs['message_ids']
+        )
+
+        self.copied_message_ids.extend(message_ids)
+
+        return message_ids
+
+    async def forward_messages(self, *args, **kwargs):
+        message_ids = tuple(
+            MessageId(fake.pyint(min_value=1000000000, max_value=9999999999)) for _ in kwargs['message_ids']
+        )
+
+        self.forwarded_messages.extend(message_ids)
+
+        return message_ids
 
     async def forward_message(self, *args, **kwargs):
         msg = TgMessageFactory()
@@ -50,9 +65,15 @@ class MockBot:
     async def delete_message(self, *args, **kwargs):
         pass
 
+    async def delete_messages(self, *args, **kwargs):
+        return True
+
     async def pin_chat_message(self, *args, **kwargs):
         pass
 
+    async def get_chat_member(self, chat_id, user_id, *args, **kwargs):
+        return ChatMemberMember(user=TgUserFactory(id=user_id))
+
     async def create_forum_topic(self, *args, **kwargs):
         topic = TgForumTopicFactory()
         return topic
@@ -61,9 +82,6 @@ class MockBot:
         topic = TgForumTopicFactory()
         return topic
 
-    async def get_file(self, *args, **kwargs):
-        return self.attachment_file
-
     async def edit_message_text(self, *args, **kwargs):
         init_kwargs = {}
 
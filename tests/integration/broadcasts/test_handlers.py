@@ -0,0 +1,96 @@
+from unittest.mock import MagicMock
+
+import pytest
+from pytest_mock import MockerFixture
+from telegram import ChatMemberOwner
+
+from feedbackbot.broadcasts.constants import BROADCAST_USAGE
+from feedbackbot.broadcasts.handlers import BroadcastCommandHandler
+from feedbackbot.broadcasts.models import Broadcast
+from feedbackbot.core.di import DIAsync
+
+
+class TestBroadcastCommandHandler:
+
+    @pytest.fixture(autouse=True)
+    def setup_method(self, bot, session_wrapper):
+        self.under_test: BroadcastCommandHandler = DIAsync(
+            session=session_wrapper,
+            bot=bot,
+        ).broadcast_command_handler
+        self.context = MagicMock()
+
+    def make_admin(self, mocker: MockerFixture, bot, tg_update):
+        mocker.patch('feedbackbot.settings.CHAT_ID', tg_update.message.chat_id)
+        mocker.patch.object(
+            bot, 'get_chat_member', return_value=ChatMemberOwner(user=tg_update.message.from_user, is_anonymous=False)
+        )
+
+    @pytest.mark.asyncio
+    async def test_call_happy_path(self, mocker: MockerFixture, bot, mocked_session, tg_update_factory,
+                                   tg_message_factory):  # yapf: disable
+        # given
+        tg_update = tg_update_factory(
+            message=tg_message_factory(text='/broadcast', reply_to_message=tg_message_factory(text='news'))
+        )
+        self.make_admin(mocker, bot, tg_update)
+
+        # when
+        await self.under_test(tg_update, self.context)
+
+        # then
+        db_broadcast = mocked_session.query(Broadcast).one()
+        assert db_broadcast.message_id == tg_update.message.reply_to_message.message_id
+        # рассылка запущена в фоне
+        self.context.application.create_task.assert_called_once()
+        self.context.application.create_task.call_args.args[0].close()
+
+    @pytest.mark.asyncio
+    async def test_call_not_admin(self, mocker: MockerFixture, bot, mocked_session, tg_update_factory,
+                                  tg_message_factory):  # yapf: disable
+        # given
+        tg_update = tg_update_factory(
+            message=tg_message_factory(text='/broadcast', reply_to_message=tg_message_factory(text='news'))
+        )
+        mocker.patch('feedbackbot.settings.CHAT_ID', tg_update.message.chat_id)
+
+        # when
+        await self.under_test(tg_update, self.context)
+
+        # then
+        assert mocked_session.query(Broadcast).count() == 0
+        assert bot.sent_messages == []
+        self.context.application.create_task.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_call_not_reply(self, mocker: MockerFixture, bot, mocked_session, tg_update_factory,
+                                  tg_message_factory):  # yapf: disable
+        # given
+        tg_update = tg_update_factory(message=tg_message_factory(text='/broadcast', reply_to_message=None))
+        self.make_admin(mocker, bot, tg_update)
+
+        # when
+        await self.under_test(tg_update, self.context)
+
+        # then
+        assert bot.sent_messages[0].text == BROADCAST_USAGE
+        assert mocked_session.query(Broadcast).count() == 0
+
+    @pytest.mark.asyncio
+    async def test_call_other_chat(self, mocker: MockerFixture, bot, mocked_session, tg_update_factory,
+                                   tg_message_factory):  # yapf: disable
+        # given
+        # администратор чата операторов отправил команду в личный чат с ботом
+        tg_update = tg_update_factory(
+            message=tg_message_factory(text='/broadcast', reply_to_message=tg_message_factory(text='news'))
+        )
+        self.make_admin(mocker, bot, tg_update)
+        mocker.patch('feedbackbot.settings.CHAT_ID', tg_update.message.chat_id + 1)
+
+        # when
+        await self.under_test(tg_update, self.context)
+
+        # then
+        bot.get_chat_member.assert_not_called()
+        assert mocked_session.query(Broadcast).count() == 0
+        self.context.application.create_task.assert_not_called()
@@ -1,13 +1,14 @@
 import random
-from unittest.mock import call
 
 import pytest
 from faker import Generator
 from pytest_mock import MockerFixture
 from telegram import Update
+from telegram.error import BadRequest
 
-from feedbackbot import settings
 from feedbackbot.core.di import DIAsync
+from feedbackbot.outbox.models import OutboxEntry
+from feedbackbot.outbox.services import OutboxDispatcher
 from feedbackbot.topics.constants import UNSUPPORTED_CONTENT
 from feedbackbot.topics.handlers import ReplyMessageHandler, DeleteCommandHandler, DeleteHistoryCommandHandler
 from feedbackbot.topics.models import Reply, Message
@@ -22,6 +23,10 @@ class TestReplyMessageHandler:
             session=session_wrapper,
             bot=bot,
         ).reply_message_handler
+        self.outbox: OutboxDispatcher = DIAsync(
+            session=session_wrapper,
+            bot=bot,
+        ).outbox_dispatcher
 
     @pytest.mark.asyncio
     async def test_call_reply_happy_path_text(self, mocker: MockerFixture, bot, mocked_session, tg_update_factory,
@@ -43,18 +48,27 @@ class TestReplyMessageHandler:
 
         mocker.patch('feedbackbot.settings.BOT_ID', self.BOT_ID)
         reply_user_pm_spy = mocker.spy(self.under_test._service, 'reply_user_pm')
-        bot_send_message_spy = mocker.spy(bot, 'send_message')
+        bot_copy_message_spy = mocker.spy(bot, 'copy_message')
 
         # when
         await self.under_test(tg_update, {})
 
         # then
         reply_user_pm_spy.assert_called_once()
-        # ответ отправлен
-        bot_send_message_spy.assert_called_once_with(chat_id=db_topic.user.id, text=tg_update.message.text)
-        # запись создана
+        # обработчик только ставит ответ в очередь
+        bot_copy_message_spy.assert_not_called()
+        assert mocked_session.query(OutboxEntry).count() == 1
+
+        await self.outbox.dispatch_due()
+
+        # ответ скопирован пользователю
+        bot_copy_message_spy.assert_called_once_with(
+            chat_id=db_topic.user.id, from_chat_id=tg_update.message.chat_id, message_id=tg_update.message.id
+        )
+        # запись создана, запрос отмечен выполненным
         actual_reply = mocked_session.query(Reply).filter_by(topic_id=db_topic.id).first()
         assert actual_reply is not None
+        assert mocked_session.query(OutboxEntry).one().delivered_at is not None
 
     @pytest.mark.asyncio
     async def test_call_reply_happy_path_photo(self, mocker: MockerFixture, bot, mocked_session, tg_update_factory,
@@ -76,25 +90,68 @@ class TestReplyMessageHandler:
 
         mocker.patch('feedbackbot.settings.BOT_ID', self.BOT_ID)
         reply_user_pm_spy = mocker.spy(self.under_test._service, 'reply_user_pm')
-        bot_send_photo_spy = mocker.spy(bot, 'send_photo')
+        bot_copy_message_spy = mocker.spy(bot, 'copy_message')
 
         # when
         await self.under_test(tg_update, {})
+        await self.outbox.dispatch_due()
 
         # then
         reply_user_pm_spy.assert_called_once()
 
-        # ответ отправлен
-        bot_send_photo_spy.assert_called_once()
-        bot.attachment_file.download_to_drive.assert_called_once()
-        assert str(bot.attachment_file.download_to_drive.call_args[0][0]).startswith(str(settings.TMP_PATH))
+        # ответ скопирован пользователю
+        bot_copy_message_spy.assert_called_once_with(
+            chat_id=db_topic.user.id, from_chat_id=tg_update.message.chat_id, message_id=tg_update.message.id
+        )
 
         # запись создана
         actual_reply = mocked_session.query(Reply).filter_by(topic_id=db_topic.id).first()
         assert actual_reply is not None
 
     @pytest.mark.asyncio
-    async def test_call_reply_unknown_content_type(self, mocker: MockerFixture, bot, tg_update_factory,
+    async def test_call_reply_media_group(self, mocker: MockerFixture, bot, mocked_session, tg_update_factory,
+                                          tg_user_factory, tg_message_factory, tg_message_origin_factory,
+                                          db_user_factory, db_topic_factory):  # yapf: disable
+        # given
+        reply_to_message = tg_message_factory(
+            from_user=tg_user_factory(id=self.BOT_ID),
+            forward_origin=tg_message_origin_factory()
+        )
+        first_message = tg_message_factory(bot=bot, media_group_id='album', reply_to_message=reply_to_message)
+        second_message = tg_message_factory(
+            bot=bot, message_id=first_message.id + 1, media_group_id='album', reply_to_message=reply_to_message,
+            chat=first_message.chat, message_thread_id=first_message.message_thread_id,
+        )
+
+        db_user = db_user_factory()
+        db_topic = db_topic_factory(id=first_message.message_thread_id, user=db_user)
+
+        mocker.patch('feedbackbot.settings.BOT_ID', self.BOT_ID)
+        mocker.spy(bot, 'copy_messages')
+        mocker.spy(bot, 'copy_message')
+
+        # when
+        await self.under_test(tg_update_factory(message=first_message), {})
+        await self.under_test(tg_update_factory(message=second_message), {})
+        await self.under_test._media_group_collector.flush_all()
+        await self.outbox.dispatch_due()
+
+        # then
+        # альбом скопирован пользователю одним запросом
+        bot.copy_message.assert_not_called()
+        bot.copy_messages.assert_called_once_with(
+            chat_id=db_user.id,
+            from_chat_id=first_message.chat_id,
+            message_ids=[first_message.id, second_message.id],
+        )
+        # записаны оба ответа
+        actual_replies = mocked_session.query(Reply).filter_by(topic_id=db_topic.id).all()
+        assert {actual_reply.bot_message_id for actual_reply in actual_replies} == {
+            message_id.message_id for message_id in bot.copied_message_ids
+        }
+
+    @pytest.mark.asyncio
+    async def test_call_reply_unknown_content_type(self, mocker: MockerFixture, bot, mocked_session, tg_update_factory,
                                                    tg_user_factory, tg_message_factory, tg_message_origin_factory,
                                                    tg_photo_attachment, db_user_factory, db_topic_factory):  # yapf: disable
         # given
@@ -114,17 +171,20 @@ class TestReplyMessageHandler:
 
         mocker.patch('feedbackbot.settings.BOT_ID', self.BOT_ID)
         reply_user_pm_spy = mocker.spy(self.under_test._service, 'reply_user_pm')
-        create_reply_spy = mocker.spy(self.under_test._service._reply_repo, 'create_reply')
+        mocker.patch.object(bot, 'copy_message', side_effect=BadRequest("Message can't be copied"))
 
         # when
         await self.under_test(tg_update, {})
+        await self.outbox.dispatch_due()
 
         # then
         reply_user_pm_spy.assert_called_once()
 
         assert bot.sent_messages[0].text == UNSUPPORTED_CONTENT
 
-        create_reply_spy.assert_not_called()
+        # ответ не записан, но и не повторяется
+        assert mocked_session.query(Reply).filter_by(topic_id=db_topic.id).count() == 0
+        assert mocked_session.query(OutboxEntry).one().delivered_at is not None
 
     @pytest.mark.asyncio
     async def test_call_reply_not_forwarded_by_bot(self, mocker: MockerFixture, tg_update_factory, tg_user_factory,
@@ -416,25 +476,30 @@ class TestDeleteHistoryCommandHandler:
 
         delete_history_spy = mocker.spy(self.under_test._topic_service, 'delete_history')
         # delete_reply_spy = mocker.spy(self.under_test._topic_service, 'delete_reply')
-        bot_delete_message_spy = mocker.spy(bot, 'delete_message')
+        bot_delete_messages_spy = mocker.spy(bot, 'delete_messages')
 
         # when
         await self.under_test(tg_update, {})
 
         # then
         # вызван нужный метод сервиса
-        delete_history_spy.assert_called_once_with(tg_update.message.message_thread_id)
+        delete_history_spy.assert_called_once_with(tg_update.message.message_thread_id, purge_group=False)
+
+        # бот выполнил удаление в чате с пользователем
+        actual_deleted_ids = set()
+        for (chat_id, message_ids), _ in bot_delete_messages_spy.call_args_list:
+            assert chat_id == db_topic.user.id
+            actual_deleted_ids.update(message_ids)
+        assert actual_deleted_ids == (
+            {db_message.id for db_message in db_messages} | {db_reply.bot_message_id for db_reply in db_replies}
+        )
 
         for db_message in db_messages:
-            # бот выполнил удаление в чате с пользователем
-            bot_delete_message_spy.assert_has_calls([call(db_topic.user.id, db_message.id)])
             # сообщения в базе удалены
             actual_db_message = mocked_session.query(Message).get(db_message.id)
             assert actual_db_message is None
 
         for db_reply in db_replies:
-            # бот выполнил удаление в чате с пользователем
-            bot_delete_message_spy.assert_has_calls([call(db_topic.user.id, db_reply.bot_message_id)])
             # сообщения в базе удалены
             actual_db_reply = mocked_session.query(Reply).get(db_reply.id)
             assert actual_db_reply is None
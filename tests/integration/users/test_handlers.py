@@ -3,14 +3,18 @@ import datetime
 import pytest
 from pytest_mock import MockerFixture
 from telegram import Update
+from telegram.error import BadRequest
 
+from feedbackbot import settings
 from feedbackbot.core.di import DIAsync
+from feedbackbot.outbox.services import OutboxDispatcher
 from feedbackbot.topics.models import Topic, Message
 from feedbackbot.users.handlers import (
     ForwardMessageHandler, BanCommandHandler, UnbanCommandHandler,
     UserLogCommandHandler
 )
 from feedbackbot.users.models import User, UserLog
+from feedbackbot.users.repos import get_banned_user_ids
 
 
 class TestForwardMessageHandler:
@@ -21,6 +25,10 @@ class TestForwardMessageHandler:
             session=session_wrapper,
             bot=bot,
         ).forward_message_handler
+        self.outbox: OutboxDispatcher = DIAsync(
+            session=session_wrapper,
+            bot=bot,
+        ).outbox_dispatcher
 
     @pytest.mark.asyncio
     async def test_call_happy_path_new_topic(self, mocker: MockerFixture, bot, mocked_session, tg_update_factory):
@@ -35,6 +43,7 @@ class TestForwardMessageHandler:
 
         # when
         await self.under_test(tg_update, {})
+        await self.outbox.dispatch_due()
 
         # then
         # пользователь создан
@@ -49,6 +58,8 @@ class TestForwardMessageHandler:
         actual_topic = actual_topics[0]
         assert actual_topic is not None
         assert actual_topic.user_id == expected_user_id
+        # и стал активным топиком пользователя
+        assert actual_user.active_topic_id == actual_topic.id
 
         # начальные логи созданы: полное имя и username
         actual_logs = mocked_session.query(UserLog).filter_by(user_id=actual_user.id).all()
@@ -57,6 +68,9 @@ class TestForwardMessageHandler:
         assert actual_logs[0].value == expected_user_full_name
         assert actual_logs[1].field == 'username'
         assert actual_logs[1].value == expected_user_username
+        # текущее состояние пользователя совпадает с последними записями лога
+        assert actual_user.full_name == expected_user_full_name
+        assert actual_user.username == expected_user_username
 
         # начальная информация отправлена в чат
         # call('-1002173328097', message_thread_id=1, text='Пользователь 2181914066:\n\n*Первичная информация*\n
@@ -76,12 +90,14 @@ class TestForwardMessageHandler:
         tg_update: Update = tg_update_factory()
         db_user = db_user_factory(id=tg_update.message.from_user.id)
         db_topic = db_topic_factory(id=tg_update.message.message_thread_id, user=db_user)
+        db_user.active_topic_id = db_topic.id
 
         mocker.spy(bot, 'send_message')
         mocker.spy(bot, 'pin_chat_message')
 
         # when
         await self.under_test(tg_update, {})
+        await self.outbox.dispatch_due()
 
         # then
         # пользователь уже существует, новый не создан
@@ -102,6 +118,84 @@ class TestForwardMessageHandler:
         actual_messages = mocked_session.query(Message).filter_by(topic_id=actual_topics[0].id).all()
         assert len(actual_messages) == 1
 
+    @pytest.mark.asyncio
+    async def test_call_existing_topic_deleted(self, mocker: MockerFixture, bot, mocked_session, tg_update_factory,
+                                               db_user_factory, db_topic_factory):  # yapf: disable
+        # given
+        tg_update: Update = tg_update_factory(message__bot=bot)
+        db_user = db_user_factory(id=tg_update.message.from_user.id)
+        db_topic = db_topic_factory(id=tg_update.message.message_thread_id, user=db_user)
+        db_user.active_topic_id = db_topic.id
+
+        # топик удален в Телеграм: первая пересылка не проходит
+        forward_message = bot.forward_message
+        forward_errors = [BadRequest('Message thread not found')]
+
+        async def forward_to_deleted_topic(*args, **kwargs):
+            if forward_errors:
+                raise forward_errors.pop()
+            return await forward_message(*args, **kwargs)
+
+        mocker.patch.object(bot, 'forward_message', side_effect=forward_to_deleted_topic)
+        mocker.spy(bot, 'create_forum_topic')
+        mocker.spy(bot, 'pin_chat_message')
+
+        # when
+        await self.under_test(tg_update, {})
+        await self.outbox.dispatch_due()
+
+        # then
+        # создан новый топик, он стал активным, карточка пользователя закреплена
+        bot.create_forum_topic.assert_called_once()
+        bot.pin_chat_message.assert_called_once()
+        actual_user = mocked_session.query(User).filter_by(id=db_user.id).first()
+        assert actual_user.active_topic_id != db_topic.id
+
+        # сообщение переслано в новый топик
+        actual_messages = mocked_session.query(Message).filter_by(topic_id=actual_user.active_topic_id).all()
+        assert len(actual_messages) == 1
+
+    @pytest.mark.asyncio
+    async def test_call_media_group(self, mocker: MockerFixture, bot, mocked_session, tg_update_factory,
+                                    tg_message_factory, db_user_factory, db_topic_factory):  # yapf: disable
+        # given
+        first_message = tg_message_factory(bot=bot, media_group_id='album')
+        tg_updates = [
+            tg_update_factory(message=first_message),
+            tg_update_factory(message=tg_message_factory(
+                bot=bot, message_id=first_message.id + 1, media_group_id='album', chat=first_message.chat,
+                from_user=first_message.from_user,
+            )),
+        ]
+        db_user = db_user_factory(id=first_message.from_user.id)
+        db_topic = db_topic_factory(id=first_message.message_thread_id, user=db_user)
+        db_user.active_topic_id = db_topic.id
+
+        mocker.spy(bot, 'forward_messages')
+        mocker.spy(bot, 'forward_message')
+        mocker.spy(self.under_test._user_service, 'get_or_create_user')
+
+        # when
+        for tg_update in tg_updates:
+            await self.under_test(tg_update, {})
+        await self.under_test._media_group_collector.flush_all()
+        await self.outbox.dispatch_due()
+
+        # then
+        # альбом переслан одним запросом, пользователь проверен один раз
+        bot.forward_message.assert_not_called()
+        bot.forward_messages.assert_called_once_with(
+            chat_id=settings.CHAT_ID,
+            from_chat_id=first_message.chat_id,
+            message_ids=[first_message.id, first_message.id + 1],
+            message_thread_id=db_topic.id,
+        )
+        self.under_test._user_service.get_or_create_user.assert_called_once()
+
+        # записаны оба сообщения
+        actual_messages = mocked_session.query(Message).filter_by(topic_id=db_topic.id).all()
+        assert {actual_message.id for actual_message in actual_messages} == {first_message.id, first_message.id + 1}
+
     @pytest.mark.asyncio
     async def test_call_user_is_banned(self, mocker: MockerFixture, tg_update_factory, db_user_factory,
                                        db_topic_factory):  # yapf: disable
@@ -122,6 +216,23 @@ class TestForwardMessageHandler:
         self.under_test._user_service.log_user_changes.assert_not_called()
         self.under_test._topic_service.forward_user_pm.assert_not_called()
 
+    @pytest.mark.asyncio
+    async def test_call_user_is_banned_in_memory(self, mocker: MockerFixture, tg_update_factory):
+        # given
+        tg_update: Update = tg_update_factory()
+        get_banned_user_ids().add(tg_update.message.from_user.id)
+
+        mocker.spy(self.under_test._user_service, 'get_or_create_user')
+        mocker.spy(self.under_test._topic_service, 'forward_user_pm')
+
+        # when
+        await self.under_test(tg_update, {})
+
+        # then
+        # до БД дело не доходит
+        self.under_test._user_service.get_or_create_user.assert_not_called()
+        self.under_test._topic_service.forward_user_pm.assert_not_called()
+
 
 class TestBanCommandHandler:
 
@@ -146,6 +257,7 @@ class TestBanCommandHandler:
 
         # then
         assert actual_db_user.is_banned
+        assert db_user.id in get_banned_user_ids()
 
 
 class TestUnbanCommandHandler:
@@ -164,6 +276,7 @@ class TestUnbanCommandHandler:
         tg_update: Update = tg_update_factory()
         db_user = db_user_factory(id=tg_update.message.from_user.id, is_banned=True)
         db_topic = db_topic_factory(id=tg_update.message.message_thread_id, user=db_user)
+        get_banned_user_ids().add(db_user.id)
 
         # when
         await self.under_test(tg_update, {})
@@ -171,6 +284,7 @@ class TestUnbanCommandHandler:
 
         # then
         assert not actual_db_user.is_banned
+        assert db_user.id not in get_banned_user_ids()
 
 
 class TestUserLogCommandHandler:
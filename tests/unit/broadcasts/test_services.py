@@ -0,0 +1,212 @@
+import pytest
+from pytest_mock import MockerFixture
+from telegram import MessageId
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+from feedbackbot.broadcasts.constants import (
+    BROADCAST_ALREADY_RUNNING, BROADCAST_DONE, BROADCAST_ABORTED, BROADCAST_FAILED,
+)
+from feedbackbot.broadcasts.models import Broadcast
+from feedbackbot.broadcasts.services import BroadcastService
+from feedbackbot.core.di import DIAsync
+
+
+class TestBroadcastService:
+    CHAT_ID = -1
+
+    @pytest.fixture(autouse=True)
+    def setup_method(self, session_wrapper, bot):
+        self.under_test: BroadcastService = DIAsync(
+            session=session_wrapper,
+            bot=bot,
+        ).broadcast_service
+
+    async def create_broadcast(self, mocked_session, **kwargs) -> Broadcast:
+        db_broadcast = Broadcast(from_chat_id=self.CHAT_ID, message_id=10, progress_message_id=20, total=2, **kwargs)
+        mocked_session.add(db_broadcast)
+        mocked_session.flush()
+
+        return db_broadcast
+
+    @pytest.mark.asyncio
+    async def test_create_broadcast(self, bot, mocked_session, tg_message_factory):
+        # given
+        tg_message = tg_message_factory()
+
+        # when
+        actual = await self.under_test.create_broadcast(tg_message, tg_message.message_thread_id)
+
+        # then
+        db_broadcast = mocked_session.get(Broadcast, actual)
+        assert db_broadcast.message_id == tg_message.message_id
+        # забаненный пользователь не учитывается
+        assert db_broadcast.total == 2
+        assert db_broadcast.progress_message_id == bot.sent_messages[0].message_id
+
+    @pytest.mark.asyncio
+    async def test_create_broadcast_already_running(self, bot, mocked_session, tg_message_factory):
+        # given
+        await self.create_broadcast(mocked_session)
+        tg_message = tg_message_factory()
+
+        # when
+        actual = await self.under_test.create_broadcast(tg_message, tg_message.message_thread_id)
+
+        # then
+        assert actual is None
+        assert bot.sent_messages[0].text == BROADCAST_ALREADY_RUNNING
+        assert mocked_session.query(Broadcast).count() == 1
+
+    @pytest.mark.asyncio
+    async def test_run_broadcast(self, mocker: MockerFixture, bot, mocked_session):
+        # given
+        db_broadcast = await self.create_broadcast(mocked_session)
+        mocker.spy(bot, 'copy_message')
+        mocker.spy(bot, 'edit_message_text')
+
+        # when
+        await self.under_test.run_broadcast(db_broadcast.id)
+
+        # then
+        # забаненному пользователю сообщение не отправляется
+        assert sorted(c.kwargs['chat_id'] for c in bot.copy_message.call_args_list) == [1, 2]
+        bot.copy_message.assert_called_with(chat_id=mocker.ANY, from_chat_id=self.CHAT_ID, message_id=10)
+
+        mocked_session.refresh(db_broadcast)
+        assert db_broadcast.sent == 2
+        assert db_broadcast.last_user_id == 2
+        assert db_broadcast.finished_at is not None
+        assert bot.edit_message_text.call_args.kwargs['text'] == BROADCAST_DONE.format(
+            sent=2, total=2, blocked=0, failed=0
+        )
+
+    @pytest.mark.asyncio
+    async def test_run_broadcast_resume(self, mocker: MockerFixture, bot, mocked_session):
+        # given
+        # рассылка прервана после первого пользователя
+        db_broadcast = await self.create_broadcast(mocked_session, last_user_id=1, sent=1)
+        mocker.spy(bot, 'copy_message')
+
+        # when
+        await self.under_test.resume_broadcasts()
+
+        # then
+        bot.copy_message.assert_called_once_with(chat_id=2, from_chat_id=self.CHAT_ID, message_id=10)
+        mocked_session.refresh(db_broadcast)
+        assert db_broadcast.sent == 2
+        assert db_broadcast.finished_at is not None
+
+    @pytest.mark.asyncio
+    async def test_run_broadcast_blocked(self, mocker: MockerFixture, bot, mocked_session):
+        # given
+        db_broadcast = await self.create_broadcast(mocked_session)
+        copy_message = bot.copy_message
+
+        async def copy_message_blocked(*args, chat_id, **kwargs):
+            if chat_id == 1:
+                raise Forbidden('Forbidden: bot was blocked by the user')
+            return await copy_message(*args, chat_id=chat_id, **kwargs)
+
+        mocker.patch.object(bot, 'copy_message', side_effect=copy_message_blocked)
+
+        # when
+        await self.under_test.run_broadcast(db_broadcast.id)
+
+        # then
+        mocked_session.refresh(db_broadcast)
+        assert (db_broadcast.sent, db_broadcast.blocked, db_broadcast.failed) == (1, 1, 0)
+
+    @pytest.mark.asyncio
+    async def test_run_broadcast_retry_after(self, mocker: MockerFixture, bot, mocked_session):
+        # given
+        db_broadcast = await self.create_broadcast(mocked_session)
+        mocker.patch.object(bot, 'copy_message', side_effect=[RetryAfter(0), MessageId(1), MessageId(2)])
+
+        # when
+        await self.under_test.run_broadcast(db_broadcast.id)
+
+        # then
+        # после RetryAfter сообщение отправляется повторно
+        assert bot.copy_message.call_count == 3
+        mocked_session.refresh(db_broadcast)
+        assert (db_broadcast.sent, db_broadcast.failed) == (2, 0)
+
+    @pytest.mark.asyncio
+    async def test_run_broadcast_source_deleted(self, mocker: MockerFixture, bot, mocked_session, db_user_factory):
+        # given
+        for _ in range(8):
+            db_user_factory()
+        db_broadcast = await self.create_broadcast(mocked_session)
+        mocker.patch('feedbackbot.settings.BROADCAST_CONCURRENCY', 1)
+        mocker.patch.object(bot, 'copy_message', side_effect=BadRequest('Message to copy not found'))
+        mocker.spy(bot, 'edit_message_text')
+
+        # when
+        await self.under_test.run_broadcast(db_broadcast.id)
+
+        # then
+        # рассылка остановлена после первой же ошибки
+        bot.copy_message.assert_called_once()
+        mocked_session.refresh(db_broadcast)
+        assert db_broadcast.finished_at is not None
+        assert bot.edit_message_text.call_args.kwargs['text'] == BROADCAST_ABORTED.format(
+            sent=0, total=2, blocked=0, failed=0
+        )
+
+    @pytest.mark.asyncio
+    async def test_run_broadcast_bad_request(self, mocker: MockerFixture, bot, mocked_session):
+        # given
+        db_broadcast = await self.create_broadcast(mocked_session)
+        copy_message = bot.copy_message
+
+        async def copy_message_bad_request(*args, chat_id, **kwargs):
+            if chat_id == 1:
+                raise BadRequest('Chat not found')
+            return await copy_message(*args, chat_id=chat_id, **kwargs)
+
+        mocker.patch.object(bot, 'copy_message', side_effect=copy_message_bad_request)
+
+        # when
+        await self.under_test.run_broadcast(db_broadcast.id)
+
+        # then
+        # ошибка отправки одному пользователю не останавливает рассылку
+        mocked_session.refresh(db_broadcast)
+        assert (db_broadcast.sent, db_broadcast.blocked, db_broadcast.failed) == (1, 0, 1)
+
+    @pytest.mark.asyncio
+    async def test_run_broadcast_failed(self, mocker: MockerFixture, bot, mocked_session, tg_message_factory):
+        # given
+        db_broadcast = await self.create_broadcast(mocked_session)
+        mocker.patch.object(bot, 'copy_message', side_effect=RuntimeError)
+        mocker.spy(bot, 'edit_message_text')
+
+        # when
+        await self.under_test.run_broadcast(db_broadcast.id)
+
+        # then
+        mocked_session.refresh(db_broadcast)
+        assert db_broadcast.finished_at is not None
+        assert bot.edit_message_text.call_args.kwargs['text'] == BROADCAST_FAILED.format(
+            sent=0, total=2, blocked=0, failed=0
+        )
+        # прерванная рассылка не блокирует новую
+        tg_message = tg_message_factory()
+        assert await self.under_test.create_broadcast(tg_message, tg_message.message_thread_id) is not None
+
+    @pytest.mark.asyncio
+    async def test_run_broadcast_progress_edit_failed(self, mocker: MockerFixture, bot, mocked_session):
+        # given
+        db_broadcast = await self.create_broadcast(mocked_session)
+        mocker.patch('feedbackbot.settings.BROADCAST_PROGRESS_INTERVAL', 0)
+        mocker.patch.object(bot, 'edit_message_text', side_effect=[RetryAfter(5), NetworkError('Bad Gateway')])
+
+        # when
+        await self.under_test.run_broadcast(db_broadcast.id)
+
+        # then
+        # ошибка сообщения о ходе рассылки не прерывает ее
+        assert bot.edit_message_text.call_count == 2
+        mocked_session.refresh(db_broadcast)
+        assert (db_broadcast.sent, db_broadcast.failed) == (2, 0)
+        assert db_broadcast.finished_at is not None
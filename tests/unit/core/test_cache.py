@@ -0,0 +1,117 @@
+import pytest
+
+from feedbackbot.core.cache import TTLCache, MappingIndex
+
+
+class TestTTLCache:
+
+    @pytest.fixture(autouse=True)
+    def setup_method(self):
+        self.now = 0.0
+        self.under_test: TTLCache = TTLCache(maxsize=2, ttl=10, clock=lambda: self.now)
+
+    def test_get(self):
+        # given
+        self.under_test.set(1, 'a')
+
+        # when/then
+        assert self.under_test.get(1) == 'a'
+        assert self.under_test.get(2) is None
+        assert self.under_test.stats()['hits'] == 1
+        assert self.under_test.stats()['misses'] == 1
+
+    def test_ttl(self):
+        # given
+        self.under_test.set(1, 'a')
+
+        # when
+        self.now = 10
+
+        # then
+        assert self.under_test.get(1) is None
+        assert len(self.under_test) == 0
+
+    def test_lru_eviction(self):
+        # given
+        self.under_test.set(1, 'a')
+        self.under_test.set(2, 'b')
+        # 1 использован позже, чем 2
+        self.under_test.get(1)
+
+        # when
+        self.under_test.set(3, 'c')
+
+        # then
+        assert self.under_test.get(2) is None
+        assert self.under_test.get(1) == 'a'
+        assert self.under_test.get(3) == 'c'
+        assert self.under_test.stats()['evictions'] == 1
+
+    def test_invalidate(self):
+        # given
+        self.under_test.set(1, 'a')
+
+        # when
+        self.under_test.invalidate(1)
+
+        # then
+        assert self.under_test.get(1) is None
+
+
+class TestMappingIndex:
+
+    @pytest.fixture(autouse=True)
+    def setup_method(self):
+        self.now = 0.0
+        self.under_test: MappingIndex = MappingIndex(maxsize=2, max_age=10, clock=lambda: self.now)
+
+    def test_get_both_directions(self):
+        # given
+        self.under_test.add(1, 101, 'a')
+
+        # when/then
+        assert self.under_test.get(1) == 'a'
+        assert self.under_test.get_by_reverse(101) == 'a'
+        assert self.under_test.get_by_reverse(1) is None
+        assert self.under_test.stats()['hits'] == 2
+        assert self.under_test.stats()['misses'] == 1
+
+    def test_age_eviction(self):
+        # given
+        self.under_test.add(1, 101, 'a')
+        self.now = 5
+        self.under_test.add(2, 102, 'b')
+
+        # when
+        self.now = 10
+
+        # then
+        assert self.under_test.get_by_reverse(101) is None
+        assert self.under_test.get(2) == 'b'
+        assert self.under_test.stats()['evictions'] == 1
+
+    def test_size_eviction(self):
+        # given
+        self.under_test.add(1, 101, 'a')
+        self.under_test.add(2, 102, 'b')
+        # чтение не продлевает жизнь записи
+        self.under_test.get(1)
+
+        # when
+        self.under_test.add(3, 103, 'c')
+
+        # then
+        assert self.under_test.get(1) is None
+        assert self.under_test.get_by_reverse(101) is None
+        assert len(self.under_test) == 2
+
+    def test_remove(self):
+        # given
+        self.under_test.add(1, 101, 'a')
+
+        # when
+        self.under_test.remove(1)
+
+        # then
+        assert self.under_test.get(1) is None
+        assert self.under_test.get_by_reverse(101) is None
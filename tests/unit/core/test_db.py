@@ -1,6 +1,12 @@
+import contextvars
+
 import pytest
+from sqlalchemy import create_engine, event, select, update, text
 
-from feedbackbot.core.db import BaseAsyncDBRepo
+from feedbackbot.core.db import (
+    BaseAsyncDBRepo, UnitOfWork, FilterShape, RoutingSession, pin_primary, get_engine, get_replica_engines
+)
+from feedbackbot.core.metrics import metrics
 from feedbackbot.core.di import DIAsync
 from feedbackbot.users.models import User
 
@@ -13,6 +19,9 @@ class TestBaseAsyncDBRepo:
 
         class TestRepo(BaseAsyncDBRepo[User]):
             model_class = User
+            hot_filters = (
+                FilterShape(('is_banned',)),
+            )
 
         self.under_test: TestRepo = DIAsync(
             session=session_wrapper,
@@ -49,6 +58,33 @@ class TestBaseAsyncDBRepo:
         assert actual[0].id == 2
         assert actual[1].id == 1
 
+    @pytest.mark.asyncio
+    async def test_iterate_batches(self, mocked_session):
+        # given
+        await self.under_test.bulk_create([{'id': self.new_obj_id + i} for i in range(4)])
+
+        # when
+        actual = [
+            [user.id for user in batch]
+            async for batch in self.under_test.iterate_batches(User.id > 1, batch_size=2, ordering=('id', 'desc'))
+        ]
+
+        # then
+        assert actual == [
+            [self.new_obj_id + 3, self.new_obj_id + 2],
+            [self.new_obj_id + 1, self.new_obj_id],
+            [3, 2],
+        ]
+
+    @pytest.mark.asyncio
+    async def test_iterate_by_field(self):
+        # given/when
+        actual = [user.id async for user in self.under_test.iterate(batch_size=1, ordering=('is_banned', 'asc'))]
+
+        # then
+        # сортировка по полю, при совпадении – по первичному ключу
+        assert actual == [1, 2, 3]
+
     @pytest.mark.asyncio
     async def test_update(self):
         actual = await self.under_test.update(User.id == 1, is_banned=True)
@@ -56,6 +92,68 @@ class TestBaseAsyncDBRepo:
         assert actual.id == 1
         assert actual.is_banned == True
 
+    @pytest.mark.asyncio
+    async def test_upsert_new(self, mocked_session):
+        # given/when
+        actual = await self.under_test.upsert(id=self.new_obj_id, is_banned=True)
+
+        # then
+        assert actual.id == self.new_obj_id
+        assert actual.is_banned == True
+        assert mocked_session.query(User).filter_by(id=self.new_obj_id).first() is not None
+
+    @pytest.mark.asyncio
+    async def test_upsert_existing(self):
+        # given/when
+        actual = await self.under_test.upsert(id=3, is_banned=False)
+
+        # then
+        assert actual.id == 3
+        assert actual.is_banned == False
+
+    @pytest.mark.asyncio
+    async def test_get_or_create_new(self, mocked_session):
+        # given/when
+        actual = await self.under_test.get_or_create(id=self.new_obj_id)
+
+        # then
+        assert actual.id == self.new_obj_id
+        assert mocked_session.query(User).filter_by(id=self.new_obj_id).first() is not None
+
+    @pytest.mark.asyncio
+    async def test_get_or_create_existing(self, mocked_session):
+        # given/when
+        actual = await self.under_test.get_or_create(id=3, is_banned=False)
+
+        # then
+        # существующая запись не изменяется
+        assert actual.id == 3
+        assert actual.is_banned == True
+        assert mocked_session.query(User).count() == 3
+
+    @pytest.mark.asyncio
+    async def test_get_or_create_existing_not_rewritten(self, mocked_session):
+        # given
+        statements = []
+        engine = mocked_session.get_bind()
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(engine, 'before_cursor_execute', record)
+
+        # when
+        try:
+            actual = await self.under_test.get_or_create(id=1)
+        finally:
+            event.remove(engine, 'before_cursor_execute', record)
+
+        # then
+        # конфликт не обновляет строку: вставка без DO UPDATE и чтение существующей записи
+        assert actual.id == 1
+        assert not any('DO UPDATE' in statement for statement in statements)
+        assert any('DO NOTHING' in statement for statement in statements)
+
     @pytest.mark.asyncio
     async def test_delete(self, mocked_session):
         # given
@@ -68,6 +166,43 @@ class TestBaseAsyncDBRepo:
         db_user = mocked_session.query(User).filter_by(id=self.new_obj_id).first()
         assert db_user is None  # User should be deleted
 
+    @pytest.mark.asyncio
+    async def test_bulk_create(self, mocked_session):
+        # given/when
+        await self.under_test.bulk_create([{'id': self.new_obj_id}, {'id': self.new_obj_id + 1}])
+
+        # then
+        assert mocked_session.query(User).count() == 5
+
+    @pytest.mark.asyncio
+    async def test_bulk_update(self, mocked_session):
+        # given/when
+        await self.under_test.bulk_update([{'id': 1, 'is_banned': True}, {'id': 3, 'is_banned': False}])
+
+        # then
+        assert mocked_session.get(User, 1).is_banned == True
+        assert mocked_session.get(User, 3).is_banned == False
+
+    @pytest.mark.asyncio
+    async def test_bulk_delete(self, mocked_session):
+        # given/when
+        actual = await self.under_test.bulk_delete([1, 2])
+
+        # then
+        assert actual == 2
+        assert [u.id for u in mocked_session.query(User).all()] == [3]
+
+    @pytest.mark.asyncio
+    async def test_purge(self, mocked_session):
+        # given/when
+        # порция меньше числа записей: удаление выполняется в несколько запросов
+        actual = await self.under_test.purge(User.is_banned == False, batch_size=1)
+
+        # then
+        assert actual == 2
+        mocked_session.expire_all()
+        assert [u.id for u in mocked_session.query(User).all()] == [3]
+
     @pytest.mark.asyncio
     async def test_filter(self, mocked_session):
         # given/when
@@ -78,3 +213,141 @@ class TestBaseAsyncDBRepo:
         assert len(actual) == 2
         assert actual[0].id == 1
         assert actual[1].id == 2
+
+    @pytest.mark.asyncio
+    async def test_unit_of_work_shares_session(self, session_wrapper):
+        # given
+        unit_of_work = UnitOfWork(session_wrapper)
+
+        # when
+        async with unit_of_work():
+            await self.under_test.create(id=self.new_obj_id)
+            await self.under_test.update(User.id == self.new_obj_id, is_banned=True)
+            actual = await self.under_test.get(id=self.new_obj_id)
+
+        # then
+        # все вызовы репозитория использовали одну сессию
+        session_wrapper.assert_called_once()
+        assert actual.is_banned == True
+
+    @pytest.mark.asyncio
+    async def test_unit_of_work_nested(self, session_wrapper):
+        # given
+        unit_of_work = UnitOfWork(session_wrapper)
+
+        # when
+        async with unit_of_work() as outer:
+            async with unit_of_work() as inner:
+                pass
+
+        # then
+        assert outer is inner
+        session_wrapper.assert_called_once()
+
+    def test_filter_statement_registry(self):
+        # given
+        hot_shape = FilterShape(('is_banned',))
+
+        # when
+        actual = self.under_test._filter_statement(FilterShape(('id', 'is_banned'), ('id', 'desc')))
+
+        # then
+        # горячие запросы построены при объявлении репозитория
+        assert hot_shape in self.under_test._statements
+        # выражение строится один раз и не зависит от порядка полей
+        assert actual is self.under_test._filter_statement(FilterShape(('is_banned', 'id'), ('id', 'desc')))
+
+
+class TestRoutingSession:
+
+    @pytest.fixture(autouse=True)
+    def setup_method(self):
+        self.primary = create_engine('sqlite://')
+        self.replica = create_engine('sqlite://')
+        self.under_test = RoutingSession(bind=self.primary, replicas=[self.replica])
+
+    def test_read_goes_to_replica(self):
+        assert self.under_test.get_bind(clause=select(User)) is self.replica
+
+    def test_write_goes_to_primary(self):
+        assert self.under_test.get_bind(clause=update(User).values(is_banned=True)) is self.primary
+
+    def test_read_after_write_goes_to_primary(self):
+        def read_after_write():
+            pin_primary()
+            return self.under_test.get_bind(clause=select(User))
+
+        # запись закрепляет основную БД только в своем контексте (задаче)
+        assert contextvars.copy_context().run(read_after_write) is self.primary
+        assert self.under_test.get_bind(clause=select(User)) is self.replica
+
+    @pytest.mark.asyncio
+    async def test_pin_scoped_to_unit_of_work(self, session_wrapper):
+        # given
+        unit_of_work = UnitOfWork(session_wrapper)
+
+        # when/then
+        async with unit_of_work():
+            pin_primary()
+            assert self.under_test.get_bind(clause=select(User)) is self.primary
+
+        # следующая единица работы в той же задаче снова читает с реплики
+        async with unit_of_work():
+            assert self.under_test.get_bind(clause=select(User)) is self.replica
+
+    @pytest.mark.asyncio
+    async def test_pin_scoped_to_write_outside_unit_of_work(self, session_wrapper):
+        # given
+        repo = DIAsync(session=session_wrapper).user_repo
+
+        # when
+        await repo.create_user(999999)
+
+        # then
+        # запись вне единицы работы не закрепляет основную БД за задачей
+        assert self.under_test.get_bind(clause=select(User)) is self.replica
+
+
+class TestSqliteEngine:
+
+    @pytest.mark.asyncio
+    async def test_pragmas(self, tmp_path):
+        # given
+        db_path = tmp_path / 'data' / 'bot.sqlite3'
+        engine = get_engine(f'sqlite+aiosqlite:///{db_path}')
+
+        # when
+        async with engine.connect() as con:
+            actual_journal_mode = (await con.execute(text('PRAGMA journal_mode'))).scalar()
+            actual_foreign_keys = (await con.execute(text('PRAGMA foreign_keys'))).scalar()
+        await engine.dispose()
+
+        # then
+        # каталог для файла БД создан
+        assert db_path.exists()
+        assert actual_journal_mode == 'wal'
+        assert actual_foreign_keys == 1
+
+
+class TestReplicaEngines:
+
+    @pytest.mark.asyncio
+    async def test_pool_metrics_per_replica(self, mocker, tmp_path):
+        # given
+        # у реплик один хост (для SQLite – пустой)
+        mocker.patch('feedbackbot.settings.DB_REPLICA_URIS', [
+            f'sqlite+aiosqlite:///{tmp_path / "replica1.sqlite3"}',
+            f'sqlite+aiosqlite:///{tmp_path / "replica2.sqlite3"}',
+        ])
+
+        # when
+        replica_engines = get_replica_engines()
+        async with replica_engines[1].connect():
+            actual = metrics.collect()
+        for replica_engine in replica_engines:
+            await replica_engine.dispose()
+
+        # then
+        # метрики одной реплики не перезаписывают метрики другой
+        assert actual['db.pool.replica.0']['checked_out'] == 0
+        assert actual['db.pool.replica.1']['checked_out'] == 1
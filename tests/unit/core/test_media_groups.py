@@ -0,0 +1,132 @@
+import asyncio
+from contextvars import ContextVar
+
+import pytest
+
+from feedbackbot.core.media_groups import MediaGroupCollector
+
+_update_var: ContextVar[str | None] = ContextVar('update_var', default=None)
+
+
+class TestMediaGroupCollector:
+
+    @pytest.fixture(autouse=True)
+    def setup_method(self):
+        self.under_test: MediaGroupCollector = MediaGroupCollector(window=0.01, max_size=3)
+        self.flushed = []
+
+    async def flush(self, messages):
+        self.flushed.append([message.id for message in messages])
+
+    @pytest.mark.asyncio
+    async def test_group_collected(self, tg_message_factory):
+        # given
+        messages = [tg_message_factory(message_id=i, media_group_id='a') for i in (2, 1)]
+
+        # when
+        for message in messages:
+            self.under_test.add(message, self.flush)
+        await asyncio.sleep(0.05)
+
+        # then
+        # альбом передан один раз, сообщения по возрастанию ID
+        assert self.flushed == [[1, 2]]
+        assert self.under_test.stats()['pending'] == 0
+        assert self.under_test.stats()['messages_flushed'] == 2
+
+    @pytest.mark.asyncio
+    async def test_full_group_flushed_immediately(self, tg_message_factory):
+        # given
+        self.under_test = MediaGroupCollector(window=10, max_size=2)
+
+        # when
+        for i in (1, 2):
+            self.under_test.add(tg_message_factory(message_id=i, media_group_id='a'), self.flush)
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+
+        # then
+        assert self.flushed == [[1, 2]]
+
+    @pytest.mark.asyncio
+    async def test_flush_preceding(self, tg_message_factory):
+        # given
+        self.under_test = MediaGroupCollector(window=10)
+        album_message = tg_message_factory(message_id=1, media_group_id='a')
+        other_chat_message = tg_message_factory(message_id=2, media_group_id='b')
+        self.under_test.add(album_message, self.flush)
+        self.under_test.add(other_chat_message, self.flush)
+
+        # when
+        await self.under_test.flush_preceding(
+            tg_message_factory(chat=album_message.chat, message_thread_id=album_message.message_thread_id)
+        )
+
+        # then
+        # альбом из другого чата продолжает собираться
+        assert self.flushed == [[1]]
+        assert self.under_test.stats()['pending'] == 1
+
+        await self.under_test.flush_all()
+        assert self.flushed == [[1], [2]]
+
+    @pytest.mark.asyncio
+    async def test_groups_of_one_chat_flushed_in_order(self, tg_message_factory):
+        # given
+        release = asyncio.Event()
+        started = []
+
+        async def flush(messages):
+            started.append(messages[0].id)
+            if messages[0].id == 1:
+                await release.wait()
+
+        first = tg_message_factory(message_id=1, media_group_id='a')
+        second = tg_message_factory(
+            message_id=2, media_group_id='b', chat=first.chat, message_thread_id=first.message_thread_id
+        )
+
+        # when
+        self.under_test.add(first, flush)
+        self.under_test.add(second, flush)
+        await asyncio.sleep(0.05)
+
+        # then
+        # второй альбом ждет, пока не будет отправлен первый
+        assert started == [1]
+
+        release.set()
+        await self.under_test.flush_all()
+        assert started == [1, 2]
+        assert self.under_test._tails == {}
+
+    @pytest.mark.asyncio
+    async def test_flush_in_clean_context(self, tg_message_factory):
+        # given
+        actual = []
+
+        async def flush(messages):
+            actual.append(_update_var.get())
+
+        # when
+        _update_var.set('update')
+        self.under_test.add(tg_message_factory(media_group_id='a'), flush)
+        await self.under_test.flush_all()
+
+        # then
+        # контекст обновления, начавшего альбом, не наследуется
+        assert actual == [None]
+
+    @pytest.mark.asyncio
+    async def test_flush_error(self, tg_message_factory):
+        # given
+        async def flush(messages):
+            raise RuntimeError
+
+        # when
+        self.under_test.add(tg_message_factory(media_group_id='a'), flush)
+        await self.under_test.flush_all()
+
+        # then
+        assert self.under_test.stats()['errors'] == 1
+        assert self.under_test.stats()['pending'] == 0
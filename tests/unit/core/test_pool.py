@@ -0,0 +1,50 @@
+import sqlite3
+
+import pytest
+from sqlalchemy import QueuePool
+
+from feedbackbot.core.pool import InstrumentedPoolMixin, pool_stats
+
+
+class InstrumentedQueuePool(InstrumentedPoolMixin, QueuePool):
+    pass
+
+
+class TestInstrumentedPool:
+
+    @pytest.fixture(autouse=True)
+    def setup_method(self):
+        self.under_test = InstrumentedQueuePool(
+            lambda: sqlite3.connect(':memory:', check_same_thread=False),
+            pool_size=1,
+            max_overflow=1,
+        )
+        yield
+        self.under_test.dispose()
+
+    def test_checkout_stats(self):
+        # given/when
+        con = self.under_test.connect()
+        actual = pool_stats(self.under_test)
+
+        # then
+        assert actual['checked_out'] == 1
+        assert actual['checkouts'] == 1
+        assert actual['overflow_events'] == 0
+
+        con.close()
+        assert pool_stats(self.under_test)['checked_out'] == 0
+
+    def test_overflow_stats(self):
+        # given/when
+        con_1 = self.under_test.connect()
+        con_2 = self.under_test.connect()
+        actual = pool_stats(self.under_test)
+
+        # then
+        assert actual['checked_out'] == 2
+        assert actual['checkouts'] == 2
+        assert actual['overflow_events'] == 1
+
+        con_1.close()
+        con_2.close()
@@ -0,0 +1,166 @@
+import asyncio
+import inspect
+
+import pytest
+from aiolimiter import AsyncLimiter
+from telegram.ext import AIORateLimiter
+
+from feedbackbot.core.enums import Priority
+from feedbackbot.core.ratelimit import PriorityGate, PriorityRateLimiter, get_request_priority, request_priority
+
+
+class TestGetRequestPriority:
+
+    def test_user_forward(self):
+        assert get_request_priority('forwardMessage') == Priority.USER_FORWARD
+        assert get_request_priority('createForumTopic') == Priority.USER_FORWARD
+
+    def test_housekeeping(self):
+        # в том числе сообщения в личный чат: ответом оператора запрос помечает вызывающий код
+        assert get_request_priority('copyMessage') == Priority.HOUSEKEEPING
+        assert get_request_priority('sendMessage') == Priority.HOUSEKEEPING
+        assert get_request_priority('deleteMessages') == Priority.HOUSEKEEPING
+        assert get_request_priority('setMyCommands') == Priority.HOUSEKEEPING
+
+
+class TestPriorityGate:
+
+    @pytest.fixture(autouse=True)
+    def setup_method(self):
+        self.under_test: PriorityGate = PriorityGate()
+        self.admitted = []
+
+    async def request(self, priority, chat_id):
+        async with self.under_test(priority, chat_id):
+            self.admitted.append((priority, chat_id))
+
+    async def run_queued(self, *requests):
+        """
+        Ставит запросы в очередь, пока место занято, и отпускает их все разом.
+        """
+        release = asyncio.Event()
+
+        async def hold():
+            async with self.under_test(Priority.HOUSEKEEPING, 'holder'):
+                await release.wait()
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        tasks = [asyncio.create_task(self.request(*request)) for request in requests]
+        await asyncio.sleep(0)
+
+        release.set()
+        await asyncio.gather(holder, *tasks)
+
+    @pytest.mark.asyncio
+    async def test_higher_priority_first(self):
+        # given/when
+        await self.run_queued(
+            (Priority.HOUSEKEEPING, 'group'),
+            (Priority.USER_FORWARD, 'group'),
+            (Priority.OPERATOR_REPLY, 1),
+        )
+
+        # then
+        assert self.admitted == [
+            (Priority.OPERATOR_REPLY, 1),
+            (Priority.USER_FORWARD, 'group'),
+            (Priority.HOUSEKEEPING, 'group'),
+        ]
+
+    @pytest.mark.asyncio
+    async def test_chats_take_turns(self):
+        # given/when
+        await self.run_queued(
+            (Priority.OPERATOR_REPLY, 1),
+            (Priority.OPERATOR_REPLY, 1),
+            (Priority.OPERATOR_REPLY, 1),
+            (Priority.OPERATOR_REPLY, 2),
+        )
+
+        # then
+        # поток запросов в чат 1 не задерживает чат 2
+        assert [chat_id for _, chat_id in self.admitted] == [1, 2, 1, 1]
+
+    @pytest.mark.asyncio
+    async def test_cancelled_waiter_removed(self):
+        # given
+        release = asyncio.Event()
+
+        async def hold():
+            async with self.under_test(Priority.HOUSEKEEPING, 'holder'):
+                await release.wait()
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(self.request(Priority.OPERATOR_REPLY, 1))
+        await asyncio.sleep(0)
+        assert self.under_test.queued(Priority.OPERATOR_REPLY) == 1
+
+        # when
+        waiter.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        await holder
+
+        # then
+        assert self.under_test.queued(Priority.OPERATOR_REPLY) == 0
+        await self.request(Priority.USER_FORWARD, 'group')
+        assert self.admitted == [(Priority.USER_FORWARD, 'group')]
+
+
+class TestPriorityRateLimiter:
+
+    @pytest.mark.asyncio
+    async def test_process_request_stats(self):
+        # given
+        under_test = PriorityRateLimiter()
+
+        async def callback(*args, **kwargs):
+            return True
+
+        # when
+        actual = await under_test.process_request(
+            callback, (), {}, endpoint='copyMessage', data={'chat_id': 123}, rate_limit_args=None,
+        )
+
+        # then
+        assert actual is True
+        # сообщение в личный чат без явного приоритета – служебное
+        assert under_test.stats(Priority.HOUSEKEEPING)['processed'] == 1
+        assert under_test.stats(Priority.OPERATOR_REPLY)['processed'] == 0
+
+    @pytest.mark.asyncio
+    async def test_process_request_priority_override(self):
+        # given
+        under_test = PriorityRateLimiter()
+
+        async def callback(*args, **kwargs):
+            return True
+
+        # when
+        # рассылка в личный чат не считается ответом оператора
+        with request_priority(Priority.BROADCAST):
+            await under_test.process_request(
+                callback, (), {}, endpoint='copyMessage', data={'chat_id': 123}, rate_limit_args=None,
+            )
+
+        # then
+        assert under_test.stats(Priority.BROADCAST)['processed'] == 1
+        assert under_test.stats(Priority.OPERATOR_REPLY)['processed'] == 0
+
+    def test_ptb_internals(self):
+        # PriorityRateLimiter переопределяет внутренние методы AIORateLimiter: при обновлении PTB тест покажет, что
+        # их сигнатуры изменились
+        assert list(inspect.signature(AIORateLimiter.process_request).parameters) == [
+            'self', 'callback', 'args', 'kwargs', 'endpoint', 'data', 'rate_limit_args',
+        ]
+        assert list(inspect.signature(AIORateLimiter._run_request).parameters) == [
+            'self', 'chat', 'group', 'callback', 'args', 'kwargs',
+        ]
+        assert list(inspect.signature(AIORateLimiter._get_group_limiter).parameters) == ['self', 'group_id']
+
+        under_test = AIORateLimiter()
+        assert isinstance(under_test._base_limiter, AsyncLimiter)
+        assert isinstance(under_test._retry_after_event, asyncio.Event)
+        assert under_test._group_max_rate > 0
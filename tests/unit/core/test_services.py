@@ -0,0 +1,122 @@
+import datetime
+from unittest.mock import AsyncMock
+
+import pytest
+import pytest_asyncio
+from pytest_mock import MockerFixture
+from sqlalchemy import insert
+
+from feedbackbot.core.cache import TTLCache, MappingIndex
+from feedbackbot.core.db import Base, DBRefs, get_engine, get_session_factory
+from feedbackbot.core.pool import pool_stats
+from feedbackbot.core.services import RetentionService, WarmupService
+from feedbackbot.topics.models import Topic
+from feedbackbot.topics.repos import TopicRepo, MessageRepo, ReplyRepo, TopicRef
+from feedbackbot.users.models import User
+from feedbackbot.users.repos import UserRepo, UserLogRepo, UserState
+
+
+class TestWarmupService:
+
+    @pytest_asyncio.fixture(autouse=True)
+    async def setup_method(self, tmp_path):
+        engine = get_engine(f'sqlite+aiosqlite:///{tmp_path / "bot.sqlite3"}')
+        replica_engine = get_engine(f'sqlite+aiosqlite:///{tmp_path / "replica.sqlite3"}')
+        # реплика совпадает с основной БД
+        for db_engine in (engine, replica_engine):
+            async with db_engine.begin() as con:
+                await con.run_sync(Base.metadata.create_all)
+                await con.execute(insert(User).values(id=1, is_banned=False))
+                await con.execute(insert(Topic).values(id=100, user_id=1))
+
+        session = get_session_factory(engine, [replica_engine])
+        self.topic_cache = TTLCache(maxsize=10, ttl=60)
+        self.user_cache = TTLCache(maxsize=10, ttl=60)
+        self.under_test: WarmupService = WarmupService(
+            db=DBRefs(engine, session, [replica_engine]),
+            topic_repo=TopicRepo(session, self.topic_cache),
+            message_repo=MessageRepo(session, MappingIndex(maxsize=10, max_age=60)),
+            reply_repo=ReplyRepo(session, MappingIndex(maxsize=10, max_age=60)),
+            user_repo=UserRepo(session, self.user_cache, set()),
+            user_log_repo=UserLogRepo(session),
+        )
+        yield
+        await engine.dispose()
+        await replica_engine.dispose()
+
+    @pytest.mark.asyncio
+    async def test_warm_up(self, mocker: MockerFixture):
+        # given
+        mocker.patch('feedbackbot.settings.DB_POOL_SIZE', 3)
+        stats_before = pool_stats(self.under_test._db.engine.pool)
+
+        # when
+        actual = await self.under_test.warm_up()
+
+        # then
+        assert actual > 0
+        # открыто заданное количество соединений, все они вернулись в пул
+        actual_stats = pool_stats(self.under_test._db.engine.pool)
+        assert actual_stats['checked_in'] == 3
+        assert actual_stats['checked_out'] == 0
+        assert actual_stats['checkouts'] - stats_before['checkouts'] >= 3
+        # пул реплики прогрет так же
+        assert pool_stats(self.under_test._db.replica_engines[0].pool)['checked_in'] == 3
+        # топик и его пользователь загружены в кэши
+        assert self.topic_cache.get(100) == TopicRef(100, 1)
+        assert self.user_cache.get(1) == UserState(1, False, None, None, None)
+
+
+class TestRetentionService:
+
+    @pytest.fixture(autouse=True)
+    def setup_method(self):
+        self.under_test: RetentionService = RetentionService(
+            message_repo=AsyncMock(**{'purge_messages.return_value': 3}),
+            reply_repo=AsyncMock(**{'purge_replies.return_value': 2}),
+            user_log_repo=AsyncMock(**{'purge_user_logs.return_value': 1}),
+            outbox_repo=AsyncMock(**{'purge_processed.return_value': 4}),
+            user_card_cache=TTLCache(maxsize=10, ttl=60),
+        )
+
+    @pytest.mark.asyncio
+    async def test_purge(self, mocker: MockerFixture):
+        # given
+        mocker.patch('feedbackbot.settings.RETENTION_MESSAGES_DAYS', 30)
+        mocker.patch('feedbackbot.settings.RETENTION_USER_LOGS_DAYS', 0)
+        mocker.patch('feedbackbot.settings.RETENTION_OUTBOX_DAYS', 0)
+        expected_older_than = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=30)
+
+        # when
+        actual = await self.under_test.purge()
+
+        # then
+        assert actual == {'messages': 3, 'replies': 2}
+        actual_older_than = self.under_test._message_repo.purge_messages.call_args[0][0]
+        assert abs(actual_older_than - expected_older_than) < datetime.timedelta(minutes=1)
+        self.under_test._reply_repo.purge_replies.assert_called_once_with(actual_older_than)
+        # история пользователей хранится всегда
+        self.under_test._user_log_repo.purge_user_logs.assert_not_called()
+        self.under_test._outbox_repo.purge_processed.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_purge_outbox(self, mocker: MockerFixture):
+        # given
+        mocker.patch('feedbackbot.settings.RETENTION_MESSAGES_DAYS', 0)
+        mocker.patch('feedbackbot.settings.RETENTION_USER_LOGS_DAYS', 0)
+        mocker.patch('feedbackbot.settings.RETENTION_OUTBOX_DAYS', 2)
+
+        # when
+        actual = await self.under_test.purge()
+
+        # then
+        # выполненные запросы очереди очищаются по умолчанию, даже если переписка хранится всегда
+        assert actual == {'outbox': 4}
+        assert self.under_test.enabled is True
+
+    def test_disabled(self, mocker: MockerFixture):
+        mocker.patch('feedbackbot.settings.RETENTION_MESSAGES_DAYS', 0)
+        mocker.patch('feedbackbot.settings.RETENTION_USER_LOGS_DAYS', 0)
+        mocker.patch('feedbackbot.settings.RETENTION_OUTBOX_DAYS', 0)
+
+        assert self.under_test.enabled is False
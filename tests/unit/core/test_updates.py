@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+from telegram import Chat
+
+from feedbackbot.core.updates import KeyedUpdateProcessor, get_update_key
+
+
+class TestKeyedUpdateProcessor:
+
+    @pytest.fixture(autouse=True)
+    def setup_method(self):
+        # обновление в тестах – пара (ключ, номер)
+        self.under_test: KeyedUpdateProcessor = KeyedUpdateProcessor(
+            concurrency=2, max_pending=10, get_key=lambda update: update[0],
+        )
+        self.events = []
+        self.running = 0
+        self.max_running = 0
+
+    async def handle(self, update):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        self.events.append(('start', update))
+        await asyncio.sleep(0.01)
+        self.events.append(('end', update))
+        self.running -= 1
+
+    async def process(self, *updates):
+        await asyncio.gather(*(
+            self.under_test.process_update(update, self.handle(update)) for update in updates
+        ))
+
+    @pytest.mark.asyncio
+    async def test_same_key_ordered(self):
+        # given/when
+        await self.process(('a', 1), ('a', 2), ('a', 3))
+
+        # then
+        # обновления одного ключа не пересекаются и идут в порядке получения
+        assert self.events == [
+            ('start', ('a', 1)), ('end', ('a', 1)),
+            ('start', ('a', 2)), ('end', ('a', 2)),
+            ('start', ('a', 3)), ('end', ('a', 3)),
+        ]
+        assert self.under_test.stats()['keys'] == 0
+
+    @pytest.mark.asyncio
+    async def test_different_keys_concurrent(self):
+        # given/when
+        await self.process(('a', 1), ('b', 1), ('c', 1), (None, 1))
+
+        # then
+        # разные ключи обрабатываются параллельно, но не больше concurrency одновременно
+        assert self.max_running == 2
+
+        actual = self.under_test.stats()
+        assert actual['processed'] == 4
+        assert actual['pending'] == 0
+        assert actual['in_progress'] == 0
+        assert actual['wait_max_ms'] > 0
+
+    @pytest.mark.asyncio
+    async def test_key_does_not_block_others(self):
+        # given/when
+        # поток обновлений одного пользователя не занимает все слоты
+        await self.process(('a', 1), ('a', 2), ('a', 3), ('b', 1))
+
+        # then
+        assert self.events.index(('start', ('b', 1))) < self.events.index(('start', ('a', 2)))
+
+
+class TestGetUpdateKey:
+
+    def test_private_chat(self, tg_update_factory, tg_message_factory):
+        # given
+        tg_update = tg_update_factory(message=tg_message_factory(chat=Chat(1, Chat.PRIVATE)))
+
+        # when/then
+        assert get_update_key(tg_update) == ('user', 1)
+
+    def test_topic(self, tg_update_factory, tg_message_factory):
+        # given
+        tg_message = tg_message_factory(chat=Chat(-1, Chat.SUPERGROUP), is_topic_message=True)
+        tg_update = tg_update_factory(message=tg_message)
+
+        # when/then
+        assert get_update_key(tg_update) == ('topic', -1, tg_message.message_thread_id)
@@ -0,0 +1,78 @@
+import datetime
+
+import pytest
+
+from feedbackbot.core.di import DIAsync
+from feedbackbot.outbox.models import OutboxEntry
+from feedbackbot.outbox.repos import OutboxRepo, get_outbox_wakeup
+
+
+class TestOutboxRepo:
+
+    @pytest.fixture(autouse=True)
+    def setup_method(self, session_wrapper):
+        self.under_test: OutboxRepo = DIAsync(
+            session=session_wrapper,
+        ).outbox_repo
+
+    @pytest.mark.asyncio
+    async def test_enqueue_idempotent(self, mocked_session):
+        # given
+        get_outbox_wakeup().clear()
+
+        # when
+        first = await self.under_test.enqueue('forward:1:1', 'forward_user_pm', {'message_ids': [1]}, 'user:1')
+        second = await self.under_test.enqueue('forward:1:1', 'forward_user_pm', {'message_ids': [1]}, 'user:1')
+
+        # then
+        # повторно полученное обновление не дублирует запрос
+        assert first.id == second.id
+        assert mocked_session.query(OutboxEntry).count() == 1
+        assert get_outbox_wakeup().is_set()
+
+    @pytest.mark.asyncio
+    async def test_get_due_queue_heads(self):
+        # given
+        first = await self.under_test.enqueue('a:1', 'kind', {}, 'user:1')
+        await self.under_test.enqueue('a:2', 'kind', {}, 'user:1')
+        other = await self.under_test.enqueue('b:1', 'kind', {}, 'user:2')
+
+        # when
+        actual = await self.under_test.get_due(10)
+
+        # then
+        # из очереди пользователя выбирается только первый запрос
+        assert [db_entry.id for db_entry in actual] == [first.id, other.id]
+
+    @pytest.mark.asyncio
+    async def test_get_due_rescheduled_blocks_queue(self):
+        # given
+        first = await self.under_test.enqueue('a:1', 'kind', {}, 'user:1')
+        await self.under_test.enqueue('a:2', 'kind', {}, 'user:1')
+        next_attempt_at = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(minutes=1)
+
+        # when
+        await self.under_test.reschedule(first.id, 1, next_attempt_at, 'error')
+        actual = await self.under_test.get_due(10)
+
+        # then
+        # следующий запрос не обгоняет ожидающий повтора
+        assert actual == []
+
+    @pytest.mark.asyncio
+    async def test_claim(self):
+        # given
+        first = await self.under_test.enqueue('a:1', 'kind', {}, 'user:1')
+        other = await self.under_test.enqueue('b:1', 'kind', {}, 'user:2')
+        lease = datetime.timedelta(minutes=1)
+
+        # when
+        actual = await self.under_test.claim([first.id, other.id], lease)
+        # другой диспетчер выбрал те же запросы
+        repeated = await self.under_test.claim([first.id, other.id], lease)
+
+        # then
+        assert [db_entry.id for db_entry in actual] == [first.id, other.id]
+        assert repeated == []
+        # захваченный запрос не выбирается до конца аренды
+        assert await self.under_test.get_due(10) == []
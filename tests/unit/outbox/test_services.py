@@ -0,0 +1,182 @@
+import asyncio
+from unittest.mock import AsyncMock
+
+import pytest
+import pytest_asyncio
+from pytest_mock import MockerFixture
+from sqlalchemy import select
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+from feedbackbot.core.db import Base, get_engine, get_session_factory
+from feedbackbot.core.di import DIAsync
+from feedbackbot.outbox.models import OutboxEntry
+from feedbackbot.outbox.services import OutboxDispatcher
+
+
+class TestOutboxDispatcher:
+
+    @pytest.fixture(autouse=True)
+    def setup_method(self, session_wrapper):
+        self.handler = AsyncMock()
+        self.under_test: OutboxDispatcher = DIAsync(
+            session=session_wrapper,
+            outbox_handlers={'kind': self.handler},
+        ).outbox_dispatcher
+
+    async def enqueue(self, key='a:1', ordering_key='user:1'):
+        return await self.under_test._outbox_repo.enqueue(key, 'kind', {'key': key}, ordering_key)
+
+    @pytest.mark.asyncio
+    async def test_dispatch_due(self, mocked_session):
+        # given
+        await self.enqueue('a:1', 'user:1')
+        await self.enqueue('b:1', 'user:2')
+
+        # when
+        actual = await self.under_test.dispatch_due()
+
+        # then
+        assert actual == 2
+        assert self.handler.call_count == 2
+        assert all(db_entry.delivered_at is not None for db_entry in mocked_session.query(OutboxEntry))
+        assert self.under_test.stats()['delivered'] == 2
+
+    @pytest.mark.asyncio
+    async def test_dispatch_delivered_not_repeated(self, mocked_session):
+        # given
+        await self.enqueue('a:1')
+        await self.under_test.dispatch_due()
+
+        # when
+        # Телеграм прислал обновление повторно уже после доставки
+        await self.enqueue('a:1')
+        actual = await self.under_test.dispatch_due()
+
+        # then
+        assert actual == 0
+        self.handler.assert_called_once()
+        assert mocked_session.query(OutboxEntry).count() == 1
+
+    @pytest.mark.asyncio
+    async def test_dispatch_non_retryable_dropped(self, mocked_session):
+        # given
+        await self.enqueue('a:1', 'user:1')
+        await self.enqueue('a:2', 'user:1')
+        self.handler.side_effect = [BadRequest('Message to forward not found'), None]
+
+        # when
+        await self.under_test.dispatch_due()
+
+        # then
+        # запрос отброшен сразу и не задерживает следующий запрос пользователя
+        assert self.under_test.stats()['dropped'] == 1
+        assert [db_entry.key for db_entry in await self.under_test._outbox_repo.get_due(10)] == ['a:2']
+
+    @pytest.mark.asyncio
+    async def test_dispatch_forbidden_dropped(self, mocked_session):
+        # given
+        db_entry = await self.enqueue()
+        self.handler.side_effect = Forbidden('Forbidden: bot was blocked by the user')
+
+        # when
+        await self.under_test.dispatch_due()
+
+        # then
+        actual = mocked_session.get(OutboxEntry, db_entry.id)
+        assert actual.dropped_at is not None
+        assert actual.attempts == 1
+
+    @pytest.mark.asyncio
+    async def test_dispatch_error_retried(self, mocked_session):
+        # given
+        db_entry = await self.enqueue()
+        self.handler.side_effect = NetworkError('error')
+
+        # when
+        await self.under_test.dispatch_due()
+
+        # then
+        # запрос остался в очереди и будет повторен позже
+        actual = mocked_session.get(OutboxEntry, db_entry.id)
+        assert actual.attempts == 1
+        assert 'error' in actual.last_error
+        assert await self.under_test._outbox_repo.get_due(10) == []
+
+    @pytest.mark.asyncio
+    async def test_dispatch_retry_after_not_counted(self, mocked_session):
+        # given
+        db_entry = await self.enqueue()
+        self.handler.side_effect = RetryAfter(5)
+
+        # when
+        await self.under_test.dispatch_due()
+
+        # then
+        assert mocked_session.get(OutboxEntry, db_entry.id).attempts == 0
+
+    @pytest.mark.asyncio
+    async def test_dispatch_dropped_after_max_attempts(self, mocker, mocked_session):
+        # given
+        mocker.patch('feedbackbot.settings.OUTBOX_MAX_ATTEMPTS', 1)
+        await self.enqueue()
+        self.handler.side_effect = NetworkError('error')
+
+        # when
+        await self.under_test.dispatch_due()
+
+        # then
+        assert mocked_session.query(OutboxEntry).one().dropped_at is not None
+        assert self.under_test.stats()['dropped'] == 1
+
+
+class TestOutboxDispatcherWithReplica:
+
+    @pytest_asyncio.fixture(autouse=True)
+    async def setup_method(self, tmp_path):
+        # реплика пуста, как реплика с большим отставанием
+        self.primary = get_engine(f'sqlite+aiosqlite:///{tmp_path / "primary.sqlite3"}')
+        self.replica = get_engine(f'sqlite+aiosqlite:///{tmp_path / "replica.sqlite3"}')
+        for engine in (self.primary, self.replica):
+            async with engine.begin() as con:
+                await con.run_sync(Base.metadata.create_all)
+
+        self.handled = asyncio.Event()
+
+        async def handler(payload):
+            self.handled.set()
+
+        self.di = DIAsync(
+            session=get_session_factory(self.primary, [self.replica]),
+            outbox_handlers={'kind': handler},
+        )
+        yield
+        await self.primary.dispose()
+        await self.replica.dispose()
+
+    @pytest.mark.asyncio
+    async def test_run_reads_primary(self, mocker: MockerFixture):
+        # given
+        mocker.patch('feedbackbot.settings.OUTBOX_POLL_INTERVAL', 0.01)
+        async with self.di.unit_of_work():
+            await self.di.outbox_repo.enqueue('a:1', 'kind', {}, 'user:1')
+
+        # when
+        task = asyncio.create_task(self.di.outbox_dispatcher.run())
+        try:
+            await asyncio.wait_for(self.handled.wait(), 1)
+
+            # then
+            # запрос выбран из основной БД и отмечен выполненным там же
+            await asyncio.wait_for(self._wait_delivered(), 1)
+        finally:
+            task.cancel()
+
+    async def _wait_delivered(self):
+        while True:
+            async with self.primary.connect() as con:
+                res = await con.execute(select(OutboxEntry.delivered_at))
+                if res.scalar_one() is not None:
+                    return
+
+            await asyncio.sleep(0.01)
+
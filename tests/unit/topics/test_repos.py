@@ -0,0 +1,143 @@
+import pytest
+
+from feedbackbot.core.db import UnitOfWork
+from feedbackbot.core.di import DIAsync
+from feedbackbot.topics.models import Message
+from feedbackbot.topics.repos import (
+    TopicRepo, MessageRepo, TopicRef, MessageRef, get_topic_cache, get_message_index
+)
+
+
+class TestTopicRepo:
+
+    @pytest.fixture(autouse=True)
+    def setup_method(self, session_wrapper):
+        self.under_test: TopicRepo = DIAsync(
+            session=session_wrapper,
+        ).topic_repo
+        self.unit_of_work = UnitOfWork(session_wrapper)
+
+    @pytest.mark.asyncio
+    async def test_get_topic_cached(self, mocked_session, db_topic_factory):
+        # given
+        db_topic = db_topic_factory()
+        mocked_session.flush()
+        stats_before = get_topic_cache().stats()
+
+        # when
+        actual_first = await self.under_test.get_topic(db_topic.id)
+        actual_second = await self.under_test.get_topic(db_topic.id)
+
+        # then
+        assert actual_first == actual_second == TopicRef(db_topic.id, db_topic.user_id)
+        # второе обращение обслужено кэшем
+        assert get_topic_cache().stats()['misses'] - stats_before['misses'] == 1
+        assert get_topic_cache().stats()['hits'] - stats_before['hits'] == 1
+
+    @pytest.mark.asyncio
+    async def test_get_topic_missing(self):
+        # given/when
+        actual = await self.under_test.get_topic(123)
+
+        # then
+        assert actual is None
+        assert len(get_topic_cache()) == 0
+
+    @pytest.mark.asyncio
+    async def test_get_topic_rollback(self, mocked_session, db_user_factory):
+        # given
+        db_user = db_user_factory()
+        mocked_session.flush()
+
+        # when
+        with pytest.raises(RuntimeError):
+            async with self.unit_of_work():
+                await self.under_test.create_topic(456, db_user.id)
+                actual = await self.under_test.get_topic(456)
+                raise RuntimeError
+
+        # then
+        # топик из откаченной транзакции не попадает в кэш
+        assert actual == TopicRef(456, db_user.id)
+        assert get_topic_cache().get(456) is None
+
+    @pytest.mark.asyncio
+    async def test_create_topic_invalidates_cache(self, mocked_session):
+        # given
+        get_topic_cache().set(123, TopicRef(123, 2))
+
+        # when
+        await self.under_test.create_topic(123, 1)
+
+        # then
+        assert await self.under_test.get_topic(123) == TopicRef(123, 1)
+
+
+class TestMessageRepo:
+
+    @pytest.fixture(autouse=True)
+    def setup_method(self, session_wrapper):
+        self.under_test: MessageRepo = DIAsync(
+            session=session_wrapper,
+        ).message_repo
+
+    @pytest.mark.asyncio
+    async def test_create_message_indexed(self, mocked_session, db_topic_factory):
+        # given
+        db_topic = db_topic_factory()
+        mocked_session.flush()
+        expected = MessageRef(1, 1001, db_topic.id)
+        stats_before = get_message_index().stats()
+
+        # when
+        await self.under_test.create_message(1, 1001, db_topic.id)
+
+        # then
+        # соответствие доступно в обе стороны без обращения к БД
+        assert await self.under_test.get_message(1) == expected
+        assert await self.under_test.get_message_by_bot_message_id(1001) == expected
+        assert get_message_index().stats()['hits'] - stats_before['hits'] == 2
+
+    @pytest.mark.asyncio
+    async def test_create_messages(self, mocked_session, db_topic_factory):
+        # given
+        db_topic = db_topic_factory()
+        mocked_session.flush()
+        expected = [MessageRef(1, 1001, db_topic.id), MessageRef(2, 1002, db_topic.id)]
+
+        # when
+        await self.under_test.create_messages(expected)
+
+        # then
+        # записи созданы одним запросом и попали в индекс
+        actual = mocked_session.query(Message).filter_by(topic_id=db_topic.id).order_by(Message.id).all()
+        assert [MessageRef.from_model(db_message) for db_message in actual] == expected
+        assert get_message_index().get_by_reverse(1002) == expected[1]
+
+    @pytest.mark.asyncio
+    async def test_get_message_not_indexed(self, mocked_session, db_message_factory):
+        # given
+        db_message = db_message_factory()
+        mocked_session.flush()
+        stats_before = get_message_index().stats()
+
+        # when
+        actual = await self.under_test.get_message_by_bot_message_id(db_message.bot_message_id)
+
+        # then
+        assert actual == MessageRef.from_model(db_message)
+        assert get_message_index().stats()['misses'] - stats_before['misses'] == 1
+
+    @pytest.mark.asyncio
+    async def test_delete_message_unindexed(self, mocked_session, db_topic_factory):
+        # given
+        db_topic = db_topic_factory()
+        mocked_session.flush()
+        await self.under_test.create_message(1, 1001, db_topic.id)
+
+        # when
+        await self.under_test.delete_message(1)
+
+        # then
+        assert len(get_message_index()) == 0
+        assert await self.under_test.get_message(1) is None
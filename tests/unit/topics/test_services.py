@@ -1,4 +1,4 @@
-from unittest.mock import AsyncMock
+from unittest.mock import AsyncMock, call
 
 import pytest
 from pytest_mock import MockerFixture
@@ -6,10 +6,14 @@ from telegram.error import BadRequest, Forbidden
 
 from feedbackbot import settings
 from feedbackbot.core.di import DIAsync
-from feedbackbot.topics.constants import UNSUPPORTED_CONTENT
+from feedbackbot.core.enums import OutboxKind, Priority
+from feedbackbot.topics.constants import UNSUPPORTED_CONTENT, DELETE_HISTORY_DONE
 from feedbackbot.topics.models import Topic
+from feedbackbot.topics.repos import TopicRef, MessageRef
+from feedbackbot.topics import services as topic_services
 from feedbackbot.topics.services import TopicService
 from feedbackbot.users.constants import USER_BLOCKED_BOT
+from tests.utils.db import async_iterator_mock
 
 
 class TestTopicService:
@@ -25,6 +29,8 @@ class TestTopicService:
             }),
             message_repo=AsyncMock(),
             reply_repo=AsyncMock(),
+            user_repo=AsyncMock(),
+            outbox_repo=AsyncMock(),
         ).topic_service
 
     @pytest.mark.asyncio
@@ -33,14 +39,14 @@ class TestTopicService:
         tg_user = tg_user_factory()
         db_user = db_user_factory(id=tg_user.id)
 
-        self.under_test._topic_repo.filter_topics.return_value = []
-
         # when
         actual_created, actual_topic = await self.under_test.get_or_create_user_topic(tg_user, db_user)
 
         # then
         assert actual_created is True
         assert isinstance(actual_topic, Topic)
+        # новый топик стал активным топиком пользователя
+        self.under_test._user_repo.update_user.assert_called_once_with(db_user.id, active_topic_id=actual_topic.id)
 
     @pytest.mark.asyncio
     async def test_get_or_create_user_topic_use_existing_tg_topic_present(self, bot, mocker: MockerFixture,
@@ -48,11 +54,11 @@ class TestTopicService:
                                                                           db_topic_factory):  # yapf: disable
         # given
         tg_user = tg_user_factory()
-        db_user = db_user_factory(id=tg_user.id)
         db_topic = db_topic_factory()
+        db_user = db_user_factory(id=tg_user.id, active_topic_id=db_topic.id)
 
         mocker.patch.object(bot, 'edit_forum_topic', side_effect=BadRequest('Topic_not_modified'))
-        self.under_test._topic_repo.filter_topics.return_value = [db_topic]
+        self.under_test._topic_repo.get_topic.return_value = db_topic
 
         # when
         actual_created, actual_topic = await self.under_test.get_or_create_user_topic(tg_user, db_user)
@@ -62,6 +68,8 @@ class TestTopicService:
         assert isinstance(actual_topic, Topic)
         # использован существующий топик
         assert actual_topic == db_topic
+        self.under_test._topic_repo.get_topic.assert_called_once_with(db_topic.id)
+        self.under_test._user_repo.update_user.assert_not_called()
 
     @pytest.mark.asyncio
     async def test_get_or_create_user_topic_use_existing_tg_topic_missing(self, bot, mocker: MockerFixture,
@@ -69,12 +77,12 @@ class TestTopicService:
                                                                           db_topic_factory):  # yapf: disable
         # given
         tg_user = tg_user_factory()
-        db_user = db_user_factory(id=tg_user.id)
         db_topic = db_topic_factory()
+        db_user = db_user_factory(id=tg_user.id, active_topic_id=db_topic.id)
 
         mocker.patch.object(bot, 'edit_forum_topic', side_effect=BadRequest('Topic_id_invalid'))
         bot.create_forum_topic = AsyncMock(return_value=AsyncMock(message_thread_id=123))
-        self.under_test._topic_repo.filter_topics.return_value = [db_topic]
+        self.under_test._topic_repo.get_topic.return_value = db_topic
 
         # when
         actual_created, actual_topic = await self.under_test.get_or_create_user_topic(tg_user, db_user)
@@ -84,93 +92,207 @@ class TestTopicService:
         assert isinstance(actual_topic, Topic)
 
     @pytest.mark.asyncio
-    async def test_forward_user_pm(self, mocker: MockerFixture, bot, tg_message_factory, db_topic_factory):
+    async def test_get_or_create_user_topic_name_cached(self, bot, mocker: MockerFixture, tg_user_factory,
+                                                        db_user_factory, db_topic_factory):  # yapf: disable
+        # given
+        tg_user = tg_user_factory()
+        db_topic = db_topic_factory()
+        db_user = db_user_factory(id=tg_user.id, active_topic_id=db_topic.id)
+
+        mocker.spy(bot, 'edit_forum_topic')
+        self.under_test._topic_repo.get_topic.return_value = db_topic
+
+        # when
+        await self.under_test.get_or_create_user_topic(tg_user, db_user)
+        actual_created, actual_topic = await self.under_test.get_or_create_user_topic(tg_user, db_user)
+
+        # then
+        assert actual_created is False
+        assert actual_topic == db_topic
+        # название не менялось, повторного запроса к Телеграм нет
+        bot.edit_forum_topic.assert_called_once()
+
+    @pytest.mark.asyncio
+    async def test_forward_user_pm(self, tg_message_factory, db_topic_factory):
         # given
-        tg_message = tg_message_factory(bot=bot)
+        tg_message = tg_message_factory()
         db_topic = db_topic_factory(id=tg_message.message_thread_id)
 
+        # when
+        await self.under_test.forward_user_pm([tg_message], db_topic)
+
+        # then
+        # пересылка только поставлена в очередь
+        self.under_test._outbox_repo.enqueue.assert_called_once_with(
+            key=f'forward:{tg_message.chat_id}:{tg_message.id}',
+            kind=OutboxKind.FORWARD_USER_PM.value,
+            payload={
+                'user_id': db_topic.user_id,
+                'from_chat_id': tg_message.chat_id,
+                'message_ids': [tg_message.id],
+                'topic_id': db_topic.id,
+            },
+            ordering_key=f'fwd:{db_topic.user_id}',
+        )
+
+    @pytest.mark.asyncio
+    async def test_deliver_user_pm(self, mocker: MockerFixture, bot):
+        # given
+        payload = {'user_id': 1, 'from_chat_id': 1, 'message_ids': [10], 'topic_id': 100}
+
         mocker.patch('feedbackbot.settings.CHAT_ID', self.CHAT_ID)
         mocker.spy(bot, 'forward_message')
 
         # when
-        await self.under_test.forward_user_pm(tg_message, db_topic)
+        actual = await self.under_test.deliver_user_pm(payload)
 
         # then
-        # проверяем, что сообщение было перенаправлено
-        assert bot.forward_message.call_count == 1
-        assert bot.forward_message.call_args_list[0][1]['chat_id'] == settings.CHAT_ID
-        assert bot.forward_message.call_args_list[0][1]['message_thread_id'] == db_topic.id
-        # проверяем, что сообщение было записано в базу данных
-        self.under_test._message_repo.create_message.assert_called_once_with(
-            tg_message.id, bot.forwarded_messages[0].id, db_topic
+        assert actual is True
+        bot.forward_message.assert_called_once_with(
+            chat_id=settings.CHAT_ID, from_chat_id=1, message_id=10, message_thread_id=100
+        )
+        self.under_test._message_repo.create_messages.assert_called_once_with(
+            [MessageRef(10, bot.forwarded_messages[0].id, 100)]
         )
 
     @pytest.mark.asyncio
-    async def test_reply_user_pm_text(self, mocker: MockerFixture, bot, tg_message_factory, db_topic_factory):
+    async def test_deliver_user_pm_media_group(self, mocker: MockerFixture, bot):
         # given
-        tg_message = tg_message_factory(bot=bot, text='Hello')
+        payload = {'user_id': 1, 'from_chat_id': 1, 'message_ids': [10, 11], 'topic_id': 100}
+
+        mocker.spy(bot, 'forward_message')
+
+        # when
+        await self.under_test.deliver_user_pm(payload, topic_id=200)
+
+        # then
+        # альбом пересылается одним запросом в указанный топик
+        bot.forward_message.assert_not_called()
+        self.under_test._message_repo.create_messages.assert_called_once_with([
+            MessageRef(10, bot.forwarded_messages[0].message_id, 200),
+            MessageRef(11, bot.forwarded_messages[1].message_id, 200),
+        ])
+
+    @pytest.mark.asyncio
+    async def test_deliver_user_pm_topic_deleted(self, mocker: MockerFixture, bot):
+        # given
+        payload = {'user_id': 1, 'from_chat_id': 1, 'message_ids': [10], 'topic_id': 100}
+
+        mocker.patch.object(bot, 'forward_message', side_effect=BadRequest('Message thread not found'))
+
+        # when
+        actual = await self.under_test.deliver_user_pm(payload)
+
+        # then
+        assert actual is False
+        self.under_test._message_repo.create_messages.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_reply_user_pm(self, tg_message_factory, db_topic_factory):
+        # given
+        tg_message = tg_message_factory(text='Hello')
         db_topic = db_topic_factory(id=tg_message.message_thread_id)
 
-        mocker.spy(bot, 'send_message')
-        mocker.spy(bot, 'send_photo')
-        self.under_test._topic_repo.get_topic.return_value = db_topic
+        self.under_test._topic_repo.get_topic.return_value = TopicRef(db_topic.id, db_topic.user.id)
 
         # when
-        await self.under_test.reply_user_pm(tg_message)
+        await self.under_test.reply_user_pm([tg_message])
 
         # then
-        bot.send_photo.assert_not_called()
-        bot.send_message.assert_called_once_with(chat_id=db_topic.user.id, text=tg_message.text)
-        self.under_test._reply_repo.create_reply.assert_called_once_with(
-            tg_message.id, bot_message_id=bot.sent_messages[0].id, topic=db_topic
+        # ответ только поставлен в очередь
+        self.under_test._outbox_repo.enqueue.assert_called_once_with(
+            key=f'reply:{tg_message.chat_id}:{tg_message.id}',
+            kind=OutboxKind.REPLY_USER_PM.value,
+            payload={
+                'user_id': db_topic.user.id,
+                'from_chat_id': tg_message.chat_id,
+                'message_ids': [tg_message.id],
+                'topic_id': db_topic.id,
+            },
+            ordering_key=f'reply:{db_topic.user.id}',
         )
 
     @pytest.mark.asyncio
-    async def test_reply_user_pm_photo(self, mocker: MockerFixture, bot, tg_photo_attachment, tg_message_factory,
-                                       db_topic_factory):  # yapf:disable
+    async def test_reply_user_pm_topic_not_found(self, tg_message_factory):
         # given
-        tg_message = tg_message_factory(bot=bot, photo=(tg_photo_attachment,))
-        db_topic = db_topic_factory(id=tg_message.message_thread_id)
+        self.under_test._topic_repo.get_topic.return_value = None
 
-        mocker.spy(bot, 'send_message')
-        mocker.spy(bot, 'send_photo')
-        self.under_test._topic_repo.get_topic.return_value = db_topic
+        # when
+        await self.under_test.reply_user_pm([tg_message_factory()])
+
+        # then
+        self.under_test._outbox_repo.enqueue.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_deliver_reply(self, mocker: MockerFixture, bot):
+        # given
+        payload = {'user_id': 1, 'from_chat_id': self.CHAT_ID, 'message_ids': [10], 'topic_id': 100}
+
+        mocker.spy(bot, 'copy_message')
+        request_priority_spy = mocker.spy(topic_services, 'request_priority')
 
         # when
-        await self.under_test.reply_user_pm(tg_message)
+        await self.under_test.deliver_reply(payload)
 
         # then
-        bot.send_message.assert_not_called()
-        bot.send_photo.assert_called_once()
-        self.under_test._reply_repo.create_reply.assert_called_once_with(
-            tg_message.id, bot_message_id=bot.sent_messages[0].id, topic=db_topic
+        bot.copy_message.assert_called_once_with(chat_id=1, from_chat_id=self.CHAT_ID, message_id=10)
+        # ответ оператора идет первым в общем лимите запросов
+        request_priority_spy.assert_called_once_with(Priority.OPERATOR_REPLY)
+        self.under_test._reply_repo.create_replies.assert_called_once_with(
+            [MessageRef(10, bot.copied_message_ids[0].message_id, 100)]
         )
 
     @pytest.mark.asyncio
-    async def test_reply_user_pm_unsupported_content(self, mocker: MockerFixture, bot, tg_message_factory):
+    async def test_deliver_reply_media_group(self, mocker: MockerFixture, bot):
         # given
-        tg_message = tg_message_factory(bot=bot, text=None, photo=None)
+        payload = {'user_id': 1, 'from_chat_id': self.CHAT_ID, 'message_ids': [10, 11], 'topic_id': 100}
+
+        mocker.spy(bot, 'copy_message')
+        mocker.spy(bot, 'copy_messages')
 
         # when
-        await self.under_test.reply_user_pm(tg_message)
+        await self.under_test.deliver_reply(payload)
+
+        # then
+        # альбом копируется одним запросом
+        bot.copy_message.assert_not_called()
+        bot.copy_messages.assert_called_once_with(chat_id=1, from_chat_id=self.CHAT_ID, message_ids=[10, 11])
+        self.under_test._reply_repo.create_replies.assert_called_once_with([
+            MessageRef(10, bot.copied_message_ids[0].message_id, 100),
+            MessageRef(11, bot.copied_message_ids[1].message_id, 100),
+        ])
+
+    @pytest.mark.asyncio
+    async def test_deliver_reply_unsupported_content(self, mocker: MockerFixture, bot):
+        # given
+        payload = {'user_id': 1, 'from_chat_id': self.CHAT_ID, 'message_ids': [10], 'topic_id': 100}
+
+        mocker.patch.object(bot, 'copy_message', side_effect=BadRequest("Message can't be copied"))
+
+        # when
+        await self.under_test.deliver_reply(payload)
 
         # then
         assert bot.sent_messages[0].text == UNSUPPORTED_CONTENT
+        self.under_test._reply_repo.create_replies.assert_not_called()
 
     @pytest.mark.asyncio
-    async def test_reply_user_pm_forbidden(self, mocker: MockerFixture, bot, tg_message_factory, db_topic_factory):
+    async def test_deliver_reply_forbidden(self, mocker: MockerFixture, bot):
         # given
-        tg_message = tg_message_factory(bot=bot, text='Hello')
-        db_topic = db_topic_factory(id=tg_message.message_thread_id)
+        payload = {'user_id': 1, 'from_chat_id': self.CHAT_ID, 'message_ids': [10], 'topic_id': 100}
 
-        mocker.patch.object(bot, 'send_message', side_effect=[Forbidden('Forbidden'), None])
-        self.under_test._topic_repo.get_topic.return_value = db_topic
+        mocker.patch.object(bot, 'copy_message', side_effect=Forbidden('Forbidden'))
+        mocker.spy(bot, 'send_message')
 
         # when
-        await self.under_test.reply_user_pm(tg_message)
+        await self.under_test.deliver_reply(payload)
 
         # then
-        assert bot.send_message.call_args_list[1][1]['text'] == USER_BLOCKED_BOT
+        # оператор получает ответ бота в том же топике
+        bot.send_message.assert_called_once_with(
+            chat_id=self.CHAT_ID, message_thread_id=100, reply_to_message_id=10, text=USER_BLOCKED_BOT
+        )
+        self.under_test._reply_repo.create_replies.assert_not_called()
 
     @pytest.mark.asyncio
     async def test_edit_operator_reply_text(self, mocker: MockerFixture, bot, tg_message_factory, db_topic_factory,
@@ -182,7 +304,7 @@ class TestTopicService:
 
         mocker.spy(bot, 'edit_message_text')
         mocker.spy(bot, 'edit_message_media')
-        self.under_test._topic_repo.get_topic.return_value = db_topic
+        self.under_test._topic_repo.get_topic.return_value = TopicRef(db_topic.id, db_topic.user.id)
         self.under_test._reply_repo.get_reply.return_value = db_reply
 
         # when
@@ -204,7 +326,7 @@ class TestTopicService:
 
         mocker.spy(bot, 'edit_message_text')
         mocker.spy(bot, 'edit_message_media')
-        self.under_test._topic_repo.get_topic.return_value = db_topic
+        self.under_test._topic_repo.get_topic.return_value = TopicRef(db_topic.id, db_topic.user.id)
         self.under_test._reply_repo.get_reply.return_value = db_reply
 
         # when
@@ -239,7 +361,7 @@ class TestTopicService:
         db_topic = db_topic_factory(id=tg_message.message_thread_id)
 
         mocker.spy(bot, 'edit_message_text')
-        self.under_test._topic_repo.get_topic.return_value = db_topic
+        self.under_test._topic_repo.get_topic.return_value = TopicRef(db_topic.id, db_topic.user.id)
         self.under_test._reply_repo.get_reply.return_value = None
 
         # when
@@ -258,7 +380,7 @@ class TestTopicService:
 
         mocker.spy(bot, 'edit_message_text')
         mocker.spy(bot, 'edit_message_media')
-        self.under_test._topic_repo.get_topic.return_value = db_topic
+        self.under_test._topic_repo.get_topic.return_value = TopicRef(db_topic.id, db_topic.user.id)
         self.under_test._reply_repo.get_reply.return_value = db_reply
 
         # when
@@ -278,7 +400,7 @@ class TestTopicService:
         db_reply = db_reply_factory(id=tg_message.id, topic_id=db_topic.id)
 
         mocker.patch.object(bot, 'edit_message_text', side_effect=[Forbidden('Forbidden'), None])
-        self.under_test._topic_repo.get_topic.return_value = db_topic
+        self.under_test._topic_repo.get_topic.return_value = TopicRef(db_topic.id, db_topic.user.id)
         self.under_test._reply_repo.get_reply.return_value = db_reply
 
         # when
@@ -295,7 +417,7 @@ class TestTopicService:
 
         mocker.spy(bot, 'delete_message')
         self.under_test._message_repo.get_message.return_value = db_message
-        self.under_test._topic_repo.get_topic.return_value = db_topic
+        self.under_test._topic_repo.get_topic.return_value = TopicRef(db_topic.id, db_topic.user.id)
 
         # when
         await self.under_test.delete_message_user(db_message.id)
@@ -326,8 +448,8 @@ class TestTopicService:
         db_topic = db_topic_factory(id=db_message.topic_id)
 
         mocker.spy(bot, 'delete_message')
-        self.under_test._message_repo.filter_messages.return_value = [db_message]
-        self.under_test._topic_repo.get_topic.return_value = db_topic
+        self.under_test._message_repo.get_message_by_bot_message_id.return_value = db_message
+        self.under_test._topic_repo.get_topic.return_value = TopicRef(db_topic.id, db_topic.user.id)
 
         # when
         await self.under_test.delete_message_operator(db_message.bot_message_id)
@@ -340,7 +462,7 @@ class TestTopicService:
     async def test_delete_message_operator_not_exists(self, mocker: MockerFixture, bot):
         # given
         mocker.spy(bot, 'delete_message')
-        self.under_test._message_repo.filter_messages.return_value = []
+        self.under_test._message_repo.get_message_by_bot_message_id.return_value = None
 
         # when
         await self.under_test.delete_message_operator(123)
@@ -357,7 +479,7 @@ class TestTopicService:
 
         mocker.spy(bot, 'delete_message')
         self.under_test._reply_repo.get_reply.return_value = db_reply
-        self.under_test._topic_repo.get_topic.return_value = db_topic
+        self.under_test._topic_repo.get_topic.return_value = TopicRef(db_topic.id, db_topic.user.id)
 
         # when
         await self.under_test.delete_reply(db_reply.id)
@@ -387,15 +509,95 @@ class TestTopicService:
         db_messages = [db_message_factory(topic_id=db_topic.id) for _ in range(3)]
         db_replies = [db_reply_factory(topic_id=db_topic.id) for _ in range(2)]
 
-        mocker.spy(bot, 'delete_message')
-        self.under_test._topic_repo.get_topic.return_value = db_topic
-        self.under_test._message_repo.filter_messages.return_value = db_messages
-        self.under_test._reply_repo.filter_replies.return_value = db_replies
+        mocker.spy(bot, 'delete_messages')
+        mocker.spy(bot, 'edit_message_text')
+        self.under_test._topic_repo.get_topic.return_value = TopicRef(db_topic.id, db_topic.user.id)
+        self.under_test._message_repo.iterate_message_batches = async_iterator_mock(db_messages)
+        self.under_test._reply_repo.iterate_reply_batches = async_iterator_mock(db_replies)
 
         # when
         await self.under_test.delete_history(db_topic.id)
 
         # then
-        assert bot.delete_message.call_count == len(db_messages) + len(db_replies)
-        assert self.under_test._message_repo.delete_message.call_count == len(db_messages)
-        assert self.under_test._reply_repo.delete_reply.call_count == len(db_replies)
+        # по одной пачке на порцию сообщений и ответов, только в чате пользователя
+        bot.delete_messages.assert_has_calls([
+            call(db_topic.user.id, [m.id for m in db_messages]),
+            call(db_topic.user.id, [r.bot_message_id for r in db_replies]),
+        ])
+        assert bot.delete_messages.call_count == 2
+        # итог выведен в сообщение о ходе удаления
+        assert bot.edit_message_text.call_args.kwargs['text'] == DELETE_HISTORY_DONE.format(deleted=5)
+        # записи удалены в БД одним запросом на таблицу
+        self.under_test._message_repo.delete_messages.assert_called_once()
+        assert list(self.under_test._message_repo.delete_messages.call_args[0][0]) == [m.id for m in db_messages]
+        self.under_test._reply_repo.delete_replies.assert_called_once()
+        assert list(self.under_test._reply_repo.delete_replies.call_args[0][0]) == [r.id for r in db_replies]
+
+    @pytest.mark.asyncio
+    async def test_delete_history_purge_group(self, mocker: MockerFixture, bot, db_topic_factory,
+                                              db_message_factory):  # yapf: disable
+        # given
+        db_topic = db_topic_factory()
+        db_messages = [db_message_factory(topic_id=db_topic.id) for _ in range(150)]
+
+        mocker.patch('feedbackbot.settings.CHAT_ID', self.CHAT_ID)
+        mocker.spy(bot, 'delete_messages')
+        self.under_test._topic_repo.get_topic.return_value = TopicRef(db_topic.id, db_topic.user.id)
+        self.under_test._message_repo.iterate_message_batches = async_iterator_mock(db_messages)
+        self.under_test._reply_repo.iterate_reply_batches = async_iterator_mock()
+
+        # when
+        await self.under_test.delete_history(db_topic.id, purge_group=True)
+
+        # then
+        # не больше 100 сообщений в пачке, в чате пользователя и в чате операторов
+        bot.delete_messages.assert_has_calls([
+            call(db_topic.user.id, [m.id for m in db_messages[:100]]),
+            call(db_topic.user.id, [m.id for m in db_messages[100:]]),
+            call(self.CHAT_ID, [m.bot_message_id for m in db_messages[:100]]),
+            call(self.CHAT_ID, [m.bot_message_id for m in db_messages[100:]]),
+        ], any_order=True)
+        assert bot.delete_messages.call_count == 4
+
+    @pytest.mark.asyncio
+    async def test_delete_history_user_blocked_bot(self, mocker: MockerFixture, bot, db_topic_factory,
+                                                   db_message_factory):  # yapf: disable
+        # given
+        db_topic = db_topic_factory()
+        db_messages = [db_message_factory(topic_id=db_topic.id) for _ in range(2)]
+
+        mocker.patch('feedbackbot.settings.CHAT_ID', self.CHAT_ID)
+        delete_messages = bot.delete_messages
+
+        async def delete_messages_blocked(chat_id, message_ids, *args, **kwargs):
+            if chat_id == db_topic.user.id:
+                raise Forbidden('Forbidden: bot was blocked by the user')
+            return await delete_messages(chat_id, message_ids, *args, **kwargs)
+
+        mocker.patch.object(bot, 'delete_messages', side_effect=delete_messages_blocked)
+        mocker.spy(bot, 'edit_message_text')
+        self.under_test._topic_repo.get_topic.return_value = TopicRef(db_topic.id, db_topic.user.id)
+        self.under_test._message_repo.iterate_message_batches = async_iterator_mock(db_messages)
+        self.under_test._reply_repo.iterate_reply_batches = async_iterator_mock()
+
+        # when
+        await self.under_test.delete_history(db_topic.id, purge_group=True)
+
+        # then
+        # удаление в чате операторов и в БД продолжается
+        bot.delete_messages.assert_any_call(self.CHAT_ID, [m.bot_message_id for m in db_messages])
+        self.under_test._message_repo.delete_messages.assert_called_once()
+        assert bot.edit_message_text.call_args.kwargs['text'] == DELETE_HISTORY_DONE.format(deleted=2)
+
+    @pytest.mark.asyncio
+    async def test_delete_history_topic_not_found(self, mocker: MockerFixture, bot):
+        # given
+        mocker.spy(bot, 'send_message')
+        self.under_test._topic_repo.get_topic.return_value = None
+
+        # when
+        await self.under_test.delete_history(123)
+
+        # then
+        bot.send_message.assert_not_called()
+        self.under_test._message_repo.delete_messages.assert_not_called()
@@ -0,0 +1,101 @@
+import pytest
+
+from feedbackbot.core.db import UnitOfWork
+from feedbackbot.core.di import DIAsync
+from feedbackbot.users.enums import UserLogField
+from feedbackbot.users.repos import UserRepo, UserLogRepo, UserState, get_user_cache, get_banned_user_ids
+
+
+class TestUserRepo:
+
+    @pytest.fixture(autouse=True)
+    def setup_method(self, session_wrapper):
+        self.under_test: UserRepo = DIAsync(
+            session=session_wrapper,
+        ).user_repo
+        self.unit_of_work = UnitOfWork(session_wrapper)
+
+    @pytest.mark.asyncio
+    async def test_get_or_create_user_cached(self, mocked_session, db_user_factory):
+        # given
+        db_user = db_user_factory()
+        mocked_session.flush()
+        stats_before = get_user_cache().stats()
+
+        # when
+        actual_first = await self.under_test.get_or_create_user(db_user.id)
+        actual_second = await self.under_test.get_or_create_user(db_user.id)
+
+        # then
+        assert actual_first == actual_second == UserState.from_user(db_user)
+        assert get_user_cache().stats()['hits'] - stats_before['hits'] == 1
+
+    @pytest.mark.asyncio
+    async def test_update_user_ban(self, mocked_session, db_user_factory):
+        # given
+        db_user = db_user_factory()
+        mocked_session.flush()
+
+        # when
+        await self.under_test.update_user(db_user.id, is_banned=True)
+
+        # then
+        assert self.under_test.is_banned(db_user.id)
+        assert get_user_cache().get(db_user.id).is_banned
+
+    @pytest.mark.asyncio
+    async def test_update_user_rollback(self, mocked_session, db_user_factory):
+        # given
+        db_user = db_user_factory()
+        mocked_session.flush()
+
+        # when
+        with pytest.raises(RuntimeError):
+            async with self.unit_of_work():
+                await self.under_test.update_user(db_user.id, is_banned=True)
+                raise RuntimeError
+
+        # then
+        # откаченная запись не попадает в кэши
+        assert not self.under_test.is_banned(db_user.id)
+        assert get_user_cache().get(db_user.id) is None
+
+    @pytest.mark.asyncio
+    async def test_load_banned_users(self, mocked_session, db_user_factory):
+        # given
+        db_banned_user = db_user_factory(is_banned=True)
+        db_user_factory(is_banned=False)
+        mocked_session.flush()
+        get_banned_user_ids().add(-1)
+
+        # when
+        actual = await self.under_test.load_banned_users()
+
+        # then
+        # пользователь 3 забанен в начальных данных (см. sqlalchemy_mock_config)
+        assert actual == 2
+        assert get_banned_user_ids() == {3, db_banned_user.id}
+
+
+class TestUserLogRepo:
+
+    @pytest.fixture(autouse=True)
+    def setup_method(self, session_wrapper):
+        self.under_test: UserLogRepo = DIAsync(
+            session=session_wrapper,
+        ).user_log_repo
+
+    @pytest.mark.asyncio
+    async def test_has_user_logs(self, mocked_session, db_user_factory, db_user_log_factory):
+        # given
+        db_user = db_user_factory()
+        db_user_log_factory(user=db_user, field=UserLogField.USERNAME.value)
+        mocked_session.flush()
+
+        # when
+        actual_username = await self.under_test.has_user_logs(db_user.id, UserLogField.USERNAME.value)
+        actual_is_banned = await self.under_test.has_user_logs(db_user.id, UserLogField.IS_BANNED.value)
+
+        # then
+        assert actual_username is True
+        assert actual_is_banned is False
@@ -1,12 +1,16 @@
-from unittest.mock import AsyncMock, call
+from unittest.mock import AsyncMock, ANY, call
 
 import pytest
 from pytest_mock import MockerFixture
 from telegram import User as TGUser, Update
 
+from feedbackbot.core.cache import TTLCache
+from feedbackbot.core.db import UnitOfWork
+from feedbackbot.topics.repos import TopicRef
 from feedbackbot.users.services import UserService
 from feedbackbot.users.models import User as DBUser
 from feedbackbot.users.enums import UserLogField, UserLogValue
+from tests.utils.db import async_iterator_mock
 
 
 class TestUserService:
@@ -15,71 +19,119 @@ class TestUserService:
     def setup_method(self, session_wrapper, bot, db_user_factory):
         self.under_test: UserService = UserService(
             bot=bot,
+            unit_of_work=UnitOfWork(session_wrapper),
             topic_repo=AsyncMock(),
             user_repo=AsyncMock(**{
-                'get.return_value': db_user_factory(),
-                'create_user.return_value': db_user_factory()
+                'get_or_create_user.return_value': db_user_factory(),
             }),
             user_log_repo=AsyncMock(),
+            user_card_cache=TTLCache(maxsize=10, ttl=60),
         )
 
     @pytest.mark.asyncio
-    async def test_get_or_create_user_existing(self, tg_user_factory, db_user_factory):
+    async def test_get_or_create_user(self, tg_user_factory, db_user_factory):
         # given
         tg_user = tg_user_factory()
         db_user = db_user_factory(id=tg_user.id)
-        self.under_test._user_repo.get.return_value = db_user
+        self.under_test._user_repo.get_or_create_user.return_value = db_user
 
         # when
         actual_user = await self.under_test.get_or_create_user(tg_user)
 
         # then
         assert actual_user == db_user
-        self.under_test._user_repo.create_user.assert_not_called()
+        self.under_test._user_repo.get_or_create_user.assert_called_once_with(tg_user.id)
 
     @pytest.mark.asyncio
-    async def test_get_or_create_user_new(self, tg_user_factory):
+    async def test_set_user_ban_by_topic(self, db_topic_factory):
         # given
-        tg_user = tg_user_factory()
-        self.under_test._user_repo.get.return_value = None
+        db_topic = db_topic_factory()
+        self.under_test._topic_repo.get_topic.return_value = db_topic
+        self.under_test._user_repo.get_user_state.return_value = db_topic.user
 
         # when
-        actual_user = await self.under_test.get_or_create_user(tg_user)
+        await self.under_test.set_user_ban_by_topic(db_topic.id, True)
 
         # then
-        self.under_test._user_repo.create_user.assert_called_once_with(tg_user.id)
-        assert actual_user == self.under_test._user_repo.create_user.return_value
+        self.under_test._user_repo.update_user.assert_called_once_with(db_topic.user_id, is_banned=True)
+        self.under_test._user_log_repo.create_user_log.assert_called_once()
 
     @pytest.mark.asyncio
-    async def test_set_user_ban_by_topic(self, db_topic_factory):
+    async def test_set_user_ban_by_topic_first_ban_not_notified(self, bot, mocker: MockerFixture, db_topic_factory):
         # given
         db_topic = db_topic_factory()
         self.under_test._topic_repo.get_topic.return_value = db_topic
+        self.under_test._user_repo.get_user_state.return_value = db_topic.user
+        self.under_test._user_log_repo.has_user_logs.return_value = False
+        mocker.spy(bot, 'send_message')
 
         # when
         await self.under_test.set_user_ban_by_topic(db_topic.id, True)
 
         # then
-        self.under_test._user_repo.update_user.assert_called_once_with(db_topic.user_id, is_banned=True)
+        # у поля еще нет истории: изменение записано без оповещения
         self.under_test._user_log_repo.create_user_log.assert_called_once()
+        bot.send_message.assert_not_called()
 
     @pytest.mark.asyncio
-    async def test_log_user_changes(self, tg_user_factory, db_topic_factory):
+    async def test_set_user_ban_by_topic_notified(self, bot, mocker: MockerFixture, db_topic_factory):
+        # given
+        db_topic = db_topic_factory()
+        self.under_test._topic_repo.get_topic.return_value = db_topic
+        self.under_test._user_repo.get_user_state.return_value = db_topic.user
+        self.under_test._user_log_repo.has_user_logs.return_value = True
+        mocker.spy(bot, 'send_message')
+
+        # when
+        await self.under_test.set_user_ban_by_topic(db_topic.id, True)
+
+        # then
+        expected_change = f'`{UserLogValue.FALSE.value}` -> `{UserLogValue.TRUE.value}`'
+        assert expected_change in bot.send_message.call_args.kwargs['text']
+
+    @pytest.mark.asyncio
+    async def test_log_user_changes(self, tg_user_factory, db_user_factory, db_topic_factory):
         # given
         tg_user = tg_user_factory()
+        db_user = db_user_factory(id=tg_user.id)
         db_topic = db_topic_factory()
+        expected_username = tg_user.username or UserLogValue.EMPTY.value
 
         # when
-        await self.under_test.log_user_changes(tg_user, db_topic.id)
+        await self.under_test.log_user_changes(tg_user, db_user, db_topic.id)
 
         # then
         self.under_test._user_log_repo.create_user_log.assert_any_call(
-            tg_user.id, field=UserLogField.FULL_NAME.value, value=tg_user.full_name
+            tg_user.id, field=UserLogField.FULL_NAME.value, value=tg_user.full_name, timestamp=ANY
         )
         self.under_test._user_log_repo.create_user_log.assert_any_call(
-            tg_user.id, field=UserLogField.USERNAME.value, value=tg_user.username or UserLogValue.EMPTY.value
+            tg_user.id, field=UserLogField.USERNAME.value, value=expected_username, timestamp=ANY
+        )
+        # текущее состояние пользователя обновлено
+        self.under_test._user_repo.update_user.assert_called_once_with(
+            tg_user.id, full_name=tg_user.full_name, username=expected_username
         )
 
+    @pytest.mark.asyncio
+    async def test_log_user_changes_unchanged(self, mocker: MockerFixture, tg_user_factory, db_user_factory,
+                                              db_topic_factory):
+        # given
+        tg_user = tg_user_factory()
+        db_user = db_user_factory(
+            id=tg_user.id, full_name=tg_user.full_name, username=tg_user.username or UserLogValue.EMPTY.value
+        )
+        db_topic = db_topic_factory()
+
+        mocker.spy(self.under_test._bot, 'send_message')
+
+        # when
+        await self.under_test.log_user_changes(tg_user, db_user, db_topic.id)
+
+        # then
+        self.under_test._user_log_repo.create_user_log.assert_not_called()
+        self.under_test._user_repo.update_user.assert_not_called()
+        self.under_test._bot.send_message.assert_not_called()
+
     @pytest.mark.asyncio
     async def test_send_userlog_message(self, mocker: MockerFixture, tg_update_factory, db_user_factory,
                                         db_user_log_factory, db_topic_factory, ):
@@ -98,10 +150,40 @@ class TestUserService:
 
         mocker.spy(self.under_test._bot, 'send_message')
         self.under_test._topic_repo.get_topic.return_value = db_topic
-        self.under_test._user_log_repo.filter_user_logs.return_value = db_logs
+        self.under_test._user_log_repo.iterate_user_logs = async_iterator_mock(*db_logs)
+
+        # when
+        await self.under_test.send_userlog_message(db_topic.id)
+
+        # then
+        self.under_test._bot.send_message.assert_called_once()
+
+    @pytest.mark.asyncio
+    async def test_send_userlog_message_cached(self, mocker: MockerFixture, db_user_factory, db_user_log_factory,
+                                               db_topic_factory):  # yapf: disable
+        # given
+        db_user = db_user_factory()
+        db_topic = db_topic_factory(user=db_user)
+        db_logs = [
+            db_user_log_factory(user=db_user, field='full_name', value='Вася Пупкин'),
+            db_user_log_factory(user=db_user, field='username', value='abc'),
+        ]
+
+        mocker.spy(self.under_test._bot, 'send_message')
+        self.under_test._topic_repo.get_topic.return_value = TopicRef(db_topic.id, db_user.id)
+        self.under_test._user_log_repo.iterate_user_logs = async_iterator_mock(*db_logs)
 
         # when
         await self.under_test.send_userlog_message(db_topic.id)
+        await self.under_test._log_user_detail_change(
+            db_user.id, 'abc', 'def', UserLogField.USERNAME.value, db_topic.id
+        )
+        await self.under_test.send_userlog_message(db_topic.id)
 
         # then
-        self.under_test._bot.send_message.assert_called_once()
\ No newline at end of file
+        # лог прочитан один раз, новая запись дописана в закэшированную карточку
+        self.under_test._user_log_repo.iterate_user_logs.assert_called_once()
+        actual_text = self.under_test._bot.send_message.call_args.kwargs['text']
+        assert '[@abc]' in actual_text
+        assert 'изменено на `def`' in actual_text
+
@@ -2,6 +2,17 @@ import random
 from unittest.mock import MagicMock
 
 
+def async_iterator_mock(*items):
+    """
+    Мок метода, возвращающего асинхронный итератор по items.
+    """
+    async def _iterate(*args, **kwargs):
+        for item in items:
+            yield item
+
+    return MagicMock(side_effect=_iterate)
+
+
 class AsyncContextManagerWrapper:
     def __init__(self, for_obj):
         self._obj = for_obj
@@ -35,4 +46,10 @@ class AsyncSessionMock:
     async def commit(self, *args, **kwargs):
         return self._session.commit(*args, **kwargs)
 
+    def get_bind(self, *args, **kwargs):
+        return self._session.get_bind(*args, **kwargs)
+
+    async def flush(self, *args, **kwargs):
+        return self._session.flush(*args, **kwargs)
+
     begin = MagicMock()